@@ -22,6 +22,9 @@
 """
 
 import abc
+import bisect
+import collections
+import functools
 import hashlib
 import json
 import os
@@ -36,6 +39,7 @@ from oslo_utils import units
 import six
 
 from cinder.backup import driver
+from cinder import coordination
 from cinder import exception
 from cinder.i18n import _
 from cinder import objects
@@ -52,13 +56,191 @@ chunkedbackup_service_opts = [
                default='zlib',
                choices=['none', 'off', 'no',
                         'zlib', 'gzip',
-                        'bz2', 'bzip2'],
-               help='Compression algorithm (None to disable)'),
+                        'bz2', 'bzip2',
+                        'zstd', 'lz4'],
+               help='Compression algorithm (None to disable). zstd and lz4 '
+                    'require the zstandard and lz4 Python packages.'),
+    cfg.IntOpt('backup_compression_level',
+               help='Compression level used with the backup compression '
+                    'algorithm. Valid values depend on the algorithm: 0-9 '
+                    'for zlib, 1-9 for bz2, 1-22 for zstd and 0-16 for '
+                    'lz4. Defaults to the default level of the algorithm.'),
+    cfg.BoolOpt('backup_adaptive_compression',
+                default=False,
+                help='Compress a small sample of every backup chunk first '
+                     'and store the chunk uncompressed, without compressing '
+                     'all of it, when the sample does not compress well.'),
+    cfg.BoolOpt('backup_detect_zero_blocks',
+                default=False,
+                help='Do not store blocks of the volume that only hold '
+                     'zeroes in the backup repository, only record them in '
+                     'the backup metadata, and deallocate them on restore '
+                     'when the destination supports it. Backups with zero '
+                     'blocks cannot be restored by releases that predate '
+                     'this option, so only enable it once all the '
+                     'cinder-backup services have been upgraded.'),
+    cfg.BoolOpt('backup_deduplication',
+                default=False,
+                help='Store backup chunks in a container shared by all '
+                     'backups and keyed by the SHA-256 of their content, so '
+                     'that chunks with the same data are only stored once. '
+                     'Stored chunks are reference counted in the database '
+                     'and deleted with the last backup that uses them.'),
+    cfg.StrOpt('backup_deduplication_container',
+               default='cinder-backup-dedup',
+               help='Container holding the deduplicated backup chunks when '
+                    'backup_deduplication is enabled.'),
+    cfg.IntOpt('backup_object_writers',
+               default=1,
+               min=1,
+               help='Number of backup chunks that are compressed and written '
+                    'to the backup repository concurrently. The object '
+                    'writers of the configured backup driver must be safe '
+                    'to use from several native threads when this is '
+                    'greater than 1.'),
+    cfg.IntOpt('backup_object_readers',
+               default=1,
+               min=1,
+               help='Number of backup objects that are read from the backup '
+                    'repository and decompressed concurrently during a '
+                    'restore. The object readers of the configured backup '
+                    'driver must be safe to use from several native threads '
+                    'when this is greater than 1.'),
+    cfg.IntOpt('backup_pipeline_max_memory_mb',
+               default=0,
+               min=0,
+               help='Maximum amount of volume data, in MiB, that a single '
+                    'backup or restore keeps in memory while it is waiting '
+                    'to be compressed and written or to be written to the '
+                    'volume. 0 allows two chunks per object writer or '
+                    'reader.'),
 ]
 
 CONF = cfg.CONF
 CONF.register_opts(chunkedbackup_service_opts)
 
+# Size of the sample used to find out whether a chunk is worth compressing
+# with backup_adaptive_compression, and the compressed to original size ratio
+# above which it isn't.
+_COMPRESSION_SAMPLE_BYTES = 64 * units.Ki
+_COMPRESSION_MIN_RATIO = 0.9
+
+# Restored data is flushed and synced to the volume every this many bytes
+# instead of after every object.
+_RESTORE_SYNC_INTERVAL_BYTES = 256 * units.Mi
+
+
+class _ChunkWriterPool(object):
+    """Bounded pool of greenthreads writing backup chunks.
+
+    At most ``max_pending`` chunks are queued or being written at any given
+    time, so callers block in :meth:`spawn` once the memory budget is used.
+    The first failure is re-raised by :meth:`spawn` or :meth:`wait`, and
+    chunks that have not started yet are skipped after a failure.
+    """
+
+    def __init__(self, workers, max_pending):
+        self._pool = eventlet.GreenPool(workers)
+        self._pending = eventlet.semaphore.Semaphore(max(workers,
+                                                         max_pending))
+        self._exc_info = None
+        self._aborted = False
+
+    def _run(self, func, args):
+        try:
+            if self._exc_info is None and not self._aborted:
+                func(*args)
+        except Exception:
+            if self._exc_info is None:
+                self._exc_info = sys.exc_info()
+        finally:
+            self._pending.release()
+
+    def check(self):
+        if self._exc_info is not None:
+            six.reraise(*self._exc_info)
+
+    def spawn(self, func, *args):
+        self.check()
+        self._pending.acquire()
+        self._pool.spawn_n(self._run, func, args)
+
+    def wait(self):
+        self._pool.waitall()
+        self.check()
+
+    def abort(self):
+        """Skip the chunks not started yet and wait for the running ones."""
+        self._aborted = True
+        self._pool.waitall()
+
+
+class _Codec(object):
+    """Compression library wrapper exposing compress() and decompress()."""
+
+    def __init__(self, name, compress, decompress):
+        self.name = name
+        self.compress = compress
+        self.decompress = decompress
+
+    def __repr__(self):
+        return '<%s codec>' % self.name
+
+
+def _zstd_compress(level, data):
+    import zstandard
+    # Compressor objects can't be shared between native threads.
+    return zstandard.ZstdCompressor(level=level).compress(data)
+
+
+def _zstd_decompress(data):
+    import zstandard
+    return zstandard.ZstdDecompressor().decompress(data)
+
+
+class _RestoreExtentMap(object):
+    """Map of volume ranges to the backup object holding their newest data.
+
+    Extents are added from the oldest backup to the newest one, and each
+    added extent hides whatever older data it overlaps, so once the whole
+    chain has been added the map only references the data that has to end
+    up on the volume.
+    """
+
+    def __init__(self):
+        self._starts = []
+        # Sorted, non overlapping (start, end, source, source_offset) tuples.
+        self._extents = []
+
+    def add(self, start, length, source):
+        end = start + length
+        first = bisect.bisect_right(self._starts, start)
+        if first and self._extents[first - 1][1] > start:
+            first -= 1
+        last = first
+        while (last < len(self._extents) and
+               self._extents[last][0] < end):
+            last += 1
+
+        pieces = []
+        if first < last:
+            old_start, old_end, old_source, old_offset = self._extents[first]
+            if old_start < start:
+                pieces.append((old_start, start, old_source, old_offset))
+        pieces.append((start, end, source, 0))
+        if first < last:
+            old_start, old_end, old_source, old_offset = \
+                self._extents[last - 1]
+            if old_end > end:
+                pieces.append((end, old_end, old_source,
+                               old_offset + end - old_start))
+
+        self._extents[first:last] = pieces
+        self._starts[first:last] = [piece[0] for piece in pieces]
+
+    def __iter__(self):
+        return iter(self._extents)
+
 
 # Object writer and reader returned by inheriting classes must not have any
 # logging calls, as well as the compression libraries, as eventlet has a bug
@@ -79,18 +261,50 @@ class ChunkedBackupDriver(driver.BackupDriver):
     """
 
     DRIVER_VERSION = '1.0.0'
-    DRIVER_VERSION_MAPPING = {'1.0.0': '_restore_v1'}
-
-    def _get_compressor(self, algorithm):
+    # Version of backups that have zero_extents in their metadata, which
+    # older releases would silently skip on restore.
+    SPARSE_DRIVER_VERSION = '1.1.0'
+    DRIVER_VERSION_MAPPING = {'1.0.0': '_restore_v1',
+                              '1.1.0': '_restore_v1'}
+    # Backup versions whose objects can be merged into one extent map when
+    # restoring a chain of incremental backups.
+    EXTENT_MAP_VERSIONS = ('1.0.0', '1.1.0')
+
+    def _get_compressor(self, algorithm, level=None):
         try:
-            if algorithm.lower() in ('none', 'off', 'no'):
+            algorithm = algorithm.lower()
+            if algorithm in ('none', 'off', 'no'):
                 return None
-            if algorithm.lower() in ('zlib', 'gzip'):
+            if algorithm in ('zlib', 'gzip'):
                 import zlib as compressor
                 result = compressor
-            elif algorithm.lower() in ('bz2', 'bzip2'):
+                if level is not None:
+                    result = _Codec(algorithm,
+                                    lambda data: compressor.compress(data,
+                                                                     level),
+                                    compressor.decompress)
+            elif algorithm in ('bz2', 'bzip2'):
                 import bz2 as compressor
                 result = compressor
+                if level is not None:
+                    result = _Codec(algorithm,
+                                    lambda data: compressor.compress(data,
+                                                                     level),
+                                    compressor.decompress)
+            elif algorithm == 'zstd':
+                import zstandard  # noqa
+                result = _Codec(algorithm,
+                                functools.partial(
+                                    _zstd_compress,
+                                    3 if level is None else level),
+                                _zstd_decompress)
+            elif algorithm == 'lz4':
+                import lz4.frame as compressor
+                result = _Codec(algorithm,
+                                functools.partial(
+                                    compressor.compress,
+                                    compression_level=level or 0),
+                                compressor.decompress)
             else:
                 result = None
             if result:
@@ -117,8 +331,23 @@ class ChunkedBackupDriver(driver.BackupDriver):
         self.az = CONF.storage_availability_zone
         self.backup_compression_algorithm = CONF.backup_compression_algorithm
         self.compressor = \
-            self._get_compressor(CONF.backup_compression_algorithm)
+            self._get_compressor(CONF.backup_compression_algorithm,
+                                 CONF.backup_compression_level)
+        self.adaptive_compression = CONF.backup_adaptive_compression
         self.support_force_delete = True
+        self.detect_zero_blocks = CONF.backup_detect_zero_blocks
+        self.deduplication = CONF.backup_deduplication
+        self.dedup_container = CONF.backup_deduplication_container
+        self.object_writers = CONF.backup_object_writers
+        self.object_readers = CONF.backup_object_readers
+        max_memory = CONF.backup_pipeline_max_memory_mb * units.Mi
+        if max_memory:
+            self.max_pending_chunks = max(
+                1, max_memory // max(1, self.chunk_size_bytes))
+            self.max_prefetched_objects = self.max_pending_chunks
+        else:
+            self.max_pending_chunks = 2 * self.object_writers
+            self.max_prefetched_objects = 2 * self.object_readers
 
         if sys.platform == 'win32' and self.chunk_size_bytes % 4096:
             # The chunk size must be a multiple of the sector size. In order
@@ -224,6 +453,8 @@ class ChunkedBackupDriver(driver.BackupDriver):
 
         backup.save()
         self.put_container(backup.container)
+        if self.deduplication:
+            self.put_container(self.dedup_container)
         return backup.container
 
     def _generate_object_names(self, backup):
@@ -243,13 +474,16 @@ class ChunkedBackupDriver(driver.BackupDriver):
         return filename
 
     def _write_metadata(self, backup, volume_id, container, object_list,
-                        volume_meta, extra_metadata=None):
+                        volume_meta, extra_metadata=None, zero_extents=None):
         filename = self._metadata_filename(backup)
         LOG.debug('_write_metadata started, container name: %(container)s,'
                   ' metadata filename: %(filename)s.',
                   {'container': container, 'filename': filename})
         metadata = {}
-        metadata['version'] = self.DRIVER_VERSION
+        if zero_extents:
+            metadata['version'] = self.SPARSE_DRIVER_VERSION
+        else:
+            metadata['version'] = self.DRIVER_VERSION
         metadata['backup_id'] = backup['id']
         metadata['volume_id'] = volume_id
         metadata['backup_name'] = backup['display_name']
@@ -260,6 +494,8 @@ class ChunkedBackupDriver(driver.BackupDriver):
         metadata['volume_meta'] = volume_meta
         if extra_metadata:
             metadata['extra_metadata'] = extra_metadata
+        if zero_extents:
+            metadata['zero_extents'] = zero_extents
         metadata_json = json.dumps(metadata, sort_keys=True, indent=2)
         if six.PY3:
             metadata_json = metadata_json.encode('utf-8')
@@ -353,8 +589,17 @@ class ChunkedBackupDriver(driver.BackupDriver):
                 volume_size_bytes)
 
     def _backup_chunk(self, backup, container, data, data_offset,
-                      object_meta, extra_metadata):
-        """Backup data chunk based on the object metadata and offset."""
+                      object_meta, extra_metadata, writer_pool=None,
+                      dedup_key=None):
+        """Backup data chunk based on the object metadata and offset.
+
+        The object name and its position in the metadata object list are
+        assigned here, so they are deterministic even when the chunk is
+        compressed and written by ``writer_pool`` in the background.
+
+        When a dedup_key is given the chunk is stored in the deduplication
+        container instead, see _write_dedup_chunk.
+        """
         object_prefix = object_meta['prefix']
         object_list = object_meta['list']
 
@@ -364,30 +609,145 @@ class ChunkedBackupDriver(driver.BackupDriver):
         obj[object_name] = {}
         obj[object_name]['offset'] = data_offset
         obj[object_name]['length'] = len(data)
+        object_list.append(obj)
+        object_id += 1
+        object_meta['list'] = object_list
+        object_meta['id'] = object_id
+
+        if dedup_key:
+            write_args = (self._write_dedup_chunk, backup, dedup_key,
+                          obj[object_name], data, extra_metadata)
+        else:
+            write_args = (self._write_chunk, container, object_name,
+                          obj[object_name], data, extra_metadata)
+        if writer_pool is None:
+            write_args[0](*write_args[1:])
+        else:
+            writer_pool.spawn(*write_args)
+
+        LOG.debug('Calling eventlet.sleep(0)')
+        eventlet.sleep(0)
+
+    def _write_chunk(self, container, object_name, object_info, data,
+                     extra_metadata):
+        """Compress a chunk and store it as object_name."""
         LOG.debug('Backing up chunk of data from volume.')
         algorithm, output_data = self._prepare_output_data(data)
-        obj[object_name]['compression'] = algorithm
+        object_info['compression'] = algorithm
         LOG.debug('About to put_object')
         with self._get_object_writer(
                 container, object_name, extra_metadata=extra_metadata
         ) as writer:
             writer.write(output_data)
         md5 = eventlet.tpool.execute(hashlib.md5, data).hexdigest()
-        obj[object_name]['md5'] = md5
+        object_info['md5'] = md5
         LOG.debug('backup MD5 for %(object_name)s: %(md5)s',
                   {'object_name': object_name, 'md5': md5})
-        object_list.append(obj)
-        object_id += 1
-        object_meta['list'] = object_list
-        object_meta['id'] = object_id
 
-        LOG.debug('Calling eventlet.sleep(0)')
-        eventlet.sleep(0)
+    @staticmethod
+    def _dedup_key(shalist):
+        """Return the deduplication key of a chunk from its block SHAs."""
+        return hashlib.sha256(''.join(shalist).encode('utf-8')).hexdigest()
+
+    def _dedup_lock(self, dedup_key):
+        # Locks are striped so the coordination backend doesn't end up with
+        # a lock per stored chunk.
+        return coordination.COORDINATOR.get_lock(
+            'backup-dedup-%s' % dedup_key[:3])
+
+    @staticmethod
+    def _dedup_object_name(dedup_key):
+        return 'chunk-%s.' % dedup_key
+
+    def _write_dedup_chunk(self, backup, dedup_key, object_info, data,
+                           extra_metadata):
+        """Store a chunk in the deduplication container.
+
+        The chunk is stored as chunk-<dedup_key>.<compression> unless a
+        backup already references it, and the reference of this backup is
+        recorded in the database. Both happen under a lock shared with
+        _release_dedup_chunks so a chunk cannot be deleted between the time
+        we find it and the time our reference is recorded.
+        """
+        container = self.dedup_container
+        with self._dedup_lock(dedup_key):
+            refs = self.db.backup_dedup_ref_get_all(self.context, container,
+                                                    dedup_key)
+            if refs:
+                object_name = refs[0].object_name
+                algorithm = object_name.rsplit('.', 1)[1]
+                LOG.debug('Chunk %s is already stored, reusing it.',
+                          object_name)
+            else:
+                algorithm, output_data = self._prepare_output_data(data)
+                object_name = self._dedup_object_name(dedup_key) + algorithm
+                with self._get_object_writer(
+                        container, object_name,
+                        extra_metadata=extra_metadata) as writer:
+                    writer.write(output_data)
+            self.db.backup_dedup_ref_create(self.context,
+                                            {'container': container,
+                                             'dedup_key': dedup_key,
+                                             'object_name': object_name,
+                                             'backup_id': backup.id})
+        object_info['container'] = container
+        object_info['object'] = object_name
+        object_info['compression'] = algorithm
+        md5 = eventlet.tpool.execute(hashlib.md5, data).hexdigest()
+        object_info['md5'] = md5
+
+    def _release_dedup_chunks(self, backup, object_list):
+        """Drop the references of a backup to deduplicated chunks.
+
+        Chunks that are no longer referenced by any backup are deleted.
+        References live in the database rather than in the container, as
+        listing objects is only eventually consistent on some backends.
+        """
+        dedup_objects = set()
+        for metadata_object in object_list:
+            obj = list(metadata_object.values())[0]
+            if 'container' in obj and 'object' in obj:
+                dedup_objects.add((obj['container'], obj['object']))
+
+        for container, object_name in sorted(dedup_objects):
+            dedup_key = object_name[len('chunk-'):].rsplit('.', 1)[0]
+            with self._dedup_lock(dedup_key):
+                remaining = self.db.backup_dedup_ref_destroy(
+                    self.context, container, dedup_key, backup.id)
+                if not remaining:
+                    self.delete_object(container, object_name)
+                    LOG.debug('Deleted unreferenced chunk %(object_name)s '
+                              'in container %(container)s.',
+                              {'object_name': object_name,
+                               'container': container})
+            eventlet.sleep(0)
+
+    def _is_compressible(self, data):
+        """Find out whether a chunk is worth compressing from a sample.
+
+        The sample is made of a few slices spread over the whole chunk, so
+        that we don't have to compress all of it to find out it is already
+        compressed or encrypted data.
+        """
+        if len(data) <= 2 * _COMPRESSION_SAMPLE_BYTES:
+            return True
+        slices = 4
+        slice_size = _COMPRESSION_SAMPLE_BYTES // slices
+        step = (len(data) - slice_size) // (slices - 1)
+        sample = b''.join(data[i * step:i * step + slice_size]
+                          for i in range(slices))
+        compressed_size = len(self.compressor.compress(sample))
+        return compressed_size < len(sample) * _COMPRESSION_MIN_RATIO
 
     def _prepare_output_data(self, data):
         if self.compressor is None:
             return 'none', data
         data_size_bytes = len(data)
+        if self.adaptive_compression and not self._is_compressible(data):
+            LOG.debug('Sample of this chunk did not compress well, using '
+                      'original data for this chunk of %d bytes.',
+                      data_size_bytes)
+            return 'none', data
         # Execute compression in native thread so it doesn't prevent
         # cooperative greenthread switching.
         compressed_data = self.compressor.compress(data)
@@ -417,6 +777,7 @@ class ChunkedBackupDriver(driver.BackupDriver):
         volume_meta = object_meta['volume_meta']
         sha256_list = object_sha256['sha256s']
         extra_metadata = object_meta.get('extra_metadata')
+        zero_extents = object_meta.get('zero_extents')
         self._write_sha256file(backup,
                                backup.volume_id,
                                container,
@@ -426,7 +787,8 @@ class ChunkedBackupDriver(driver.BackupDriver):
                              container,
                              object_list,
                              volume_meta,
-                             extra_metadata)
+                             extra_metadata,
+                             zero_extents)
         backup.object_count = object_id
         backup.save()
         LOG.debug('backup %s finished.', backup['id'])
@@ -470,6 +832,32 @@ class ChunkedBackupDriver(driver.BackupDriver):
             disk_path)
         return win32_diskutils.get_disk_size(disk_number)
 
+    def _find_zero_blocks(self, data):
+        """Return whether each SHA block of a data chunk only holds zeroes.
+
+        This method cannot log anything as it is called on a native thread.
+        """
+        chunk = memoryview(data)
+        zero_block = memoryview(bytes(bytearray(self.sha_block_size_bytes)))
+        zero_blocks = []
+        off = 0
+        datalen = len(chunk)
+        while off < datalen:
+            chunk_end = min(datalen, off + self.sha_block_size_bytes)
+            zero_blocks.append(
+                chunk[off:chunk_end] == zero_block[:chunk_end - off])
+            off += self.sha_block_size_bytes
+        return zero_blocks
+
+    @staticmethod
+    def _add_zero_extent(object_meta, offset, length):
+        """Record that a range of the volume only holds zeroes."""
+        zero_extents = object_meta.setdefault('zero_extents', [])
+        if zero_extents and sum(zero_extents[-1]) == offset:
+            zero_extents[-1][1] += length
+        else:
+            zero_extents.append([offset, length])
+
     def _calculate_sha(self, data):
         """Calculate SHA256 of a data chunk.
 
@@ -503,7 +891,7 @@ class ChunkedBackupDriver(driver.BackupDriver):
         # Read the shafile of the parent backup if backup['parent_id']
         # is given.
         parent_backup_shafile = None
-        parent_backup = None
+        parent_backup_shalist = None
         if backup.parent_id:
             parent_backup = objects.Backup.get_by_id(self.context,
                                                      backup.parent_id)
@@ -555,83 +943,70 @@ class ChunkedBackupDriver(driver.BackupDriver):
         sha256_list = object_sha256['sha256s']
         shaindex = 0
         is_backup_canceled = False
-        while True:
-            # First of all, we check the status of this backup. If it
-            # has been changed to delete or has been deleted, we cancel the
-            # backup process to do forcing delete.
-            with backup.as_read_deleted():
-                backup.refresh()
-            if backup.status in (fields.BackupStatus.DELETING,
-                                 fields.BackupStatus.DELETED):
-                is_backup_canceled = True
-                # To avoid the chunk left when deletion complete, need to
-                # clean up the object of chunk again.
-                self.delete_backup(backup)
-                LOG.debug('Cancel the backup process of %s.', backup.id)
-                break
-            data_offset = volume_file.tell()
-
-            if sys.platform == 'win32':
-                read_bytes = min(self.chunk_size_bytes,
-                                 win32_disk_size - data_offset)
-            else:
-                read_bytes = self.chunk_size_bytes
-            data = volume_file.read(read_bytes)
-
-            if data == b'':
-                break
-
-            # Calculate new shas with the datablock.
-            shalist = eventlet.tpool.execute(self._calculate_sha, data)
-            sha256_list.extend(shalist)
-
-            # If parent_backup is not None, that means an incremental
-            # backup will be performed.
-            if parent_backup:
-                # Find the extent that needs to be backed up.
-                extent_off = -1
-                for idx, sha in enumerate(shalist):
-                    if sha != parent_backup_shalist[shaindex]:
-                        if extent_off == -1:
-                            # Start of new extent.
-                            extent_off = idx * self.sha_block_size_bytes
-                    else:
-                        if extent_off != -1:
-                            # We've reached the end of extent.
-                            extent_end = idx * self.sha_block_size_bytes
-                            segment = data[extent_off:extent_end]
-                            self._backup_chunk(backup, container, segment,
-                                               data_offset + extent_off,
-                                               object_meta,
-                                               extra_metadata)
-                            extent_off = -1
-                    shaindex += 1
-
-                # The last extent extends to the end of data buffer.
-                if extent_off != -1:
-                    extent_end = len(data)
-                    segment = data[extent_off:extent_end]
-                    self._backup_chunk(backup, container, segment,
-                                       data_offset + extent_off,
-                                       object_meta, extra_metadata)
-                    extent_off = -1
-            else:  # Do a full backup.
-                self._backup_chunk(backup, container, data, data_offset,
-                                   object_meta, extra_metadata)
-
-            # Notifications
-            total_block_sent_num += self.data_block_num
-            counter += 1
-            if counter == self.data_block_num:
-                # Send the notification to Ceilometer when the chunk
-                # number reaches the data_block_num.  The backup percentage
-                # is put in the metadata as the extra information.
-                self._send_progress_notification(self.context, backup,
-                                                 object_meta,
-                                                 total_block_sent_num,
-                                                 volume_size_bytes)
-                # Reset the counter
-                counter = 0
+        # Chunks are read and hashed here while up to backup_object_writers
+        # of them are compressed and written to the repository in parallel.
+        writer_pool = _ChunkWriterPool(self.object_writers,
+                                       self.max_pending_chunks)
+        status_monitor = driver.BackupStatusMonitor(backup)
+        try:
+            while True:
+                # First of all, we check the status of this backup. If it
+                # has been changed to delete or has been deleted, we cancel
+                # the backup process to do forcing delete.
+                status_monitor.refresh()
+                if backup.status in (fields.BackupStatus.DELETING,
+                                     fields.BackupStatus.DELETED):
+                    is_backup_canceled = True
+                    writer_pool.abort()
+                    self._release_dedup_chunks(backup, object_meta['list'])
+                    # To avoid the chunk left when deletion complete, need
+                    # to clean up the object of chunk again.
+                    self.delete_backup(backup)
+                    LOG.debug('Cancel the backup process of %s.', backup.id)
+                    break
+                data_offset = volume_file.tell()
+
+                if sys.platform == 'win32':
+                    read_bytes = min(self.chunk_size_bytes,
+                                     win32_disk_size - data_offset)
+                else:
+                    read_bytes = self.chunk_size_bytes
+                data = volume_file.read(read_bytes)
+
+                if data == b'':
+                    writer_pool.wait()
+                    break
+
+                # Calculate new shas with the datablock.
+                shalist = eventlet.tpool.execute(self._calculate_sha, data)
+                sha256_list.extend(shalist)
+
+                self._backup_extents(backup, container, data, data_offset,
+                                     shalist, parent_backup_shalist,
+                                     shaindex, object_meta, extra_metadata,
+                                     writer_pool)
+                shaindex += len(shalist)
+
+                # Notifications
+                total_block_sent_num += self.data_block_num
+                counter += 1
+                if counter == self.data_block_num:
+                    # Send the notification to Ceilometer when the chunk
+                    # number reaches the data_block_num.  The backup percentage
+                    # is put in the metadata as the extra information.
+                    self._send_progress_notification(self.context, backup,
+                                                     object_meta,
+                                                     total_block_sent_num,
+                                                     volume_size_bytes)
+                    # Reset the counter
+                    counter = 0
+
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                timer.stop()
+                # Don't leave chunk writers running behind our back.
+                writer_pool.abort()
+                self._release_dedup_chunks_on_error(backup, object_meta)
 
         # Stop the timer.
         timer.stop()
@@ -650,26 +1025,81 @@ class ChunkedBackupDriver(driver.BackupDriver):
             except Exception:
                 with excutils.save_and_reraise_exception():
                     LOG.exception("Backup volume metadata failed.")
+                    # delete_backup can't find the deduplicated chunks of
+                    # this backup without its metadata file.
+                    self._release_dedup_chunks_on_error(backup, object_meta)
                     self.delete_backup(backup)
 
-        self._finalize_backup(backup, container, object_meta, object_sha256)
+        try:
+            self._finalize_backup(backup, container, object_meta,
+                                  object_sha256)
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                self._release_dedup_chunks_on_error(backup, object_meta)
+
+    def _backup_extents(self, backup, container, data, data_offset, shalist,
+                        parent_shalist, shaindex, object_meta,
+                        extra_metadata, writer_pool):
+        """Back up the blocks of a chunk read from the volume.
+
+        The chunk is split into extents of blocks that have to be backed up,
+        blocks that only hold zeroes, which are just recorded in the
+        metadata, and blocks that haven't changed since the parent backup if
+        this is an incremental backup. shaindex is the index of the first
+        block of the chunk in the sha list of the parent backup.
+        """
+        if self.detect_zero_blocks:
+            zero_blocks = eventlet.tpool.execute(self._find_zero_blocks, data)
+        else:
+            zero_blocks = [False] * len(shalist)
+
+        extents = []
+        for idx, sha in enumerate(shalist):
+            if (parent_shalist is not None and
+                    sha == parent_shalist[shaindex + idx]):
+                extent_type = None
+            elif zero_blocks[idx]:
+                extent_type = 'zero'
+            else:
+                extent_type = 'data'
+            if not extents or extents[-1][0] != extent_type:
+                extents.append((extent_type, idx))
 
-    def _restore_v1(self, backup, volume_id, metadata, volume_file,
-                    requested_backup):
-        """Restore a v1 volume backup.
+        for idx, (extent_type, first_block) in enumerate(extents):
+            if idx + 1 < len(extents):
+                end_block = extents[idx + 1][1]
+            else:
+                end_block = len(shalist)
+            extent_off = first_block * self.sha_block_size_bytes
+            extent_end = min(len(data), end_block * self.sha_block_size_bytes)
+            if extent_type == 'data':
+                segment = data[extent_off:extent_end]
+                dedup_key = None
+                if self.deduplication:
+                    dedup_key = self._dedup_key(
+                        shalist[first_block:end_block])
+                self._backup_chunk(backup, container, segment,
+                                   data_offset + extent_off, object_meta,
+                                   extra_metadata, writer_pool, dedup_key)
+            elif extent_type == 'zero':
+                self._add_zero_extent(object_meta, data_offset + extent_off,
+                                      extent_end - extent_off)
+
+    def _release_dedup_chunks_on_error(self, backup, object_meta):
+        try:
+            self._release_dedup_chunks(backup, object_meta['list'])
+        except Exception:
+            LOG.exception('Failed to release deduplicated chunks of backup '
+                          '%s.', backup.id)
 
-        Raises BackupRestoreCancel on any requested_backup status change, we
-        ignore the backup parameter for this check since that's only the
-        current data source from the list of backup sources.
-        """
-        backup_id = backup['id']
-        LOG.debug('v1 volume backup restore of %s started.', backup_id)
-        extra_metadata = metadata.get('extra_metadata')
-        container = backup['container']
-        metadata_objects = metadata['objects']
+    def _check_restore_objects(self, backup, metadata):
+        """Check that the repository holds all the objects of a backup."""
         metadata_object_names = []
-        for obj in metadata_objects:
-            metadata_object_names.extend(obj.keys())
+        for obj in metadata['objects']:
+            # Deduplicated chunks live in their own container.
+            metadata_object_names.extend(
+                object_name for object_name, info in obj.items()
+                if 'container' not in info)
         LOG.debug('metadata_object_names = %s.', metadata_object_names)
         prune_list = [self._metadata_filename(backup),
                       self._sha256_filename(backup)]
@@ -681,56 +1111,201 @@ class ChunkedBackupDriver(driver.BackupDriver):
                     'does not match object list stored in metadata.')
             raise exception.InvalidBackup(reason=err)
 
-        for metadata_object in metadata_objects:
-            # Abort when status changes to error, available, or anything else
-            with requested_backup.as_read_deleted():
-                requested_backup.refresh()
-            if requested_backup.status != fields.BackupStatus.RESTORING:
-                raise exception.BackupRestoreCancel(back_id=backup.id,
-                                                    vol_id=volume_id)
-
-            object_name, obj = list(metadata_object.items())[0]
-            LOG.debug('restoring object. backup: %(backup_id)s, '
-                      'container: %(container)s, object name: '
-                      '%(object_name)s, volume: %(volume_id)s.',
-                      {
-                          'backup_id': backup_id,
-                          'container': container,
-                          'object_name': object_name,
-                          'volume_id': volume_id,
-                      })
-
-            with self._get_object_reader(
-                    container, object_name,
-                    extra_metadata=extra_metadata) as reader:
-                body = reader.read()
-            compression_algorithm = metadata_object[object_name]['compression']
-            decompressor = self._get_compressor(compression_algorithm)
-            volume_file.seek(obj['offset'])
-            if decompressor is not None:
-                LOG.debug('decompressing data using %s algorithm',
-                          compression_algorithm)
-                decompressed = decompressor.decompress(body)
-                volume_file.write(decompressed)
-            else:
-                volume_file.write(body)
+    def _plan_restore(self, backup_chain):
+        """Return the objects that have to be read to restore a backup chain.
 
-            # force flush every write to avoid long blocking write on close
-            volume_file.flush()
+        backup_chain is a list of (backup, metadata) tuples going from the
+        full backup to the newest incremental backup. Only the newest version
+        of each volume range is kept, so objects that were completely
+        overwritten by later backups are not read at all.
 
-            # Be tolerant to IO implementations that do not support fileno()
-            try:
-                fileno = volume_file.fileno()
-            except IOError:
-                LOG.info("volume_file does not support fileno() so skipping "
-                         "fsync()")
+        Returns a list of (backup, metadata, object_name, object_info,
+        extents) tuples in volume offset order, where extents is the list of
+        (volume_offset, object_offset, length) ranges of the object that have
+        to be written to the volume. object_name is None for ranges that have
+        to be zeroed.
+        """
+        extent_map = _RestoreExtentMap()
+        sources = []
+        for backup, metadata in backup_chain:
+            self._check_restore_objects(backup, metadata)
+            for metadata_object in metadata['objects']:
+                object_name, obj = list(metadata_object.items())[0]
+                object_name = obj.get('object', object_name)
+                if not obj['length']:
+                    continue
+                sources.append((backup, metadata, object_name, obj))
+                extent_map.add(obj['offset'], obj['length'], len(sources) - 1)
+            # Zero extents have no object, they hide older data all the same.
+            sources.append((backup, metadata, None, None))
+            for offset, length in metadata.get('zero_extents', []):
+                extent_map.add(offset, length, len(sources) - 1)
+
+        plan = collections.OrderedDict()
+        for start, end, source, source_offset in extent_map:
+            if sources[source][2] is None:
+                plan[(source, start)] = [(start, 0, end - start)]
             else:
-                os.fsync(fileno)
-
-            # Restoring a backup to a volume can take some time. Yield so other
-            # threads can run, allowing for among other things the service
-            # status to be updated
+                plan.setdefault((source,), []).append(
+                    (start, source_offset, end - start))
+        LOG.debug('Restore plan reads %(read)d of %(total)d objects.',
+                  {'read': len(plan), 'total': len(sources)})
+        return [sources[key[0]] + (extents,)
+                for key, extents in plan.items()]
+
+    def _read_restore_object(self, backup, metadata, object_name, obj):
+        """Read a backup object and return its decompressed data."""
+        container = obj.get('container', backup['container'])
+        LOG.debug('restoring object. backup: %(backup_id)s, '
+                  'container: %(container)s, object name: '
+                  '%(object_name)s.',
+                  {
+                      'backup_id': backup['id'],
+                      'container': container,
+                      'object_name': object_name,
+                  })
+        with self._get_object_reader(
+                container, object_name,
+                extra_metadata=metadata.get('extra_metadata')) as reader:
+            body = reader.read()
+        compression_algorithm = obj['compression']
+        decompressor = self._get_compressor(compression_algorithm)
+        if decompressor is not None:
+            LOG.debug('decompressing data using %s algorithm',
+                      compression_algorithm)
+            return decompressor.decompress(body)
+        return body
+
+    def _restore_zeroes(self, volume_file, offset, length):
+        """Make a range of the restored volume read back as zeroes.
+
+        Returns True when the range was deallocated, and False when the
+        zeroes had to be written.
+        """
+        # rbd images can't be hole punched through a file descriptor.
+        if hasattr(volume_file, 'rbd_image'):
+            volume_file.rbd_image.discard(offset, length)
+            return True
+        if volume_utils.punch_hole(volume_file, offset, length):
+            return True
+
+        LOG.debug('Writing %(length)s bytes of zeroes at offset %(offset)s.',
+                  {'length': length, 'offset': offset})
+        zeroes = bytes(bytearray(min(length, self.chunk_size_bytes)))
+        volume_file.seek(offset)
+        while length:
+            written = min(length, len(zeroes))
+            volume_file.write(zeroes if written == len(zeroes)
+                              else zeroes[:written])
+            length -= written
             eventlet.sleep(0)
+        return False
+
+    @staticmethod
+    def _sync_volume_file(volume_file):
+        # force flush to avoid long blocking write on close
+        volume_file.flush()
+
+        # Be tolerant to IO implementations that do not support fileno()
+        try:
+            fileno = volume_file.fileno()
+        except IOError:
+            LOG.info("volume_file does not support fileno() so skipping "
+                     "fsync()")
+        else:
+            os.fsync(fileno)
+
+    def _restore_extents(self, backup_chain, volume_id, volume_file,
+                         requested_backup):
+        """Restore the newest data of a chain of backups to volume_file.
+
+        Up to backup_object_readers objects are read and decompressed in
+        parallel ahead of the writes, which are done in volume offset order
+        and only synced to disk every _RESTORE_SYNC_INTERVAL_BYTES.
+
+        Raises BackupRestoreCancel on any requested_backup status change.
+        """
+        plan = iter(self._plan_restore(backup_chain))
+        pool = eventlet.GreenPool(self.object_readers)
+        max_prefetched = max(self.object_readers, self.max_prefetched_objects)
+        pending = collections.deque()
+        plan_done = False
+        position = None
+        unsynced_bytes = 0
+        status_monitor = driver.BackupStatusMonitor(requested_backup)
+        try:
+            while True:
+                # Keep the readers busy while we write the oldest object.
+                while not plan_done and len(pending) < max_prefetched:
+                    item = next(plan, None)
+                    if item is None:
+                        plan_done = True
+                    elif item[2] is None:
+                        pending.append((item, None))
+                    else:
+                        pending.append(
+                            (item, pool.spawn(self._read_restore_object,
+                                              *item[:4])))
+                if not pending:
+                    break
+
+                item, reader = pending.popleft()
+                # Readers are greenthreads, which are falsy once finished.
+                data = reader.wait() if reader is not None else None
+
+                # Abort when status changes to error, available, or anything
+                # else
+                status_monitor.refresh()
+                if requested_backup.status != fields.BackupStatus.RESTORING:
+                    raise exception.BackupRestoreCancel(back_id=item[0].id,
+                                                        vol_id=volume_id)
+
+                for volume_offset, object_offset, length in item[4]:
+                    if data is None:
+                        if not self._restore_zeroes(volume_file,
+                                                    volume_offset, length):
+                            unsynced_bytes += length
+                        position = None
+                        continue
+                    if position != volume_offset:
+                        volume_file.seek(volume_offset)
+                    # rbd images only accept bytes, so don't hand out
+                    # memoryviews, and only copy objects partially restored.
+                    if object_offset == 0 and length == len(data):
+                        volume_file.write(data)
+                    else:
+                        volume_file.write(
+                            data[object_offset:object_offset + length])
+                    position = volume_offset + length
+                    unsynced_bytes += length
+                if unsynced_bytes >= _RESTORE_SYNC_INTERVAL_BYTES:
+                    self._sync_volume_file(volume_file)
+                    unsynced_bytes = 0
+
+                # Restoring a backup to a volume can take some time. Yield so
+                # other threads can run, allowing for among other things the
+                # service status to be updated
+                eventlet.sleep(0)
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                for _item, reader in pending:
+                    if reader is not None:
+                        reader.kill()
+
+        self._sync_volume_file(volume_file)
+
+    def _restore_v1(self, backup, volume_id, metadata, volume_file,
+                    requested_backup):
+        """Restore a v1 volume backup.
+
+        Raises BackupRestoreCancel on any requested_backup status change, we
+        ignore the backup parameter for this check since that's only the
+        current data source from the list of backup sources.
+        """
+        backup_id = backup['id']
+        LOG.debug('v1 volume backup restore of %s started.', backup_id)
+        self._restore_extents([(backup, metadata)], volume_id, volume_file,
+                              requested_backup)
         LOG.debug('v1 volume backup restore of %s finished.',
                   backup_id)
 
@@ -763,25 +1338,30 @@ class ChunkedBackupDriver(driver.BackupDriver):
             raise exception.InvalidBackup(reason=err)
 
         # Build a list of backups based on parent_id. A full backup
-        # will be the last one in the list.
-        backup_list = []
-        backup_list.append(backup)
+        # will be the first one in the list.
+        backup_chain = [(backup, metadata)]
         current_backup = backup
         while current_backup.parent_id:
             prev_backup = objects.Backup.get_by_id(self.context,
                                                    current_backup.parent_id)
-            backup_list.append(prev_backup)
+            backup_chain.insert(0, (prev_backup,
+                                    self._read_metadata(prev_backup)))
             current_backup = prev_backup
 
-        # Do a full restore first, then layer the incremental backups
-        # on top of it in order.
-        index = len(backup_list) - 1
-        while index >= 0:
-            backup1 = backup_list[index]
-            index = index - 1
-            metadata = self._read_metadata(backup1)
-            restore_func(backup1, volume_id, metadata, volume_file, backup)
-
+        if all(metadata['version'] in self.EXTENT_MAP_VERSIONS
+               for _backup, metadata in backup_chain):
+            # Merge the whole chain so that every volume range is only read
+            # and written once, with the data of the newest backup.
+            self._restore_extents(backup_chain, volume_id, volume_file,
+                                  backup)
+        else:
+            # Do a full restore first, then layer the incremental backups
+            # on top of it in order.
+            for backup1, metadata in backup_chain:
+                restore_func(backup1, volume_id, metadata, volume_file,
+                             backup)
+
+        for _backup, metadata in backup_chain:
             volume_meta = metadata.get('volume_meta', None)
             try:
                 if volume_meta:
@@ -807,6 +1387,16 @@ class ChunkedBackupDriver(driver.BackupDriver):
                    'pre': object_prefix})
 
         if container is not None and object_prefix is not None:
+            # Chunks shared with other backups are only deleted once no
+            # backup uses them anymore.
+            try:
+                metadata = self._read_metadata(backup)
+            except Exception:
+                LOG.debug('Could not read the metadata of backup %s, not '
+                          'releasing deduplicated chunks.', backup['id'])
+            else:
+                self._release_dedup_chunks(backup, metadata['objects'])
+
             object_names = []
             try:
                 object_names = self._generate_object_names(backup)
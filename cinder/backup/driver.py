@@ -16,6 +16,8 @@
 """Base class for all backup drivers."""
 
 import abc
+import collections
+import time
 
 from oslo_config import cfg
 from oslo_log import log as logging
@@ -39,6 +41,14 @@ service_opts = [
                default=120,
                help='Interval, in seconds, between two progress notifications '
                     'reporting the backup status'),
+    cfg.IntOpt('backup_status_check_interval',
+               default=10, min=0,
+               help='Interval, in seconds, between two database reads of '
+                    'the status of a running backup or restore to detect '
+                    'that it has been cancelled. Delete and reset status '
+                    'requests handled by the same backup service process are '
+                    'detected immediately. Set to 0 to check the status '
+                    'for every chunk or object.'),
 ]
 
 CONF = cfg.CONF
@@ -346,6 +356,53 @@ class BackupMetadataAPI(base.Base):
                 LOG.debug("No metadata of type '%s' to restore", type)
 
 
+class BackupStatusMonitor(object):
+    """Rate limits status refreshes of a running backup or restore.
+
+    Backup and restore loops used to refresh the backup from the database for
+    every chunk to find out whether the operation had been cancelled. The
+    monitor only does so every backup_status_check_interval seconds, or right
+    away once the backup manager has been told about a status change through
+    notify().
+    """
+
+    # Ids of the backups whose status was changed by a delete or reset status
+    # request, bounded in case nothing is running for them.
+    _changed = collections.OrderedDict()
+    _MAX_CHANGED = 1000
+
+    def __init__(self, backup, interval=None):
+        self.backup = backup
+        if interval is None:
+            interval = CONF.backup_status_check_interval
+        self.interval = interval
+        self._last_check = None
+
+    @classmethod
+    def notify(cls, backup_id):
+        """Flag the status of a backup as changed."""
+        cls._changed.pop(backup_id, None)
+        cls._changed[backup_id] = True
+        while len(cls._changed) > cls._MAX_CHANGED:
+            cls._changed.popitem(last=False)
+
+    def refresh(self):
+        """Refresh the backup if its status may have changed.
+
+        :returns: True if the backup was read from the database
+        """
+        changed = self._changed.pop(self.backup.id, False)
+        now = time.time()
+        if (not changed and self._last_check is not None and
+                now - self._last_check < self.interval):
+            return False
+
+        with self.backup.as_read_deleted():
+            self.backup.refresh()
+        self._last_check = now
+        return True
+
+
 @six.add_metaclass(abc.ABCMeta)
 class BackupDriver(base.Base):
 
@@ -42,26 +42,30 @@ was deemed the safest action to take. It is therefore recommended to always
 restore to a new volume (default).
 """
 
+import contextlib
 import fcntl
+import math
 import os
 import re
 import subprocess
 import time
 
 import eventlet
+from eventlet import tpool
 from os_brick.initiator import linuxrbd
 from oslo_config import cfg
 from oslo_log import log as logging
 from oslo_utils import excutils
 from oslo_utils import units
-from six.moves import range
 
 from cinder.backup import driver
 from cinder import exception
 from cinder.i18n import _
 from cinder import interface
+from cinder.objects import fields
 from cinder import utils
 import cinder.volume.drivers.rbd as rbd_driver
+from cinder.volume import utils as volume_utils
 
 try:
     import rados
@@ -93,7 +97,24 @@ service_opts = [
                      'bits to the backup RBD objects to allow mirroring'),
     cfg.BoolOpt('restore_discard_excess_bytes', default=True,
                 help='If True, always discard excess bytes when restoring '
-                     'volumes i.e. pad with zeroes.')
+                     'volumes i.e. pad with zeroes.'),
+    cfg.IntOpt('backup_ceph_zero_block_size', default=(units.Ki * 64),
+               min=0,
+               help='Size, in bytes, of the blocks that full backups and '
+                    'restores check for zeroes. Blocks of zeroes are not '
+                    'written to new backup images, and are discarded from '
+                    'restored volumes. 0 disables the zero detection.'),
+    cfg.BoolOpt('backup_ceph_native_diff', default=True,
+                help='If True, incremental backups and restores of RBD '
+                     'volumes copy the changed extents with librbd in the '
+                     'backup service. Otherwise they pipe the rbd '
+                     'export-diff and import-diff commands into each '
+                     'other.'),
+    cfg.IntOpt('backup_ceph_diff_workers', default=4, min=1,
+               help='Number of changed extents read and written in parallel '
+                    'by an incremental backup or restore of an RBD volume '
+                    'when backup_ceph_native_diff is True. Each of them '
+                    'buffers up to backup_ceph_chunk_size bytes.'),
 ]
 
 CONF = cfg.CONF
@@ -175,6 +196,8 @@ class CephBackupDriver(driver.BackupDriver):
         self.rbd = rbd
         self.rados = rados
         self.chunk_size = CONF.backup_ceph_chunk_size
+        self.diff_workers = CONF.backup_ceph_diff_workers
+        self.zero_block_size = CONF.backup_ceph_zero_block_size
         self._execute = execute or utils.execute
 
         if self._supports_stripingv2:
@@ -299,7 +322,7 @@ class CephBackupDriver(driver.BackupDriver):
             client.shutdown()
             raise
 
-    def _disconnect_from_rados(self, client, ioctx):
+    def _disconnect_from_rados(self, client, ioctx, error=None):
         """Terminate connection with the backup Ceph cluster."""
         # closing an ioctx cannot raise an exception
         ioctx.close()
@@ -326,76 +349,106 @@ class CephBackupDriver(driver.BackupDriver):
         """Trim length bytes from offset.
 
         If the volume is an rbd do a discard() otherwise assume it is a file
-        and pad with zeroes.
+        and punch a hole, or pad with zeroes if that is not supported.
         """
         if length:
             LOG.debug("Discarding %(length)s bytes from offset %(offset)s",
                       {'length': length, 'offset': offset})
             if self._file_is_rbd(volume):
                 volume.rbd_image.discard(offset, length)
-            else:
-                zeroes = '\0' * self.chunk_size
-                chunks = int(length / self.chunk_size)
-                for chunk in range(0, chunks):
-                    LOG.debug("Writing zeroes chunk %d", chunk)
-                    volume.write(zeroes)
-                    volume.flush()
+            elif not volume_utils.punch_hole(volume, offset, length):
+                zeroes = memoryview(bytes(bytearray(
+                    min(length, self.chunk_size))))
+                volume.seek(offset)
+                remaining = length
+                while remaining:
+                    written = min(remaining, len(zeroes))
+                    volume.write(zeroes[:written])
+                    remaining -= written
                     # yield to any other pending backups
                     eventlet.sleep(0)
+                volume.flush()
 
-                rem = int(length % self.chunk_size)
-                if rem:
-                    zeroes = '\0' * rem
-                    volume.write(zeroes)
-                    volume.flush()
+            volume.seek(offset + length)
 
-    def _transfer_data(self, src, src_name, dest, dest_name, length):
-        """Transfer data between files (Python IO objects)."""
+    def _find_zero_ranges(self, data):
+        """Split a chunk of data into ranges of data and of zeroes.
+
+        Returns a list of (start, end, is_zero) tuples covering the chunk.
+        This method cannot log anything as it is called on a native thread.
+        """
+        if not self.zero_block_size:
+            return [(0, len(data), False)]
+
+        chunk = memoryview(data)
+        zero_block = memoryview(bytes(bytearray(self.zero_block_size)))
+        ranges = []
+        off = 0
+        datalen = len(chunk)
+        while off < datalen:
+            block_end = min(datalen, off + self.zero_block_size)
+            is_zero = chunk[off:block_end] == zero_block[:block_end - off]
+            if ranges and ranges[-1][2] == is_zero:
+                ranges[-1] = (ranges[-1][0], block_end, is_zero)
+            else:
+                ranges.append((off, block_end, is_zero))
+            off = block_end
+        return ranges
+
+    def _write_data(self, dest, offset, data, dest_is_zeroed):
+        """Write a chunk of data at offset without writing its zeroes."""
+        for start, end, is_zero in tpool.execute(self._find_zero_ranges,
+                                                 data):
+            if not is_zero:
+                dest.seek(offset + start)
+                dest.write(data[start:end])
+            elif not dest_is_zeroed:
+                self._discard_bytes(dest, offset + start, end - start)
+        dest.seek(offset + len(data))
+
+    def _transfer_data(self, src, src_name, dest, dest_name, length,
+                       dest_is_zeroed=False):
+        """Transfer data between files (Python IO objects).
+
+        Blocks of zeroes are not written to the destination: they are
+        skipped if the destination is known to only hold zeroes, like a new
+        RBD image, and discarded otherwise.
+        """
         LOG.debug("Transferring data between '%(src)s' and '%(dest)s'",
                   {'src': src_name, 'dest': dest_name})
 
-        chunks = int(length / self.chunk_size)
+        chunks = int(math.ceil(float(length) / self.chunk_size))
         LOG.debug("%(chunks)s chunks of %(bytes)s bytes to be transferred",
                   {'chunks': chunks, 'bytes': self.chunk_size})
 
-        for chunk in range(0, chunks):
+        offset = 0
+        chunk = 0
+        while offset < length:
             before = time.time()
-            data = src.read(self.chunk_size)
+            data = src.read(min(self.chunk_size, length - offset))
             # If we have reach end of source, discard any extraneous bytes from
             # destination volume if trim is enabled and stop writing.
             if data == b'':
                 if CONF.restore_discard_excess_bytes:
-                    self._discard_bytes(dest, dest.tell(),
-                                        length - dest.tell())
+                    self._discard_bytes(dest, offset, length - offset)
 
                 return
 
-            dest.write(data)
+            self._write_data(dest, offset, data, dest_is_zeroed)
             dest.flush()
+            offset += len(data)
+            chunk += 1
             delta = (time.time() - before)
-            rate = (self.chunk_size / delta) / 1024
+            rate = (len(data) / delta) / 1024
             LOG.debug("Transferred chunk %(chunk)s of %(chunks)s "
                       "(%(rate)dK/s)",
-                      {'chunk': chunk + 1,
+                      {'chunk': chunk,
                        'chunks': chunks,
                        'rate': rate})
 
             # yield to any other pending backups
             eventlet.sleep(0)
 
-        rem = int(length % self.chunk_size)
-        if rem:
-            LOG.debug("Transferring remaining %s bytes", rem)
-            data = src.read(rem)
-            if data == b'':
-                if CONF.restore_discard_excess_bytes:
-                    self._discard_bytes(dest, dest.tell(), rem)
-            else:
-                dest.write(data)
-                dest.flush()
-                # yield to any other pending backups
-                eventlet.sleep(0)
-
     def _create_base_image(self, name, size, rados_client):
         """Create a base backup image.
 
@@ -565,19 +618,169 @@ class CephBackupDriver(driver.BackupDriver):
         stdout, stderr = p2.communicate()
         return p2.returncode, stderr
 
+    @contextlib.contextmanager
+    def _open_rbd_image(self, user, conf, pool, name, snapshot=None,
+                        read_only=False):
+        """Open an RBD image with its own connection to the cluster.
+
+        The image is proxied through native threads so that reading and
+        writing it doesn't block other greenthreads.
+        """
+        client = self.rados.Rados(rados_id=utils.convert_str(user),
+                                  conffile=utils.convert_str(conf))
+        try:
+            client.connect()
+            ioctx = client.open_ioctx(utils.convert_str(pool))
+            try:
+                image = self.rbd.Image(ioctx, utils.convert_str(name),
+                                       snapshot=snapshot,
+                                       read_only=read_only)
+                try:
+                    yield tpool.Proxy(image)
+                finally:
+                    image.close()
+            finally:
+                ioctx.close()
+        finally:
+            client.shutdown()
+
+    def _send_diff_progress(self, backup, transferred, total):
+        percent = transferred * 100 / total if total else 100
+        volume_utils.notify_about_backup_usage(
+            self.context, backup, "createprogress",
+            extra_usage_info={'backup_percent': percent})
+
+    def _copy_rbd_diff(self, src_image, dest_image, from_snap=None,
+                       backup=None):
+        """Copy the extents of src_image changed since from_snap.
+
+        Like rbd import-diff, the destination is resized to the size of the
+        source and extents that no longer exist in the source are discarded.
+        Up to diff_workers extents of at most chunk_size bytes are copied at
+        a time.
+
+        If a backup is given, progress notifications are sent for it and the
+        copy stops with BackupOperationError if it gets cancelled.
+        """
+        if from_snap is not None:
+            dest_snaps = [snap['name'] for snap in dest_image.list_snaps()]
+            if from_snap not in dest_snaps:
+                msg = (_("Start snapshot '%s' does not exist in the "
+                         "destination image") % from_snap)
+                raise exception.BackupRBDOperationFailed(msg)
+
+        size = src_image.size()
+        if dest_image.size() != size:
+            dest_image.resize(size)
+
+        extents = []
+
+        def iter_cb(offset, length, exists):
+            if not exists:
+                extents.append((offset, length, False))
+                return
+            end = offset + length
+            while offset < end:
+                extents.append((offset, min(self.chunk_size, end - offset),
+                                True))
+                offset += self.chunk_size
+
+        src_image.diff_iterate(0, size, from_snap, iter_cb)
+        total = sum(length for _offset, length, _exists in extents)
+        LOG.debug("%(extents)s extents of %(bytes)s bytes to be transferred",
+                  {'extents': len(extents), 'bytes': total})
+
+        errors = []
+        progress = {'transferred': 0, 'extents': 0}
+
+        def copy_extent(offset, length, exists):
+            try:
+                if exists:
+                    dest_image.write(src_image.read(offset, length), offset)
+                else:
+                    dest_image.discard(offset, length)
+            except Exception as e:
+                errors.append(e)
+                return
+            progress['transferred'] += length
+            progress['extents'] += 1
+            if (backup is not None and progress['extents'] %
+                    CONF.backup_object_number_per_notification == 0):
+                self._send_diff_progress(backup, progress['transferred'],
+                                         total)
+
+        status_monitor = None
+        if backup is not None:
+            status_monitor = driver.BackupStatusMonitor(backup)
+        pool = eventlet.GreenPool(self.diff_workers)
+        cancelled = False
+        for offset, length, exists in extents:
+            if errors:
+                break
+            if status_monitor is not None:
+                status_monitor.refresh()
+                if backup.status in (fields.BackupStatus.DELETING,
+                                     fields.BackupStatus.DELETED):
+                    cancelled = True
+                    break
+            # Blocks while diff_workers extents are being copied
+            pool.spawn_n(copy_extent, offset, length, exists)
+        pool.waitall()
+
+        if errors:
+            raise errors[0]
+        if cancelled:
+            msg = _("Backup %s was cancelled") % backup.id
+            raise exception.BackupOperationError(msg)
+        if backup is not None:
+            self._send_diff_progress(backup, total, total)
+
+    def _rbd_native_diff_transfer(self, src_name, src_pool, dest_name,
+                                  dest_pool, src_user, src_conf, dest_user,
+                                  dest_conf, src_snap=None, from_snap=None,
+                                  backup=None):
+        """Copy changed extents between RBD images with librbd."""
+        try:
+            with self._open_rbd_image(src_user, src_conf, src_pool, src_name,
+                                      snapshot=src_snap,
+                                      read_only=True) as src_image, \
+                    self._open_rbd_image(dest_user, dest_conf, dest_pool,
+                                         dest_name) as dest_image:
+                self._copy_rbd_diff(src_image, dest_image,
+                                    from_snap=from_snap, backup=backup)
+                # The destination gets the end snapshot like with import-diff
+                if src_snap:
+                    dest_image.create_snap(utils.convert_str(src_snap))
+        except (self.rados.Error, self.rbd.Error) as e:
+            msg = _("RBD diff op failed - %s") % e
+            LOG.info(msg)
+            raise exception.BackupRBDOperationFailed(msg)
+
     def _rbd_diff_transfer(self, src_name, src_pool, dest_name, dest_pool,
                            src_user, src_conf, dest_user, dest_conf,
-                           src_snap=None, from_snap=None):
+                           src_snap=None, from_snap=None, backup=None):
         """Copy only extents changed between two points.
 
         If no snapshot is provided, the diff extents will be all those changed
         since the rbd volume/base was created, otherwise it will be those
         changed since the snapshot was created.
+
+        Progress notifications are only sent, and cancellation only checked,
+        for the given backup when the transfer is done with librbd.
         """
         LOG.debug("Performing differential transfer from '%(src)s' to "
                   "'%(dest)s'",
                   {'src': src_name, 'dest': dest_name})
 
+        if CONF.backup_ceph_native_diff:
+            self._rbd_native_diff_transfer(src_name, src_pool, dest_name,
+                                           dest_pool, src_user, src_conf,
+                                           dest_user, dest_conf,
+                                           src_snap=src_snap,
+                                           from_snap=from_snap,
+                                           backup=backup)
+            return
+
         # NOTE(dosaboy): Need to be tolerant of clusters/clients that do
         # not support these operations since at the time of writing they
         # were very new.
@@ -706,12 +909,14 @@ class CephBackupDriver(driver.BackupDriver):
                                     dest_user=self._ceph_backup_user,
                                     dest_conf=self._ceph_backup_conf,
                                     src_snap=new_snap,
-                                    from_snap=from_snap)
+                                    from_snap=from_snap,
+                                    backup=backup)
 
             LOG.debug("Differential backup transfer completed in %.4fs",
                       (time.time() - before))
 
-        except exception.BackupRBDOperationFailed:
+        except (exception.BackupRBDOperationFailed,
+                exception.BackupOperationError):
             with excutils.save_and_reraise_exception():
                 LOG.debug("Differential backup transfer failed")
 
@@ -769,8 +974,9 @@ class CephBackupDriver(driver.BackupDriver):
                                                      self._ceph_backup_user,
                                                      self._ceph_backup_conf)
                 rbd_fd = linuxrbd.RBDVolumeIOWrapper(rbd_meta)
+                # The new backup image only holds zeroes
                 self._transfer_data(src_volume, src_name, rbd_fd, backup_name,
-                                    length)
+                                    length, dest_is_zeroed=True)
             finally:
                 dest_rbd.close()
 
@@ -923,6 +1129,13 @@ class CephBackupDriver(driver.BackupDriver):
             except exception.BackupRBDOperationFailed:
                 LOG.debug("Forcing full backup of volume %s.", volume.id)
                 do_full_backup = True
+            except exception.BackupOperationError:
+                if backup.status not in (fields.BackupStatus.DELETING,
+                                         fields.BackupStatus.DELETED):
+                    raise
+                # The backup manager reports the backup as aborted
+                LOG.debug('Cancel the backup process of %s.', backup.id)
+                return {}
         else:
             LOG.debug("Volume file is NOT RBD: will do full backup.")
             do_full_backup = True
@@ -663,6 +663,8 @@ class BackupManager(manager.ThreadPoolManager):
     def delete_backup(self, context, backup):
         """Delete volume backup from configured backup service."""
         LOG.info('Delete backup started, backup: %s.', backup.id)
+        # Let a backup still running in this process notice the deletion.
+        driver.BackupStatusMonitor.notify(backup.id)
 
         self._notify_about_backup_usage(context, backup, "delete.start")
         backup.host = self.host
@@ -938,6 +940,7 @@ class BackupManager(manager.ThreadPoolManager):
                  '%(backup_id)s, status: %(status)s.',
                  {'backup_id': backup.id,
                   'status': status})
+        driver.BackupStatusMonitor.notify(backup.id)
 
         backup_service_name = backup.service
         LOG.info('Backup service: %s.', backup_service_name)
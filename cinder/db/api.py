@@ -1719,6 +1719,49 @@ def cleanup_expired_messages(context):
 ###################
 
 
+def scheduler_claim_create(context, values):
+    """Create a capacity claim on a backend."""
+    return IMPL.scheduler_claim_create(context, values)
+
+
+def scheduler_claim_get_all(context, created_after):
+    """Get all capacity claims made after a given time."""
+    return IMPL.scheduler_claim_get_all(context, created_after)
+
+
+def cleanup_expired_scheduler_claims(context, created_before):
+    """Delete capacity claims made before a given time."""
+    return IMPL.cleanup_expired_scheduler_claims(context, created_before)
+
+
+###################
+
+
+def backup_dedup_ref_create(context, values):
+    """Record that a backup references a deduplicated chunk.
+
+    :returns: False if the reference was already recorded.
+    """
+    return IMPL.backup_dedup_ref_create(context, values)
+
+
+def backup_dedup_ref_get_all(context, container, dedup_key):
+    """Get all the references to a deduplicated chunk."""
+    return IMPL.backup_dedup_ref_get_all(context, container, dedup_key)
+
+
+def backup_dedup_ref_destroy(context, container, dedup_key, backup_id):
+    """Drop the reference of a backup to a deduplicated chunk.
+
+    :returns: the number of references left to the chunk.
+    """
+    return IMPL.backup_dedup_ref_destroy(context, container, dedup_key,
+                                         backup_id)
+
+
+###################
+
+
 def workers_init():
     """Check if DB supports subsecond resolution and set global flag.
 
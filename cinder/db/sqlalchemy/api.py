@@ -6623,6 +6623,73 @@ def cleanup_expired_messages(context):
 ###############################
 
 
+@require_admin_context
+def scheduler_claim_create(context, values):
+    claim_ref = models.SchedulerClaim()
+    claim_ref.update(values)
+
+    session = get_session()
+    with session.begin():
+        session.add(claim_ref)
+    return claim_ref
+
+
+@require_admin_context
+def scheduler_claim_get_all(context, created_after):
+    session = get_session()
+    with session.begin():
+        return session.query(models.SchedulerClaim).filter(
+            models.SchedulerClaim.created_at > created_after).all()
+
+
+@require_admin_context
+def cleanup_expired_scheduler_claims(context, created_before):
+    session = get_session()
+    with session.begin():
+        return session.query(models.SchedulerClaim).filter(
+            models.SchedulerClaim.created_at < created_before).delete()
+
+
+###############################
+
+
+@require_context
+def backup_dedup_ref_create(context, values):
+    ref = models.BackupDedupRef()
+    ref.update(values)
+    session = get_session()
+    try:
+        with session.begin():
+            session.add(ref)
+        return True
+    except db_exc.DBDuplicateEntry:
+        return False
+
+
+@require_context
+def backup_dedup_ref_get_all(context, container, dedup_key):
+    session = get_session()
+    with session.begin():
+        return session.query(models.BackupDedupRef).\
+            filter_by(container=container).\
+            filter_by(dedup_key=dedup_key).\
+            all()
+
+
+@require_context
+def backup_dedup_ref_destroy(context, container, dedup_key, backup_id):
+    session = get_session()
+    with session.begin():
+        query = session.query(models.BackupDedupRef).\
+            filter_by(container=container).\
+            filter_by(dedup_key=dedup_key)
+        query.filter_by(backup_id=backup_id).delete()
+        return query.count()
+
+
+###############################
+
+
 @require_context
 def driver_initiator_data_insert_by_key(context, initiator, namespace,
                                         key, value):
@@ -0,0 +1,34 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table
+
+
+def upgrade(migrate_engine):
+    """Add scheduler_claims table."""
+
+    meta = MetaData()
+    meta.bind = migrate_engine
+
+    scheduler_claims = Table(
+        'scheduler_claims', meta,
+        Column('id', Integer, primary_key=True, nullable=False),
+        Column('backend', String(255), nullable=False),
+        Column('size', Integer, nullable=False),
+        Column('scheduler', String(36), nullable=False),
+        Column('created_at', DateTime(timezone=False), nullable=False,
+               index=True),
+        mysql_engine='InnoDB',
+        mysql_charset='utf8'
+    )
+
+    scheduler_claims.create()
@@ -0,0 +1,36 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table
+from sqlalchemy import UniqueConstraint
+
+
+def upgrade(migrate_engine):
+    """Add backup_dedup_refs table."""
+
+    meta = MetaData()
+    meta.bind = migrate_engine
+
+    backup_dedup_refs = Table(
+        'backup_dedup_refs', meta,
+        Column('created_at', DateTime(timezone=False)),
+        Column('id', Integer, primary_key=True, nullable=False),
+        Column('container', String(255), nullable=False),
+        Column('dedup_key', String(64), nullable=False),
+        Column('object_name', String(255), nullable=False),
+        Column('backup_id', String(36), nullable=False),
+        UniqueConstraint('container', 'dedup_key', 'backup_id'),
+        mysql_engine='InnoDB',
+        mysql_charset='utf8'
+    )
+
+    backup_dedup_refs.create()
@@ -886,6 +886,35 @@ class ImageVolumeCacheEntry(BASE, models.ModelBase):
     last_used = Column(DateTime, default=lambda: timeutils.utcnow())
 
 
+class SchedulerClaim(BASE, models.ModelBase):
+    """Represents capacity a scheduler has claimed on a backend"""
+    __tablename__ = 'scheduler_claims'
+
+    id = Column(Integer, primary_key=True, nullable=False)
+    backend = Column(String(255), nullable=False)
+    size = Column(Integer, nullable=False)
+    # Identifier of the scheduler process that made the claim
+    scheduler = Column(String(36), nullable=False)
+    created_at = Column(DateTime, index=True, nullable=False,
+                        default=lambda: timeutils.utcnow())
+
+
+class BackupDedupRef(BASE, models.ModelBase):
+    """Represents a reference of a backup to a deduplicated chunk"""
+    __tablename__ = 'backup_dedup_refs'
+    __table_args__ = (
+        schema.UniqueConstraint('container', 'dedup_key', 'backup_id'),
+        CinderBase.__table_args__)
+
+    id = Column(Integer, primary_key=True, nullable=False)
+    container = Column(String(255), nullable=False)
+    dedup_key = Column(String(64), nullable=False)
+    # Name of the object holding the chunk in the container
+    object_name = Column(String(255), nullable=False)
+    backup_id = Column(String(36), nullable=False)
+    created_at = Column(DateTime, default=lambda: timeutils.utcnow())
+
+
 class Worker(BASE, CinderBase):
     """Represents all resources that are being worked on by a node."""
     __tablename__ = 'workers'
@@ -0,0 +1,178 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Cache of the image files downloaded from Glance on a volume node.
+
+Backends that cannot clone volumes download their images from Glance for
+every volume they create from them.  This cache keeps the downloaded files
+in a directory shared by all the backends of the node, so that the next
+volumes created from the same image are copied from the local file.
+
+Entries are named after the image id and a digest of its checksum and last
+update time, so an image that is changed in Glance is downloaded again and
+its previous entry removed.  Consumers get a hard link to an entry, which
+stays valid even if the entry is evicted while they use it.  The least
+recently used entries are evicted once the cache grows bigger than
+image_file_cache_max_size_gb.
+"""
+
+import errno
+import hashlib
+import os
+import shutil
+
+from oslo_config import cfg
+from oslo_log import log as logging
+from oslo_utils import fileutils
+from oslo_utils import units
+import six
+
+from cinder import utils
+
+
+image_file_cache_opts = [
+    cfg.StrOpt('image_file_cache_dir',
+               default='$image_conversion_dir/file_cache',
+               help='Directory where the images downloaded from Glance are '
+                    'cached, shared by all the backends of the node. It '
+                    'should be on the same file system as '
+                    'image_conversion_dir so that cached images are hard '
+                    'linked instead of copied.'),
+    cfg.IntOpt('image_file_cache_max_size_gb',
+               default=0,
+               min=0,
+               help='Maximum size, in gigabytes, of the images kept in '
+                    'image_file_cache_dir. The least recently used images '
+                    'are removed once the cache is bigger. 0 disables the '
+                    'cache.'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(image_file_cache_opts)
+
+LOG = logging.getLogger(__name__)
+
+PARTIAL_SUFFIX = '.part'
+
+
+class ImageFileCache(object):
+    """LRU cache of image files shared by the backends of a node."""
+
+    def __init__(self, cache_dir=None, max_size_gb=None):
+        self.cache_dir = cache_dir or CONF.image_file_cache_dir
+        if max_size_gb is None:
+            max_size_gb = CONF.image_file_cache_max_size_gb
+        self.max_size = max_size_gb * units.Gi
+
+    @property
+    def enabled(self):
+        return bool(self.cache_dir and self.max_size)
+
+    @staticmethod
+    def _get_entry_name(image_id, image_meta):
+        checksum = image_meta.get('checksum')
+        if not checksum:
+            return None
+        version = '%s:%s' % (checksum, image_meta.get('updated_at'))
+        digest = hashlib.sha256(six.text_type(version).encode('utf-8'))
+        return '%s.%s' % (image_id, digest.hexdigest()[:16])
+
+    def fetch(self, image_id, image_meta, path, download):
+        """Fill path with the cached image, downloading it if needed.
+
+        :param download: function downloading the image to the path it is
+                         given.
+        :returns: False if the image cannot be cached, in which case path is
+                  left untouched.
+        """
+        if not self.enabled:
+            return False
+        name = self._get_entry_name(image_id, image_meta)
+        if name is None:
+            return False
+
+        fileutils.ensure_tree(self.cache_dir)
+        entry = os.path.join(self.cache_dir, name)
+
+        @utils.synchronized('image-file-cache-%s' % image_id, external=True)
+        def _fetch():
+            self._remove_stale_entries(image_id, name)
+            if os.path.exists(entry):
+                LOG.debug('Image file cache hit for image %s.', image_id)
+                # Entries are evicted by last use
+                os.utime(entry, None)
+            else:
+                LOG.debug('Image file cache miss for image %s.', image_id)
+                partial = entry + PARTIAL_SUFFIX
+                try:
+                    download(partial)
+                    os.rename(partial, entry)
+                finally:
+                    fileutils.delete_if_exists(partial)
+            self._link(entry, path)
+
+        _fetch()
+        self._evict()
+        return True
+
+    @staticmethod
+    def _link(entry, path):
+        fileutils.delete_if_exists(path)
+        try:
+            os.link(entry, path)
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                raise
+            shutil.copyfile(entry, path)
+
+    def _remove_stale_entries(self, image_id, name):
+        """Remove the entries of previous versions of an image."""
+        prefix = '%s.' % image_id
+        for entry_name in os.listdir(self.cache_dir):
+            if (entry_name.startswith(prefix) and entry_name != name and
+                    not entry_name.endswith(PARTIAL_SUFFIX)):
+                LOG.debug('Removing outdated image file cache entry %s.',
+                          entry_name)
+                fileutils.delete_if_exists(
+                    os.path.join(self.cache_dir, entry_name))
+
+    def _remove_entry(self, name):
+        image_id = name.split('.', 1)[0]
+
+        @utils.synchronized('image-file-cache-%s' % image_id, external=True)
+        def _remove():
+            LOG.debug('Evicting image file cache entry %s.', name)
+            fileutils.delete_if_exists(os.path.join(self.cache_dir, name))
+
+        _remove()
+
+    def _evict(self):
+        """Remove the least recently used entries above the maximum size."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(PARTIAL_SUFFIX):
+                continue
+            try:
+                entry_stat = os.stat(os.path.join(self.cache_dir, name))
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+                continue
+            entries.append((entry_stat.st_mtime, name, entry_stat.st_size))
+
+        total_size = sum(size for _mtime, _name, size in entries)
+        for _mtime, name, size in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            self._remove_entry(name)
+            total_size -= size
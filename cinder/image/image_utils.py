@@ -26,11 +26,15 @@ we should look at maybe pushing this up to Oslo
 
 import contextlib
 import errno
+import hashlib
 import math
 import os
 import re
 import tempfile
 
+import eventlet
+from eventlet import queue
+from eventlet import tpool
 from oslo_concurrency import processutils
 from oslo_config import cfg
 from oslo_log import log as logging
@@ -42,6 +46,7 @@ import psutil
 
 from cinder import exception
 from cinder.i18n import _
+from cinder.image import file_cache
 from cinder import utils
 from cinder.volume import throttling
 from cinder.volume import utils as volume_utils
@@ -51,7 +56,24 @@ LOG = logging.getLogger(__name__)
 image_helper_opts = [cfg.StrOpt('image_conversion_dir',
                                 default='$state_path/conversion',
                                 help='Directory used for temporary storage '
-                                'during image conversion'), ]
+                                'during image conversion'),
+                     cfg.BoolOpt('image_stream_raw_download',
+                                 default=False,
+                                 help='Write raw images downloaded from '
+                                 'Glance straight to raw volumes, checking '
+                                 'their checksum and that they do not hold '
+                                 'the header of another format while they '
+                                 'are downloaded, instead of downloading '
+                                 'them to image_conversion_dir and '
+                                 'converting them with qemu-img.'),
+                     cfg.BoolOpt('image_upload_stream_raw',
+                                 default=True,
+                                 help='Upload volumes to raw images by '
+                                 'reading their data where it is stored '
+                                 'while it is uploaded, skipping the holes '
+                                 'of volume files, instead of converting '
+                                 'them to image_conversion_dir first when '
+                                 'they are not raw.'), ]
 
 CONF = cfg.CONF
 CONF.register_opts(image_helper_opts)
@@ -71,9 +93,38 @@ QEMU_IMG_FORMAT_MAP = {
 }
 QEMU_IMG_FORMAT_MAP_INV = {v: k for k, v in QEMU_IMG_FORMAT_MAP.items()}
 
+# Headers that qemu-img would detect at the start of an image that is
+# supposed to be raw, with their offset.  LUKS is left out since encrypted
+# volumes are uploaded as raw images.
+DISK_FORMAT_SIGNATURES = (
+    ('qcow2', 0, b'QFI\xfb'),
+    ('qed', 0, b'QED\x00'),
+    ('vmdk', 0, b'KDMV'),
+    ('vmdk', 0, b'COWD'),
+    ('vmdk', 0, b'# Disk DescriptorFile'),
+    ('vhdx', 0, b'vhdxfile'),
+    ('vpc', 0, b'conectix'),
+    ('vdi', 64, b'\x7f\x10\xda\xbe'),
+    ('parallels', 0, b'WithoutFreeSpace'),
+    ('parallels', 0, b'WithouFreSpacExt'),
+    ('bochs', 0, b'Bochs Virtual HD Image'),
+    ('cloop', 0, b'#!/bin/sh\n#V2.0 Format\n'),
+)
+DISK_FORMAT_HEADER_SIZE = 512
+
+# Data of streamed images is written to volumes in blocks of this size
+STREAM_BUFFER_SIZE = 4 * units.Mi
+# Number of blocks of volume data read ahead of their upload to Glance
+UPLOAD_QUEUE_DEPTH = 4
+
 QEMU_IMG_VERSION = None
+# qemu-img info of the images fetched by TemporaryImages, which do not
+# change until they are deleted, so they are only inspected once.
+TEMPORARY_IMAGE_INFO = {}
 QEMU_IMG_MIN_FORCE_SHARE_VERSION = [2, 10, 0]
 QEMU_IMG_MIN_CONVERT_LUKS_VERSION = '2.10'
+QEMU_IMG_MIN_CONVERT_COROUTINES_VERSION = [2, 9, 0]
+QEMU_IMG_MIN_TARGET_IS_ZERO_VERSION = [5, 0, 0]
 
 
 def validate_disk_format(disk_format):
@@ -94,6 +145,10 @@ def from_qemu_img_disk_format(disk_format):
 
 def qemu_img_info(path, run_as_root=True, force_share=False):
     """Return an object containing the parsed output from qemu-img info."""
+    info = TEMPORARY_IMAGE_INFO.get(path)
+    if info is not None:
+        return info
+
     cmd = ['env', 'LC_ALL=C', 'qemu-img', 'info']
     if force_share:
         if qemu_img_supports_force_share():
@@ -115,6 +170,8 @@ def qemu_img_info(path, run_as_root=True, force_share=False):
     if info.file_format == 'luks':
         info.file_format = 'raw'
 
+    if path in TEMPORARY_IMAGE_INFO:
+        TEMPORARY_IMAGE_INFO[path] = info
     return info
 
 
@@ -141,7 +198,9 @@ def qemu_img_supports_force_share():
 
 def _get_qemu_convert_cmd(src, dest, out_format, src_format=None,
                           out_subformat=None, cache_mode=None,
-                          prefix=None, cipher_spec=None, passphrase_file=None):
+                          prefix=None, cipher_spec=None, passphrase_file=None,
+                          coroutines=None, out_of_order_writes=False,
+                          target_is_zero=False):
 
     if out_format == 'vhd':
         # qemu-img still uses the legacy vpc name
@@ -155,6 +214,16 @@ def _get_qemu_convert_cmd(src, dest, out_format, src_format=None,
     if cache_mode:
         cmd += ('-t', cache_mode)
 
+    if coroutines:
+        cmd += ('-m', str(coroutines))
+
+    if out_of_order_writes:
+        cmd.append('-W')
+
+    if target_is_zero:
+        # The target must already exist for qemu-img to trust it is zeroed
+        cmd += ('-n', '--target-is-zero')
+
     if out_subformat:
         cmd += ('-o', 'subformat=%s' % out_subformat)
 
@@ -204,9 +273,63 @@ def check_qemu_img_version(minimum_version):
         raise exception.VolumeBackendAPIException(data=_msg)
 
 
+class ConversionTuning(object):
+    """Tuning of the qemu-img conversions done by a volume backend."""
+
+    DEFAULT = None
+
+    @staticmethod
+    def set_default(tuning):
+        ConversionTuning.DEFAULT = tuning
+
+    @staticmethod
+    def get_default():
+        return ConversionTuning.DEFAULT or ConversionTuning()
+
+    def __init__(self, coroutines=0, out_of_order_writes=False,
+                 target_is_zero=False):
+        self.coroutines = coroutines
+        self.out_of_order_writes = out_of_order_writes
+        self.target_is_zero = target_is_zero
+
+    @staticmethod
+    def _supported(minimum_version, option):
+        qemu_version = get_qemu_img_version()
+        if qemu_version is not None and qemu_version >= minimum_version:
+            return True
+        LOG.warning('Ignoring image conversion option %(option)s, which '
+                    'requires qemu-img %(version)s or later.',
+                    {'option': option,
+                     'version': '.'.join(str(x) for x in minimum_version)})
+        return False
+
+    def get_convert_args(self, out_format, out_subformat=None,
+                         target_is_zero=False):
+        """Return the tuning arguments of _get_qemu_convert_cmd.
+
+        :param target_is_zero: whether the conversion writes to an existing
+                               volume that was just created, which reads as
+                               zeroes if the backend says so.
+        """
+        args = {}
+        if ((self.coroutines or self.out_of_order_writes) and
+                self._supported(QEMU_IMG_MIN_CONVERT_COROUTINES_VERSION,
+                                'coroutines and out-of-order writes')):
+            args['coroutines'] = self.coroutines
+            args['out_of_order_writes'] = self.out_of_order_writes
+        # Only raw targets can be written to in place without being created
+        if (target_is_zero and self.target_is_zero and
+                out_format == 'raw' and not out_subformat and
+                self._supported(QEMU_IMG_MIN_TARGET_IS_ZERO_VERSION,
+                                '--target-is-zero')):
+            args['target_is_zero'] = True
+        return args
+
+
 def _convert_image(prefix, source, dest, out_format,
                    out_subformat=None, src_format=None,
-                   run_as_root=True, cipher_spec=None, passphrase_file=None):
+                   run_as_root=True, cipher_spec=None, passphrase_file=None,
+                   target_is_zero=False, src_virtual_size=None):
     """Convert image to other format."""
 
     # Check whether O_DIRECT is supported and set '-t none' if it is
@@ -218,7 +341,8 @@ def _convert_image(prefix, source, dest, out_format,
     # flush properly and more efficiently than would be done
     # setting O_DIRECT, so check for that and skip the
     # setting for non BLK devs
-    if (utils.is_blk_device(dest) and
+    is_blk_dev = utils.is_blk_device(dest)
+    if (is_blk_dev and
             volume_utils.check_for_odirect_support(source,
                                                    dest,
                                                    'oflag=direct')):
@@ -227,6 +351,15 @@ def _convert_image(prefix, source, dest, out_format,
         # use default
         cache_mode = None
 
+    if target_is_zero and not is_blk_dev:
+        # Some drivers fetch images to an empty temporary file, which
+        # qemu-img cannot write to without creating it.
+        target_is_zero = os.path.isfile(dest) and os.path.getsize(dest) > 0
+
+    tuning = ConversionTuning.get_default().get_convert_args(
+        out_format, out_subformat=out_subformat,
+        target_is_zero=target_is_zero)
+
     cmd = _get_qemu_convert_cmd(source, dest,
                                 out_format=out_format,
                                 src_format=src_format,
@@ -234,7 +367,8 @@ def _convert_image(prefix, source, dest, out_format,
                                 cache_mode=cache_mode,
                                 prefix=prefix,
                                 cipher_spec=cipher_spec,
-                                passphrase_file=passphrase_file)
+                                passphrase_file=passphrase_file,
+                                **tuning)
 
     start_time = timeutils.utcnow()
     utils.execute(*cmd, run_as_root=run_as_root)
@@ -244,16 +378,18 @@ def _convert_image(prefix, source, dest, out_format,
     # some incredible event this is 0 (cirros image?) don't barf
     if duration < 1:
         duration = 1
-    try:
-        image_size = qemu_img_info(source,
-                                   run_as_root=run_as_root).virtual_size
-    except ValueError as e:
-        msg = ("The image was successfully converted, but image size "
-               "is unavailable. src %(src)s, dest %(dest)s. %(error)s")
-        LOG.info(msg, {"src": source,
-                       "dest": dest,
-                       "error": e})
-        return
+    image_size = src_virtual_size
+    if image_size is None:
+        try:
+            image_size = qemu_img_info(source,
+                                       run_as_root=run_as_root).virtual_size
+        except ValueError as e:
+            msg = ("The image was successfully converted, but image size "
+                   "is unavailable. src %(src)s, dest %(dest)s. %(error)s")
+            LOG.info(msg, {"src": source,
+                           "dest": dest,
+                           "error": e})
+            return
 
     fsz_mb = image_size / units.Mi
     mbps = (fsz_mb / duration)
@@ -270,7 +406,16 @@ def _convert_image(prefix, source, dest, out_format,
 
 def convert_image(source, dest, out_format, out_subformat=None,
                   src_format=None, run_as_root=True, throttle=None,
-                  cipher_spec=None, passphrase_file=None):
+                  cipher_spec=None, passphrase_file=None,
+                  target_is_zero=False, src_virtual_size=None):
+    """Convert an image with qemu-img.
+
+    :param target_is_zero: dest is a volume that was just created, whose
+                           zeroes need not be written if the backend's
+                           new volumes read as zeroes.
+    :param src_virtual_size: virtual size of source, when the caller already
+                             inspected it.
+    """
     if not throttle:
         throttle = throttling.Throttle.get_default()
     with throttle.subcommand(source, dest) as throttle_cmd:
@@ -281,7 +426,9 @@ def convert_image(source, dest, out_format, out_subformat=None,
                        src_format=src_format,
                        run_as_root=run_as_root,
                        cipher_spec=cipher_spec,
-                       passphrase_file=passphrase_file)
+                       passphrase_file=passphrase_file,
+                       target_is_zero=target_is_zero,
+                       src_virtual_size=src_virtual_size)
 
 
 def resize_image(source, size, run_as_root=False):
@@ -363,12 +510,32 @@ def get_qemu_data(image_id, has_meta, disk_format_raw, dest, run_as_root,
     return data
 
 
+def _fetch_from_file_cache(context, image_service, image_id, image_meta,
+                           path, user_id=None, project_id=None):
+    """Fetch an image through the image file cache of the node.
+
+    Returns False if the image is not cached, and has to be fetched.
+    """
+    cache = file_cache.ImageFileCache()
+    # XenServer images are coalesced in place once fetched
+    if not cache.enabled or not image_meta or is_xenserver_format(image_meta):
+        return False
+
+    def _download(cache_path):
+        fetch(context, image_service, image_id, cache_path, user_id,
+              project_id)
+
+    return cache.fetch(image_id, image_meta, path, _download)
+
+
 def fetch_verify_image(context, image_service, image_id, dest,
                        user_id=None, project_id=None, size=None,
                        run_as_root=True):
-    fetch(context, image_service, image_id, dest,
-          None, None)
     image_meta = image_service.show(context, image_id)
+    if not _fetch_from_file_cache(context, image_service, image_id,
+                                  image_meta, dest):
+        fetch(context, image_service, image_id, dest,
+              None, None)
 
     with fileutils.remove_path_on_error(dest):
         has_meta = False if not image_meta else True
@@ -405,6 +572,121 @@ def fetch_verify_image(context, image_service, image_id, dest,
                                                   reason=reason)
 
 
+def sniff_disk_format(header):
+    """Return the format whose header starts the given data, if any."""
+    header = bytes(header)
+    for disk_format, offset, signature in DISK_FORMAT_SIGNATURES:
+        if header[offset:offset + len(signature)] == signature:
+            return disk_format
+    return None
+
+
+def is_streamable_raw_image(image_meta):
+    """Return whether an image can be streamed to a raw volume."""
+    if not CONF.image_stream_raw_download or not image_meta:
+        return False
+    return (image_meta.get('disk_format') == 'raw' and
+            image_meta.get('container_format') in (None, 'bare') and
+            image_meta.get('size') is not None)
+
+
+def _check_raw_image_header(image_id, header):
+    disk_format = sniff_disk_format(header)
+    if disk_format is not None:
+        raise exception.ImageUnacceptable(
+            image_id=image_id,
+            reason=_("Raw image holds a %s header.") % disk_format)
+
+
+def _write_image_data(image_file, data, checksum):
+    if checksum is not None:
+        checksum.update(data)
+    image_file.write(data)
+
+
+def _sync_image_file(image_file):
+    image_file.flush()
+    os.fsync(image_file.fileno())
+
+
+@contextlib.contextmanager
+def _open_volume_for_write(path):
+    """Open a volume for writing, without truncating it."""
+    if os.name == 'nt' or os.access(path, os.W_OK):
+        with open(path, 'r+b') as volume_file:
+            yield volume_file
+    else:
+        with utils.temporary_chown(path):
+            with open(path, 'r+b') as volume_file:
+                yield volume_file
+
+
+def stream_raw_image(context, image_service, image_id, image_meta, dest,
+                     size=None):
+    """Write a raw image from Glance straight to a volume.
+
+    The image data is written in blocks of STREAM_BUFFER_SIZE bytes as it
+    is downloaded.  Nothing is written until the start of the image has
+    been checked for the header of another format, that could reference a
+    backing file, and the checksum and size of the image are verified once
+    it has been written.
+    """
+    image_size = image_meta['size']
+    if size is not None:
+        check_virtual_size(image_size, size, image_id)
+
+    checksum = None
+    if image_meta.get('checksum'):
+        checksum = hashlib.md5()
+
+    LOG.debug('Streaming raw image %(image)s to volume %(dest)s - '
+              'size: %(size)s', {'image': image_id, 'dest': dest,
+                                 'size': image_size})
+    start_time = timeutils.utcnow()
+    written = 0
+    header_checked = False
+    buf = bytearray()
+    with _open_volume_for_write(dest) as volume_file:
+        for chunk in image_service.download(context, image_id):
+            buf.extend(chunk)
+            if not header_checked:
+                if len(buf) < DISK_FORMAT_HEADER_SIZE:
+                    continue
+                _check_raw_image_header(image_id, buf)
+                header_checked = True
+            if len(buf) >= STREAM_BUFFER_SIZE:
+                tpool.execute(_write_image_data, volume_file, bytes(buf),
+                              checksum)
+                written += len(buf)
+                del buf[:]
+
+        if not header_checked:
+            _check_raw_image_header(image_id, buf)
+        if buf:
+            tpool.execute(_write_image_data, volume_file, bytes(buf),
+                          checksum)
+            written += len(buf)
+        tpool.execute(_sync_image_file, volume_file)
+
+    if written != image_size:
+        reason = (_("Image %(image_id)s is %(size)s bytes but %(written)s "
+                    "bytes were downloaded.") %
+                  {'image_id': image_id, 'size': image_size,
+                   'written': written})
+        raise exception.ImageCopyFailure(reason=reason)
+    if checksum is not None and checksum.hexdigest() != image_meta['checksum']:
+        reason = (_("Checksum of image %(image_id)s is %(checksum)s but "
+                    "%(expected)s was expected.") %
+                  {'image_id': image_id, 'checksum': checksum.hexdigest(),
+                   'expected': image_meta['checksum']})
+        raise exception.ImageCopyFailure(reason=reason)
+
+    duration = max(1, timeutils.delta_seconds(start_time, timeutils.utcnow()))
+    fsz_mb = written / units.Mi
+    LOG.info("Image streamed %(sz).2f MB at %(mbps).2f MB/s",
+             {'sz': fsz_mb, 'mbps': fsz_mb / duration})
+
+
 def fetch_to_vhd(context, image_service,
                  image_id, dest, blocksize,
                  user_id=None, project_id=None, run_as_root=True):
@@ -428,6 +710,14 @@ def fetch_to_volume_format(context, image_service,
     qemu_img = True
     image_meta = image_service.show(context, image_id)
 
+    tmp_images = TemporaryImages.for_image_service(image_service)
+    if (volume_format == 'raw' and not volume_subformat and
+            is_streamable_raw_image(image_meta) and
+            not tmp_images.get(context, image_id)):
+        stream_raw_image(context, image_service, image_id, image_meta, dest,
+                         size=size)
+        return
+
     # NOTE(avishay): I'm not crazy about creating temp files which may be
     # large and cause disk full errors which would confuse users.
     # Unfortunately it seems that you can't pipe to 'qemu-img convert' because
@@ -438,16 +728,19 @@ def fetch_to_volume_format(context, image_service,
             format_raw = True if image_meta['disk_format'] == 'raw' else False
         except TypeError:
             format_raw = False
+        # Images fetched by TemporaryImages were already inspected, which
+        # tells whether qemu-img works as well as the empty tmp file would.
+        tmp_image = tmp_images.get(context, image_id)
         data = get_qemu_data(image_id, has_meta, format_raw,
-                             tmp, run_as_root)
+                             tmp_image or tmp, run_as_root)
         if data is None:
             qemu_img = False
 
-        tmp_images = TemporaryImages.for_image_service(image_service)
-        tmp_image = tmp_images.get(context, image_id)
         if tmp_image:
             tmp = tmp_image
-        else:
+        elif not _fetch_from_file_cache(context, image_service, image_id,
+                                        image_meta, tmp, user_id,
+                                        project_id):
             fetch(context, image_service, image_id, tmp, user_id, project_id)
 
         if is_xenserver_format(image_meta):
@@ -503,10 +796,13 @@ def fetch_to_volume_format(context, image_service,
         LOG.debug("%s was %s, converting to %s ", image_id, fmt, volume_format)
         disk_format = fixup_disk_format(image_meta['disk_format'])
 
+        # Images are only fetched to volumes that were just created
         convert_image(tmp, dest, volume_format,
                       out_subformat=volume_subformat,
                       src_format=disk_format,
-                      run_as_root=run_as_root)
+                      run_as_root=run_as_root,
+                      target_is_zero=True,
+                      src_virtual_size=data.virtual_size)
 
 
 def _validate_file_format(image_data, expected_format):
@@ -518,19 +814,185 @@ def _validate_file_format(image_data, expected_format):
     return False
 
 
+@contextlib.contextmanager
+def _open_volume_for_read(path):
+    if os.name == 'nt' or os.access(path, os.R_OK):
+        with open(path, 'rb') as volume_file:
+            yield volume_file
+    else:
+        with utils.temporary_chown(path):
+            with open(path, 'rb') as volume_file:
+                yield volume_file
+
+
+def _get_volume_data_map(path, volume_format, run_as_root=True):
+    """Return where the data of a volume file is stored.
+
+    Returns the (start, length, offset) extents of the volume that hold
+    data, in order, with their offset in path, or None if some data is not
+    stored as is in path, like compressed clusters.  The rest of the volume
+    reads as zeroes, since volumes with backing files are not uploaded.
+    """
+    try:
+        out, _err = utils.execute('qemu-img', 'map', '-f', volume_format,
+                                  path, run_as_root=run_as_root,
+                                  prlimit=QEMU_IMG_LIMITS)
+    except processutils.ProcessExecutionError as e:
+        LOG.debug('Cannot map the data of %(path)s: %(error)s',
+                  {'path': path, 'error': e})
+        return None
+
+    extents = []
+    # Skip the "Offset Length Mapped to File" header
+    for line in out.splitlines()[1:]:
+        if not line.strip():
+            continue
+        fields = line.split(None, 3)
+        # Data in another file, like an external data file
+        if len(fields) != 4 or fields[3] != path:
+            return None
+        extents.append(tuple(int(field, 16) for field in fields[:3]))
+    return extents
+
+
+def _read_at(volume_file, offset, length):
+    volume_file.seek(offset)
+    return volume_file.read(length)
+
+
+def _read_volume_data(volume_file, size, extents):
+    """Yield the raw data of a volume, in blocks of STREAM_BUFFER_SIZE."""
+    zeroes = None
+    position = 0
+    for start, length, offset in extents + [(size, 0, None)]:
+        while position < start:
+            if zeroes is None:
+                zeroes = b'\0' * STREAM_BUFFER_SIZE
+            block = min(STREAM_BUFFER_SIZE, start - position)
+            yield zeroes[:block]
+            position += block
+        end = min(start + length, size)
+        while position < end:
+            block = min(STREAM_BUFFER_SIZE, end - position)
+            data = tpool.execute(_read_at, volume_file,
+                                 offset + position - start, block)
+            if len(data) != block:
+                reason = (_("Read %(read)d bytes at offset %(offset)d of "
+                            "volume file %(path)s instead of %(length)d.") %
+                          {'read': len(data),
+                           'offset': offset + position - start,
+                           'path': volume_file.name, 'length': block})
+                raise exception.ImageCopyFailure(reason=reason)
+            yield data
+            position += block
+
+
+class _VolumeDataStream(object):
+    """File-like object of volume data uploaded to Glance.
+
+    The data is produced by a green thread, at most UPLOAD_QUEUE_DEPTH
+    blocks ahead of the upload, so that reading the volume overlaps with
+    sending its data.
+    """
+
+    def __init__(self, blocks):
+        self._queue = queue.LightQueue(UPLOAD_QUEUE_DEPTH)
+        self._block = b''
+        self._position = 0
+        self._eof = False
+        self._producer = eventlet.spawn(self._produce, blocks)
+
+    def _produce(self, blocks):
+        try:
+            for block in blocks:
+                self._queue.put(block)
+        except Exception as e:
+            self._queue.put(e)
+        else:
+            self._queue.put(None)
+
+    def _next_block(self):
+        self._block = self._queue.get()
+        self._position = 0
+        if self._block is None or isinstance(self._block, Exception):
+            error, self._block = self._block, b''
+            self._eof = True
+            if error is not None:
+                raise error
+
+    def read(self, size=-1):
+        while self._position == len(self._block) and not self._eof:
+            self._next_block()
+        if size is None or size < 0:
+            blocks = [self._block[self._position:]]
+            while not self._eof:
+                self._next_block()
+                blocks.append(self._block)
+            self._block, self._position = b'', 0
+            return b''.join(blocks)
+        data = self._block[self._position:self._position + size]
+        self._position += len(data)
+        return data
+
+    def close(self):
+        self._producer.kill()
+
+
+def _stream_volume_upload(context, image_service, image_id, volume_path,
+                          volume_format, run_as_root=True, size=None):
+    """Upload the raw data of a volume while it is read.
+
+    Only the extents of volume files holding data are read.  Returns False
+    if the data of the volume is not stored as is in its file, in which
+    case it must be converted before it is uploaded.
+    """
+    with _open_volume_for_read(volume_path) as volume_file:
+        if size is None:
+            volume_file.seek(0, os.SEEK_END)
+            size = volume_file.tell()
+        if volume_format == 'raw' and utils.is_blk_device(volume_path):
+            extents = [(0, size, 0)]
+        else:
+            extents = _get_volume_data_map(volume_path, volume_format,
+                                           run_as_root=run_as_root)
+        if extents is None:
+            if volume_format != 'raw':
+                return False
+            extents = [(0, size, 0)]
+
+        LOG.debug('Streaming %(size)d bytes of volume %(path)s to image '
+                  '%(image_id)s, %(data)d of which are data.',
+                  {'size': size, 'path': volume_path, 'image_id': image_id,
+                   'data': sum(length for _start, length, _offset
+                               in extents)})
+        start_time = timeutils.utcnow()
+        stream = _VolumeDataStream(_read_volume_data(volume_file, size,
+                                                     extents))
+        try:
+            image_service.update(context, image_id, {}, stream)
+        finally:
+            stream.close()
+
+    duration = max(1, timeutils.delta_seconds(start_time, timeutils.utcnow()))
+    fsz_mb = size / units.Mi
+    LOG.info("Volume uploaded %(sz).2f MB at %(mbps).2f MB/s",
+             {'sz': fsz_mb, 'mbps': fsz_mb / duration})
+    return True
+
+
 def upload_volume(context, image_service, image_meta, volume_path,
                   volume_format='raw', run_as_root=True):
     image_id = image_meta['id']
     if (image_meta['disk_format'] == volume_format):
         LOG.debug("%s was %s, no need to convert to %s",
                   image_id, volume_format, image_meta['disk_format'])
-        if os.name == 'nt' or os.access(volume_path, os.R_OK):
-            with open(volume_path, 'rb') as image_file:
-                image_service.update(context, image_id, {}, image_file)
-        else:
-            with utils.temporary_chown(volume_path):
-                with open(volume_path, 'rb') as image_file:
-                    image_service.update(context, image_id, {}, image_file)
+        if volume_format == 'raw' and CONF.image_upload_stream_raw:
+            _stream_volume_upload(context, image_service, image_id,
+                                  volume_path, volume_format,
+                                  run_as_root=run_as_root)
+            return
+        with _open_volume_for_read(volume_path) as image_file:
+            image_service.update(context, image_id, {}, image_file)
         return
 
     with temporary_file() as tmp:
@@ -551,8 +1013,16 @@ def upload_volume(context, image_service, image_meta, volume_path,
                 % {'fmt': fmt, 'backing_file': backing_file})
 
         out_format = fixup_disk_format(image_meta['disk_format'])
+        if (out_format == 'raw' and CONF.image_upload_stream_raw and
+                _stream_volume_upload(context, image_service, image_id,
+                                      volume_path, fmt,
+                                      run_as_root=run_as_root,
+                                      size=data.virtual_size)):
+            return
+
         convert_image(volume_path, tmp, out_format,
-                      run_as_root=run_as_root)
+                      run_as_root=run_as_root,
+                      src_virtual_size=data.virtual_size)
 
         data = qemu_img_info(tmp, run_as_root=run_as_root)
         if data.file_format != out_format:
@@ -715,6 +1185,9 @@ def replace_xenserver_image_with_coalesced_vhd(image_file):
         coalesced = coalesce_chain(chain)
         fileutils.delete_if_exists(image_file)
         os.rename(coalesced, image_file)
+    # The info of the tarball doesn't describe the coalesced image
+    if image_file in TEMPORARY_IMAGE_INFO:
+        TEMPORARY_IMAGE_INFO[image_file] = None
 
 
 def decode_cipher(cipher_spec, key_size):
@@ -758,15 +1231,19 @@ class TemporaryImages(object):
     def fetch(cls, image_service, context, image_id, suffix=''):
         tmp_images = cls.for_image_service(image_service).temporary_images
         with temporary_file(suffix=suffix) as tmp:
-            fetch_verify_image(context, image_service, image_id, tmp)
-            user = context.user_id
-            if not tmp_images.get(user):
-                tmp_images[user] = {}
-            tmp_images[user][image_id] = tmp
-            LOG.debug("Temporary image %(id)s is fetched for user %(user)s.",
-                      {'id': image_id, 'user': user})
-            yield tmp
-            del tmp_images[user][image_id]
+            TEMPORARY_IMAGE_INFO[tmp] = None
+            try:
+                fetch_verify_image(context, image_service, image_id, tmp)
+                user = context.user_id
+                if not tmp_images.get(user):
+                    tmp_images[user] = {}
+                tmp_images[user][image_id] = tmp
+                LOG.debug("Temporary image %(id)s is fetched for user "
+                          "%(user)s.", {'id': image_id, 'user': user})
+                yield tmp
+                del tmp_images[user][image_id]
+            finally:
+                TEMPORARY_IMAGE_INFO.pop(tmp, None)
         LOG.debug("Temporary image %(id)s for user %(user)s is deleted.",
                   {'id': image_id, 'user': user})
 
@@ -52,6 +52,9 @@ This module provides Manager, a base class for managers.
 """
 
 
+import copy
+import time
+
 from oslo_config import cfg
 from oslo_log import log as logging
 import oslo_messaging as messaging
@@ -66,12 +69,14 @@ from cinder import objects
 from cinder import rpc
 from cinder.scheduler import rpcapi as scheduler_rpcapi
 from cinder import utils
+from cinder.volume import utils as vol_utils
 
 from eventlet import greenpool
 from eventlet import tpool
 
 
 CONF = cfg.CONF
+CONF.import_opt('capabilities_full_report_interval', 'cinder.service')
 LOG = logging.getLogger(__name__)
 
 
@@ -179,6 +184,12 @@ class SchedulerDependentManager(ThreadPoolManager):
     def __init__(self, host=None, db_driver=None, service_name='undefined',
                  cluster=None):
         self.last_capabilities = None
+        # Capabilities last sent to the schedulers and their version.  The
+        # version starts from the current time so it keeps increasing across
+        # restarts.
+        self._sent_capabilities = None
+        self._capabilities_version = int(time.time() * 1000)
+        self._delta_reports = 0
         self.service_name = service_name
         self.scheduler_rpcapi = scheduler_rpcapi.SchedulerAPI()
         super(SchedulerDependentManager, self).__init__(host, db_driver,
@@ -188,16 +199,47 @@ class SchedulerDependentManager(ThreadPoolManager):
         """Remember these capabilities to send on next periodic update."""
         self.last_capabilities = capabilities
 
+    def request_full_capabilities(self, context):
+        """Send the full capabilities to the schedulers right away.
+
+        Called by a scheduler that missed a delta report.
+        """
+        self._sent_capabilities = None
+        self._publish_service_capabilities(context)
+
+    def _get_capabilities_delta(self):
+        """Return the delta to send to the schedulers or None."""
+        interval = CONF.capabilities_full_report_interval
+        if (not interval or self.cluster or self._sent_capabilities is None
+                or self._delta_reports >= interval
+                or not self.scheduler_rpcapi.can_send_capabilities_delta()):
+            return None
+        return vol_utils.get_capabilities_delta(self._sent_capabilities,
+                                                self.last_capabilities)
+
     def _publish_service_capabilities(self, context):
         """Pass data back to the scheduler at a periodic interval."""
         if self.last_capabilities:
             LOG.debug('Notifying Schedulers of capabilities ...')
+            delta = self._get_capabilities_delta()
+            base_version = self._capabilities_version
+            self._capabilities_version += 1
+            if delta is None:
+                self._delta_reports = 0
+                capabilities = self.last_capabilities
+                base_version = None
+            else:
+                self._delta_reports += 1
+                capabilities = delta
             self.scheduler_rpcapi.update_service_capabilities(
                 context,
                 self.service_name,
                 self.host,
-                self.last_capabilities,
-                self.cluster)
+                capabilities,
+                self.cluster,
+                capabilities_version=self._capabilities_version,
+                base_version=base_version)
+            self._sent_capabilities = copy.deepcopy(self.last_capabilities)
             try:
                 self.scheduler_rpcapi.notify_service_capabilities(
                     context,
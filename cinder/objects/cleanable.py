@@ -195,6 +195,10 @@ class CinderCleanableObject(base.CinderPersistentObject):
                 else:
                     candidates = list(args)
                     candidates.extend(kwargs.values())
+                # Lists of objects, like the volumes of batch requests
+                candidates = [obj for cand in candidates
+                              for obj in (cand if isinstance(cand, list)
+                                          else [cand])]
                 cleanables = [cand for cand in candidates
                               if (isinstance(cand, CinderCleanableObject)
                                   and cand.is_cleanable(pinned=False))]
@@ -51,14 +51,19 @@ from cinder import context as cinder_context
 from cinder import coordination as cinder_coordination
 from cinder.db import api as cinder_db_api
 from cinder.db import base as cinder_db_base
+from cinder.image import file_cache as cinder_image_filecache
 from cinder.image import glance as cinder_image_glance
 from cinder.image import image_utils as cinder_image_imageutils
 from cinder.keymgr import conf_key_mgr as cinder_keymgr_confkeymgr
 from cinder.message import api as cinder_message_api
 from cinder import quota as cinder_quota
+from cinder.scheduler import claims as cinder_scheduler_claims
 from cinder.scheduler import driver as cinder_scheduler_driver
+from cinder.scheduler.filters import instance_locality_filter as \
+    cinder_scheduler_filters_instancelocalityfilter
 from cinder.scheduler import host_manager as cinder_scheduler_hostmanager
 from cinder.scheduler import manager as cinder_scheduler_manager
+from cinder.scheduler import metrics as cinder_scheduler_metrics
 from cinder.scheduler import scheduler_options as \
     cinder_scheduler_scheduleroptions
 from cinder.scheduler.weights import capacity as \
@@ -232,14 +237,19 @@ def list_opts():
                 cinder_context.context_opts,
                 cinder_db_api.db_opts,
                 [cinder_db_base.db_driver_opt],
+                cinder_image_filecache.image_file_cache_opts,
                 cinder_image_glance.glance_opts,
                 cinder_image_glance.glance_core_properties_opts,
                 cinder_image_imageutils.image_helper_opts,
                 cinder_message_api.messages_opts,
                 cinder_quota.quota_opts,
+                cinder_scheduler_claims.claims_opts,
                 cinder_scheduler_driver.scheduler_driver_opts,
+                cinder_scheduler_filters_instancelocalityfilter.
+                instance_locality_opts,
                 cinder_scheduler_hostmanager.host_manager_opts,
                 [cinder_scheduler_manager.scheduler_driver_opt],
+                cinder_scheduler_metrics.metrics_opts,
                 [cinder_scheduler_scheduleroptions.
                     scheduler_json_config_location_opt],
                 cinder_scheduler_weights_capacity.capacity_weight_opts,
@@ -17,14 +17,27 @@
 Filter support
 """
 from oslo_log import log as logging
+from oslo_utils import timeutils
 
 from cinder.scheduler import base_handler
+from cinder.scheduler import metrics
 
 LOG = logging.getLogger(__name__)
 
 
 class BaseFilter(object):
     """Base class for all filter classes."""
+    def prepare(self, filter_properties):
+        """Precompute the data of a request needed to filter the objects.
+
+        Called once per request before filtering, so work that doesn't
+        depend on the objects is not repeated for each one of them.  The
+        filter handler calls it on an instance only used by that request.
+
+        Override this in a subclass.
+        """
+        pass
+
     def _filter_one(self, obj, filter_properties):
         """Return True if it passes the filter, False otherwise.
 
@@ -103,11 +116,16 @@ class BaseFilterHandler(base_handler.BaseHandler):
         for filter_cls in filter_classes:
             cls_name = filter_cls.__name__
             start_count = len(list_objs)
-            filter_class = filter_cls()
+            filter_class = self.get_instance(filter_cls)
 
             if filter_class.run_filter_for_index(index):
+                watch = timeutils.StopWatch()
+                watch.start()
+                filter_class.prepare(filter_properties)
                 objs = filter_class.filter_all(list_objs, filter_properties)
                 if objs is None:
+                    metrics.record('filter.%s' % cls_name, watch.elapsed(),
+                                   '%d -> 0' % start_count)
                     LOG.info("Filter %s returned 0 hosts", cls_name)
                     full_filter_results.append((cls_name, None))
                     list_objs = None
@@ -115,6 +133,8 @@ class BaseFilterHandler(base_handler.BaseHandler):
 
                 list_objs = list(objs)
                 end_count = len(list_objs)
+                metrics.record('filter.%s' % cls_name, watch.elapsed(),
+                               '%d -> %d' % (start_count, end_count))
                 part_filter_results.append((cls_name, start_count, end_count))
                 remaining = [getattr(obj, "host", obj)
                              for obj in list_objs]
@@ -19,6 +19,7 @@ A common base for handling extension classes.
 Used by BaseFilterHandler and BaseWeightHandler
 """
 
+import copy
 import inspect
 
 from stevedore import extension
@@ -30,6 +31,7 @@ class BaseHandler(object):
         self.namespace = modifier_namespace
         self.modifier_class_type = modifier_class_type
         self.extension_manager = extension.ExtensionManager(modifier_namespace)
+        self._instances = {}
 
     def _is_correct_class(self, cls):
         """Return whether an object is a class of the correct type.
@@ -45,3 +47,15 @@ class BaseHandler(object):
         # and also be returned by a function such as 'all_filters' for example
         return [ext.plugin for ext in self.extension_manager if
                 self._is_correct_class(ext.plugin)]
+
+    def get_instance(self, cls):
+        """Return an instance of a filter or weigher class for one request.
+
+        Each class is only instantiated once, and every request gets a
+        shallow copy of that instance, so the data of the request can be
+        stored in it without affecting the requests running concurrently.
+        """
+        instance = self._instances.get(cls)
+        if instance is None:
+            instance = self._instances[cls] = cls()
+        return copy.copy(instance)
@@ -19,9 +19,11 @@ Pluggable Weighing support
 
 import abc
 
+from oslo_utils import timeutils
 import six
 
 from cinder.scheduler import base_handler
+from cinder.scheduler import metrics
 
 
 def normalize(weight_list, minval=None, maxval=None):
@@ -76,6 +78,17 @@ class BaseWeigher(object):
     minval = None
     maxval = None
 
+    def prepare(self, weight_properties):
+        """Precompute the data of a request needed to weigh the objects.
+
+        Called once per request before weighing, so work that doesn't
+        depend on the objects is not repeated for each one of them.  The
+        weight handler calls it on an instance only used by that request.
+
+        Override this in a subclass.
+        """
+        pass
+
     def weight_multiplier(self):
         """How weighted this weigher should be.
 
@@ -130,8 +143,13 @@ class BaseWeightHandler(base_handler.BaseHandler):
 
         weighed_objs = [self.object_class(obj, 0.0) for obj in obj_list]
         for weigher_cls in weigher_classes:
-            weigher = weigher_cls()
+            watch = timeutils.StopWatch()
+            watch.start()
+            weigher = self.get_instance(weigher_cls)
+            weigher.prepare(weighing_properties)
             weights = weigher.weigh_objects(weighed_objs, weighing_properties)
+            metrics.record('weigher.%s' % weigher_cls.__name__,
+                           watch.elapsed())
 
             # Normalize the weights
             weights = normalize(weights,
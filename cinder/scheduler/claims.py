@@ -0,0 +1,191 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Stores for the capacity the schedulers claim on the backends.
+
+A scheduler only consumes capacity from its own in-memory view of the
+backends, so when several schedulers are running each one places volumes
+using the free capacity reported by the backends, ignoring what the other
+schedulers have placed since then.  Sharing the claims through a store lets
+every scheduler subtract the capacity the others have claimed after the last
+capability report of each backend.
+"""
+
+import collections
+import datetime
+
+from oslo_config import cfg
+from oslo_utils import importutils
+from oslo_utils import timeutils
+from oslo_utils import uuidutils
+from tooz import coordination as tooz_coordination
+
+from cinder import context
+from cinder import coordination
+from cinder import db
+
+
+claims_opts = [
+    cfg.StrOpt('scheduler_claims_store',
+               help='Class of the store used to share the capacity claimed '
+                    'on the backends between schedulers, needed when running '
+                    'more than one scheduler to avoid placing volumes using '
+                    'stale free capacity. It can be '
+                    'cinder.scheduler.claims.DBClaimsStore or '
+                    'cinder.scheduler.claims.ToozClaimsStore, that uses the '
+                    'coordination backend_url. Claims are not shared by '
+                    'default.'),
+    cfg.IntOpt('scheduler_claims_ttl',
+               default=300,
+               min=1,
+               help='Number of seconds after which a capacity claim is '
+                    'dropped, even if the backend has not reported its '
+                    'capabilities since it was made.'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(claims_opts)
+
+
+Claim = collections.namedtuple('Claim', ['backend', 'size', 'created_at'])
+
+
+def get_claims_store():
+    """Return the configured claims store, or None if there is none."""
+    if not CONF.scheduler_claims_store:
+        return None
+    return importutils.import_object(CONF.scheduler_claims_store)
+
+
+class ClaimsStore(object):
+    """Base class for the stores of capacity claims shared by schedulers."""
+
+    def __init__(self):
+        # Identifies the claims made by this scheduler
+        self.scheduler_id = uuidutils.generate_uuid()
+
+    @staticmethod
+    def _expiration():
+        """Return the creation time before which claims have expired."""
+        return timeutils.utcnow() - datetime.timedelta(
+            seconds=CONF.scheduler_claims_ttl)
+
+    def add(self, backend, size):
+        """Record that this scheduler has claimed size GB on a backend."""
+        raise NotImplementedError()
+
+    def get_all(self):
+        """Return the non expired claims made by the other schedulers."""
+        raise NotImplementedError()
+
+    def cleanup(self):
+        """Remove the expired claims."""
+        pass
+
+
+class DBClaimsStore(ClaimsStore):
+    """Store the claims in the scheduler_claims table."""
+
+    def __init__(self):
+        super(DBClaimsStore, self).__init__()
+        self.context = context.get_admin_context()
+
+    def add(self, backend, size):
+        db.scheduler_claim_create(self.context,
+                                  {'backend': backend,
+                                   'size': size,
+                                   'scheduler': self.scheduler_id})
+
+    def get_all(self):
+        claims = db.scheduler_claim_get_all(self.context, self._expiration())
+        return [Claim(claim.backend, claim.size, claim.created_at)
+                for claim in claims if claim.scheduler != self.scheduler_id]
+
+    def cleanup(self):
+        db.cleanup_expired_scheduler_claims(self.context, self._expiration())
+
+
+class ToozClaimsStore(ClaimsStore):
+    """Store the claims in the coordination backend.
+
+    Each scheduler joins a group and publishes its own claims as the
+    capabilities of its member, so claims of a scheduler that stops go away
+    with its membership.
+    """
+
+    GROUP = b'cinder-scheduler-claims'
+
+    def __init__(self):
+        super(ToozClaimsStore, self).__init__()
+        self.coordinator = coordination.Coordinator(
+            agent_id=self.scheduler_id, prefix='cinder-scheduler-')
+        self.member_id = (self.coordinator.prefix +
+                          self.scheduler_id).encode('ascii')
+        self.claims = []
+        self.joined = False
+
+    def _join(self):
+        if self.joined:
+            return
+        self.coordinator.start()
+        try:
+            self.coordinator.coordinator.create_group(self.GROUP).get()
+        except tooz_coordination.GroupAlreadyExist:
+            pass
+        try:
+            self.coordinator.coordinator.join_group(
+                self.GROUP, self._serialize()).get()
+        except tooz_coordination.MemberAlreadyExist:
+            pass
+        self.joined = True
+
+    def _serialize(self):
+        return [[claim.backend, claim.size,
+                 claim.created_at.strftime(timeutils.PERFECT_TIME_FORMAT)]
+                for claim in self.claims]
+
+    def add(self, backend, size):
+        self._join()
+        expiration = self._expiration()
+        self.claims = [claim for claim in self.claims
+                       if claim.created_at > expiration]
+        self.claims.append(Claim(backend, size, timeutils.utcnow()))
+        self.coordinator.coordinator.update_capabilities(
+            self.GROUP, self._serialize()).get()
+
+    def get_all(self):
+        self._join()
+        coordinator = self.coordinator.coordinator
+        members = coordinator.get_members(self.GROUP).get()
+        # Request the capabilities of all members before waiting for them
+        requests = [coordinator.get_member_capabilities(self.GROUP, member)
+                    for member in members if member != self.member_id]
+
+        expiration = self._expiration()
+        result = []
+        for request in requests:
+            try:
+                claims = request.get()
+            except tooz_coordination.MemberNotJoined:
+                continue
+            for backend, size, created_at in claims or []:
+                created_at = datetime.datetime.strptime(
+                    created_at, timeutils.PERFECT_TIME_FORMAT)
+                if created_at > expiration:
+                    result.append(Claim(backend, size, created_at))
+        return result
+
+    def cleanup(self):
+        expiration = self._expiration()
+        self.claims = [claim for claim in self.claims
+                       if claim.created_at > expiration]
@@ -79,6 +79,7 @@ class Scheduler(object):
     def reset(self):
         """Reset volume RPC API object to load new version pins."""
         self.volume_rpcapi = volume_rpcapi.VolumeAPI()
+        self.host_manager.invalidate_services()
 
     def is_ready(self):
         """Returns True if Scheduler is ready to accept requests.
@@ -90,13 +91,17 @@ class Scheduler(object):
         return self.host_manager.has_all_capabilities()
 
     def update_service_capabilities(self, service_name, host, capabilities,
-                                    cluster_name, timestamp):
-        """Process a capability update from a service node."""
-        self.host_manager.update_service_capabilities(service_name,
-                                                      host,
-                                                      capabilities,
-                                                      cluster_name,
-                                                      timestamp)
+                                    cluster_name, timestamp,
+                                    capabilities_version=None,
+                                    base_version=None):
+        """Process a capability update from a service node.
+
+        Returns False if the update is a delta that can't be applied.
+        """
+        return self.host_manager.update_service_capabilities(
+            service_name, host, capabilities, cluster_name, timestamp,
+            capabilities_version=capabilities_version,
+            base_version=base_version)
 
     def notify_service_capabilities(self, service_name, backend,
                                     capabilities, timestamp):
@@ -130,6 +135,26 @@ class Scheduler(object):
         """Must override schedule method for scheduler to work."""
         raise NotImplementedError(_("Must implement schedule_create_volume"))
 
+    def schedule_create_volumes(self, context, request_spec_list,
+                                filter_properties_list):
+        """Schedule a batch of homogeneous volume creation requests.
+
+        Returns a list with the exception of each request that couldn't be
+        placed, or None for those that were placed.  Schedulers that can't
+        place them in a single pass schedule them one by one.
+        """
+        results = []
+        for request_spec, filter_properties in zip(request_spec_list,
+                                                   filter_properties_list):
+            try:
+                self.schedule_create_volume(context, request_spec,
+                                            filter_properties)
+            except Exception as e:
+                results.append(e)
+            else:
+                results.append(None)
+        return results
+
     def schedule_create_group(self, context, group,
                               group_spec,
                               request_spec_list,
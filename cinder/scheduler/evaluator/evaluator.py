@@ -13,6 +13,7 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
 import operator
 import re
 
@@ -272,6 +273,56 @@ def _def_parser():
     return expr
 
 
+class Expression(object):
+    """An expression parsed once and evaluated as many times as needed."""
+
+    def __init__(self, expression):
+        global _parser
+        if _parser is None:
+            _parser = _def_parser()
+
+        self.expression = expression
+        try:
+            self._result = _parser.parseString(expression, parseAll=True)[0]
+        except pyparsing.ParseException as e:
+            raise exception.EvaluatorParseException(
+                _("ParseException: %s") % e)
+
+    def evaluate(self, **kwargs):
+        """Evaluates the expression with the variables in kwargs."""
+        global _vars
+        _vars = kwargs
+
+        return self._result.eval()
+
+
+# Parsed expressions, or the errors raised parsing them, by expression text in
+# least recently used order.
+_expressions = collections.OrderedDict()
+_EXPRESSIONS_CACHE_SIZE = 512
+
+
+def compile_expression(expression):
+    """Returns the Expression for a string, parsing it only once.
+
+    :raises EvaluatorParseException: if expression is not valid
+    """
+    try:
+        compiled = _expressions.pop(expression)
+    except KeyError:
+        try:
+            compiled = Expression(expression)
+        except exception.EvaluatorParseException as e:
+            compiled = e
+        while len(_expressions) >= _EXPRESSIONS_CACHE_SIZE:
+            _expressions.popitem(last=False)
+    _expressions[expression] = compiled
+
+    if isinstance(compiled, exception.EvaluatorParseException):
+        raise exception.EvaluatorParseException(*compiled.args)
+    return compiled
+
+
 def evaluate(expression, **kwargs):
     """Evaluates an expression.
 
@@ -280,18 +331,7 @@ def evaluate(expression, **kwargs):
 
     Supports both integer and floating point values, and automatic
     promotion where necessary.
-    """
-    global _parser
-    if _parser is None:
-        _parser = _def_parser()
-
-    global _vars
-    _vars = kwargs
 
-    try:
-        result = _parser.parseString(expression, parseAll=True)[0]
-    except pyparsing.ParseException as e:
-        raise exception.EvaluatorParseException(
-            _("ParseException: %s") % e)
-
-    return result.eval()
+    Expressions are only parsed the first time they are evaluated.
+    """
+    return compile_expression(expression).evaluate(**kwargs)
@@ -27,6 +27,7 @@ from oslo_serialization import jsonutils
 from cinder import exception
 from cinder.i18n import _
 from cinder.scheduler import driver
+from cinder.scheduler import metrics
 from cinder.scheduler import scheduler_options
 from cinder.volume import utils
 
@@ -62,6 +63,7 @@ class FilterScheduler(driver.Scheduler):
         filter_properties['metadata'] = vol.get('metadata')
         filter_properties['qos_specs'] = vol.get('qos_specs')
 
+    @metrics.traced('create_group', 'group')
     def schedule_create_group(self, context, group,
                               group_spec,
                               request_spec_list,
@@ -86,6 +88,7 @@ class FilterScheduler(driver.Scheduler):
 
         self.volume_rpcapi.create_group(context, updated_group)
 
+    @metrics.traced('create_volume', 'request_spec')
     def schedule_create_volume(self, context, request_spec, filter_properties):
         backend = self._schedule(context, request_spec, filter_properties)
 
@@ -109,6 +112,72 @@ class FilterScheduler(driver.Scheduler):
                                          filter_properties,
                                          allow_reschedule=True)
 
+    @metrics.traced('create_volumes', 'request_spec_list')
+    def schedule_create_volumes(self, context, request_spec_list,
+                                filter_properties_list):
+        """Place a batch of homogeneous volume creation requests.
+
+        Backends are filtered only once, using the first request, and the
+        weighers spread the requests among the remaining candidates as their
+        consumed capacity is updated after each placement.
+
+        Returns a list with the exception of each request that couldn't be
+        placed, or None for those that were placed.
+        """
+        weighed_backends = self._get_weighted_candidates(
+            context, request_spec_list[0], filter_properties_list[0])
+        weighed_backends = self._filter_resource_backend(
+            weighed_backends, request_spec_list[0])
+        candidates = [weighed_backend.obj
+                      for weighed_backend in weighed_backends]
+        # The context is popped from the filter properties of placed requests
+        weight_properties = dict(filter_properties_list[0])
+        capacity_filtered = ('CapacityFilter' in
+                             CONF.scheduler_default_filters)
+
+        results = []
+        for i, (request_spec, filter_properties) in enumerate(
+                zip(request_spec_list, filter_properties_list)):
+            if i:
+                self._populate_retry(filter_properties,
+                                     request_spec['volume_properties'])
+                # Only capacity changes between placements, so the other
+                # filters don't need to run again.
+                if candidates and capacity_filtered:
+                    candidates = self.host_manager.get_filtered_backends(
+                        candidates, weight_properties, 'CapacityFilter')
+                weighed_backends = (
+                    candidates and
+                    self.host_manager.get_weighed_backends(candidates,
+                                                           weight_properties))
+            if not weighed_backends:
+                results.append(exception.NoValidBackend(
+                    reason=_("No weighed backends available")))
+                continue
+
+            backend = self._choose_top_backend(weighed_backends,
+                                               request_spec).obj
+            try:
+                updated_volume = driver.volume_update_db(
+                    context, request_spec['volume_id'], backend.host,
+                    backend.cluster_name)
+                self._post_select_populate_filter_properties(
+                    filter_properties, backend)
+                # context is not serializable
+                filter_properties.pop('context', None)
+                self.volume_rpcapi.create_volume(context, updated_volume,
+                                                 request_spec,
+                                                 filter_properties,
+                                                 allow_reschedule=True)
+            except Exception as e:
+                LOG.exception("Failed to send volume %s to its backend.",
+                              request_spec['volume_id'])
+                results.append(e)
+                continue
+            results.append(None)
+        return results
+
+    @metrics.traced('backend_passes_filters', 'request_spec')
     def backend_passes_filters(self, context, backend, request_spec,
                                filter_properties):
         """Check if the specified backend passes the filters."""
@@ -134,6 +203,7 @@ class FilterScheduler(driver.Scheduler):
         raise exception.NoValidBackend(_('Cannot place %(resource)s %(id)s '
                                          'on %(backend)s.') % reason_param)
 
+    @metrics.traced('find_retype_backend', 'request_spec')
     def find_retype_backend(self, context, request_spec,
                             filter_properties=None, migration_policy='never'):
         """Find a backend that can accept the volume with its new type."""
@@ -518,6 +588,16 @@ class FilterScheduler(driver.Scheduler):
     def _schedule(self, context, request_spec, filter_properties=None):
         weighed_backends = self._get_weighted_candidates(context, request_spec,
                                                          filter_properties)
+        weighed_backends = self._filter_resource_backend(weighed_backends,
+                                                         request_spec)
+        if not weighed_backends:
+            LOG.warning('No weighed backend found for volume '
+                        'with properties: %s',
+                        filter_properties['request_spec'].get('volume_type'))
+            return None
+        return self._choose_top_backend(weighed_backends, request_spec)
+
+    def _filter_resource_backend(self, weighed_backends, request_spec):
         # When we get the weighed_backends, we clear those backends that don't
         # match the resource's backend (it could be assigend from group,
         # snapshot or volume).
@@ -534,12 +614,7 @@ class FilterScheduler(driver.Scheduler):
                 )
                 if backend_id != resource_backend:
                     weighed_backends.remove(backend)
-        if not weighed_backends:
-            LOG.warning('No weighed backend found for volume '
-                        'with properties: %s',
-                        filter_properties['request_spec'].get('volume_type'))
-            return None
-        return self._choose_top_backend(weighed_backends, request_spec)
+        return weighed_backends
 
     def _schedule_generic_group(self, context, group_spec, request_spec_list,
                                 group_filter_properties=None,
@@ -559,7 +634,9 @@ class FilterScheduler(driver.Scheduler):
         backend_state = top_backend.obj
         LOG.debug("Choosing %s", backend_state.backend_id)
         volume_properties = request_spec['volume_properties']
-        backend_state.consume_from_volume(volume_properties)
+        with metrics.timer('selection'):
+            self.host_manager.claim_capacity(backend_state,
+                                             volume_properties)
         return top_backend
 
     def _choose_top_backend_generic_group(self, weighed_backends):
@@ -17,30 +17,22 @@
 from oslo_utils import uuidutils
 
 from cinder.scheduler import filters
+from cinder.scheduler import metrics
 from cinder.volume import api as volume
 
 
 class AffinityFilter(filters.BaseBackendFilter):
+    # Scheduler hint holding the uuids of the volumes to (anti-)affine to
+    hint_name = None
+
     def __init__(self):
         self.volume_api = volume.API()
 
-    def _get_volumes(self, context, affinity_uuids, backend_state):
-        filters = {'id': affinity_uuids, 'deleted': False}
-        if backend_state.cluster_name:
-            filters['cluster_name'] = backend_state.cluster_name
-        else:
-            filters['host'] = backend_state.host
-        return self.volume_api.get_all(context, filters=filters)
-
-
-class DifferentBackendFilter(AffinityFilter):
-    """Schedule volume on a different back-end from a set of volumes."""
-
-    def backend_passes(self, backend_state, filter_properties):
-        context = filter_properties['context']
+    def _get_affinity_uuids(self, filter_properties):
+        """Return the list of hinted volume uuids, or None if invalid."""
         scheduler_hints = filter_properties.get('scheduler_hints') or {}
 
-        affinity_uuids = scheduler_hints.get('different_host', [])
+        affinity_uuids = scheduler_hints.get(self.hint_name, [])
 
         # scheduler hint verification: affinity_uuids can be a list of uuids
         # or single uuid.  The checks here is to make sure every single string
@@ -49,15 +41,87 @@ class DifferentBackendFilter(AffinityFilter):
         # like a uuid, it is better to fail the request than serving it wrong.
         if isinstance(affinity_uuids, list):
             for uuid in affinity_uuids:
-                if uuidutils.is_uuid_like(uuid):
-                    continue
-                else:
-                    return False
+                if not uuidutils.is_uuid_like(uuid):
+                    return None
         elif uuidutils.is_uuid_like(affinity_uuids):
             affinity_uuids = [affinity_uuids]
         else:
             # Not a list, not a string looks like uuid, don't pass it
             # to DB for query to avoid potential risk.
+            return None
+        return affinity_uuids
+
+    def _get_volumes(self, context, affinity_uuids, backend_state=None):
+        filters = {'id': affinity_uuids, 'deleted': False}
+        if backend_state is not None:
+            if backend_state.cluster_name:
+                filters['cluster_name'] = backend_state.cluster_name
+            else:
+                filters['host'] = backend_state.host
+        with metrics.timer('affinity.volume_lookup'):
+            return self.volume_api.get_all(context, filters=filters)
+
+    @staticmethod
+    def _host_matches(value, volume_host):
+        """Match a volume host the way the DB host filter does.
+
+        A value with a pool must match exactly, a backend also matches its
+        pools, and a bare host also matches all of its backends.
+        """
+        if not volume_host:
+            return False
+        if volume_host == value or volume_host.startswith(value + '#'):
+            return True
+        return ('#' not in value and '@' not in value and
+                volume_host.startswith(value + '@'))
+
+    def _on_backend(self, volumes, backend_state):
+        """Return True if any of the volumes is on the given backend."""
+        if backend_state.cluster_name:
+            return any(self._host_matches(backend_state.cluster_name,
+                                          vol.cluster_name)
+                       for vol in volumes)
+        return any(self._host_matches(backend_state.host, vol.host)
+                   for vol in volumes)
+
+    def _affinity_passes(self, on_backend):
+        """Return whether a backend passes given if it has a hinted volume."""
+        raise NotImplementedError()
+
+    def filter_all(self, filter_obj_list, filter_properties):
+        """Yield the backends that pass the filter.
+
+        The hinted volumes are looked up once per request and matched
+        against each backend in memory, instead of querying the DB for
+        every backend.
+        """
+        affinity_uuids = self._get_affinity_uuids(filter_properties)
+        if affinity_uuids is None:
+            return
+        if not affinity_uuids:
+            for obj in filter_obj_list:
+                yield obj
+            return
+
+        volumes = self._get_volumes(filter_properties['context'],
+                                    affinity_uuids)
+        for obj in filter_obj_list:
+            if self._affinity_passes(self._on_backend(volumes, obj)):
+                yield obj
+
+
+class DifferentBackendFilter(AffinityFilter):
+    """Schedule volume on a different back-end from a set of volumes."""
+
+    hint_name = 'different_host'
+
+    def _affinity_passes(self, on_backend):
+        return not on_backend
+
+    def backend_passes(self, backend_state, filter_properties):
+        context = filter_properties['context']
+        affinity_uuids = self._get_affinity_uuids(filter_properties)
+        if affinity_uuids is None:
             return False
 
         if affinity_uuids:
@@ -70,28 +134,15 @@ class DifferentBackendFilter(AffinityFilter):
 class SameBackendFilter(AffinityFilter):
     """Schedule volume on the same back-end as another volume."""
 
-    def backend_passes(self, backend_state, filter_properties):
-        context = filter_properties['context']
-        scheduler_hints = filter_properties.get('scheduler_hints') or {}
+    hint_name = 'same_host'
 
-        affinity_uuids = scheduler_hints.get('same_host', [])
+    def _affinity_passes(self, on_backend):
+        return on_backend
 
-        # scheduler hint verification: affinity_uuids can be a list of uuids
-        # or single uuid.  The checks here is to make sure every single string
-        # in the list looks like a uuid, otherwise, this filter will fail to
-        # pass.  Note that the filter does *NOT* ignore string doesn't look
-        # like a uuid, it is better to fail the request than serving it wrong.
-        if isinstance(affinity_uuids, list):
-            for uuid in affinity_uuids:
-                if uuidutils.is_uuid_like(uuid):
-                    continue
-                else:
-                    return False
-        elif uuidutils.is_uuid_like(affinity_uuids):
-            affinity_uuids = [affinity_uuids]
-        else:
-            # Not a list, not a string looks like uuid, don't pass it
-            # to DB for query to avoid potential risk.
+    def backend_passes(self, backend_state, filter_properties):
+        context = filter_properties['context']
+        affinity_uuids = self._get_affinity_uuids(filter_properties)
+        if affinity_uuids is None:
             return False
 
         if affinity_uuids:
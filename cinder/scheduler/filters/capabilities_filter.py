@@ -24,20 +24,28 @@ LOG = logging.getLogger(__name__)
 class CapabilitiesFilter(filters.BaseBackendFilter):
     """BackendFilter to work with resource (instance & volume) type records."""
 
-    def _satisfies_extra_specs(self, capabilities, resource_type):
-        """Check if capabilities satisfy resource type requirements.
+    # Requirements of the resource type of the request, set by prepare
+    _requirements = None
 
-        Check that the capabilities provided by the services satisfy
-        the extra specs associated with the resource type.
-        """
+    def prepare(self, filter_properties):
+        self._requirements = self._get_requirements(
+            filter_properties.get('resource_type'))
 
+    @staticmethod
+    def _get_requirements(resource_type):
+        """Return the requirements of the resource type extra specs.
+
+        Each requirement is the capability path, the extra spec key and
+        value, and the function that checks if a capability value matches.
+        """
         if not resource_type:
-            return True
+            return []
 
         extra_specs = resource_type.get('extra_specs', [])
         if not extra_specs:
-            return True
+            return []
 
+        requirements = []
         for key, req in extra_specs.items():
 
             # Either not scoped format, or in capabilities scope
@@ -50,6 +58,21 @@ class CapabilitiesFilter(filters.BaseBackendFilter):
             elif scope[0] == "capabilities":
                 del scope[0]
 
+            requirements.append((scope, key, req,
+                                 extra_specs_ops.get_matcher(req)))
+        return requirements
+
+    def _satisfies_extra_specs(self, capabilities, resource_type,
+                               requirements=None):
+        """Check if capabilities satisfy resource type requirements.
+
+        Check that the capabilities provided by the services satisfy
+        the extra specs associated with the resource type.
+        """
+        if requirements is None:
+            requirements = self._get_requirements(resource_type)
+
+        for scope, key, req, matcher in requirements:
             cap = capabilities
             for index in range(len(scope)):
                 try:
@@ -64,7 +87,7 @@ class CapabilitiesFilter(filters.BaseBackendFilter):
 
             # Loop through capability values looking for any match
             for cap_value in cap_list:
-                if extra_specs_ops.match(cap_value, req):
+                if matcher(cap_value):
                     break
             else:
                 # Nothing matched, so bail out
@@ -82,7 +105,8 @@ class CapabilitiesFilter(filters.BaseBackendFilter):
         # volume.
         resource_type = filter_properties.get('resource_type')
         if not self._satisfies_extra_specs(backend_state.capabilities,
-                                           resource_type):
+                                           resource_type,
+                                           self._requirements):
             LOG.debug("%(backend_state)s fails resource_type extra_specs "
                       "requirements", {'backend_state': backend_state})
             return False
@@ -30,6 +30,12 @@ class DriverFilter(filters.BaseBackendFilter):
     and metrics.
     """
 
+    # Statistics of the volume being scheduled, set by prepare
+    _request_stats = None
+
+    def prepare(self, filter_properties):
+        self._request_stats = self._generate_request_stats(filter_properties)
+
     def backend_passes(self, backend_state, filter_properties):
         """Determines if a backend has a passing filter_function or not."""
         stats = self._generate_stats(backend_state, filter_properties)
@@ -85,6 +91,18 @@ class DriverFilter(filters.BaseBackendFilter):
 
         return result
 
+    @staticmethod
+    def _generate_request_stats(filter_properties):
+        """Generates the statistics of the volume being scheduled."""
+        volume_type = filter_properties.get('volume_type', {})
+        request_spec = filter_properties.get('request_spec', {})
+        return {
+            'extra_specs': volume_type.get('extra_specs', {}),
+            'qos_specs': filter_properties.get('qos_specs', {}),
+            'volume_stats': request_spec.get('volume_properties', {}),
+            'volume_type': volume_type,
+        }
+
     def _generate_stats(self, backend_state, filter_properties):
         """Generates statistics from backend and volume data."""
 
@@ -112,22 +130,12 @@ class DriverFilter(filters.BaseBackendFilter):
                 backend_caps['filter_function'] is not None):
             filter_function = six.text_type(backend_caps['filter_function'])
 
-        qos_specs = filter_properties.get('qos_specs', {})
-
-        volume_type = filter_properties.get('volume_type', {})
-        extra_specs = volume_type.get('extra_specs', {})
-
-        request_spec = filter_properties.get('request_spec', {})
-        volume_stats = request_spec.get('volume_properties', {})
-
-        stats = {
+        stats = dict(self._request_stats or
+                     self._generate_request_stats(filter_properties))
+        stats.update({
             'backend_stats': backend_stats,
             'backend_caps': backend_caps,
-            'extra_specs': extra_specs,
-            'qos_specs': qos_specs,
-            'volume_stats': volume_stats,
-            'volume_type': volume_type,
             'filter_function': filter_function,
-        }
+        })
 
         return stats
@@ -38,12 +38,14 @@ _op_methods = {'=': lambda x, y: float(x) >= float(y),
                's>=': operator.ge}
 
 
-def match(value, req):
+def get_matcher(req):
+    """Return a function that checks if a value matches the requirement.
+
+    The requirement is only split and its operator looked up once, so the
+    returned function can check the values of many backends cheaply.
+    """
     if req is None:
-        if value is None:
-            return True
-        else:
-            return False
+        return lambda value: value is None
     words = req.split()
 
     op = method = None
@@ -52,26 +54,26 @@ def match(value, req):
         method = _op_methods.get(op)
 
     if op != '<or>' and not method:
-        return value == req
-
-    if value is None:
-        return False
+        return lambda value: value == req
 
     if op == '<or>':  # Ex: <or> v1 <or> v2 <or> v3
-        while True:
-            if words.pop(0) == value:
-                return True
-            if not words:
-                break
-            op = words.pop(0)  # remove a keyword <or>
-            if not words:
-                break
-        return False
+        choices = words[::2]
+        return lambda value: value is not None and value in choices
+
+    if not words:
+        return lambda value: False
+    operand = words[0]
 
-    try:
-        if words and method(value, words[0]):
-            return True
-    except ValueError:
-        pass
+    def matcher(value):
+        if value is None:
+            return False
+        try:
+            return bool(method(value, operand))
+        except ValueError:
+            return False
 
-    return False
+    return matcher
+
+
+def match(value, req):
+    return get_matcher(req)(value)
@@ -13,6 +13,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import collections
+import time
+
+from oslo_config import cfg
 from oslo_log import log as logging
 from oslo_utils import uuidutils
 
@@ -20,9 +24,34 @@ from cinder.compute import nova
 from cinder import exception
 from cinder.i18n import _
 from cinder.scheduler import filters
+from cinder.scheduler import metrics
 from cinder.volume import utils as volume_utils
 
 
+instance_locality_opts = [
+    cfg.IntOpt('instance_locality_cache_ttl',
+               default=60,
+               min=0,
+               help='Number of seconds the InstanceLocalityFilter keeps the '
+                    'hypervisor host of an instance it got from Nova, '
+                    'shared by all the scheduling requests. 0 disables the '
+                    'cache and Nova is queried once per request.'),
+    cfg.IntOpt('instance_locality_negative_cache_ttl',
+               default=5,
+               min=0,
+               help='Number of seconds the InstanceLocalityFilter '
+                    'remembers instances that Nova could not find, or that '
+                    'were not on a host yet.'),
+    cfg.IntOpt('instance_locality_cache_size',
+               default=1000,
+               min=1,
+               help='Maximum number of instances whose hypervisor host the '
+                    'InstanceLocalityFilter keeps.'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(instance_locality_opts)
+
 LOG = logging.getLogger(__name__)
 
 HINT_KEYWORD = 'local_to_instance'
@@ -30,6 +59,53 @@ INSTANCE_HOST_PROP = 'OS-EXT-SRV-ATTR:host'
 REQUESTS_TIMEOUT = 5
 
 
+class InstanceHostCache(object):
+    """LRU cache of the hypervisor host of instances with an expiration.
+
+    Lookups that failed because the instance doesn't exist, or that found
+    it without a host, are kept for a shorter time.
+    """
+
+    MISSING = object()
+
+    def __init__(self):
+        self._entries = collections.OrderedDict()
+
+    def get(self, instance_uuid):
+        """Return the cached host, or MISSING, raising cached errors."""
+        entry = self._entries.pop(instance_uuid, None)
+        if entry is None:
+            return self.MISSING
+        expires_at, host, error = entry
+        if expires_at <= time.time():
+            return self.MISSING
+        # Mark it as the most recently used
+        self._entries[instance_uuid] = entry
+        if error is not None:
+            raise error
+        return host
+
+    def set(self, instance_uuid, host=None, error=None):
+        if error is None and host is not None:
+            ttl = CONF.instance_locality_cache_ttl
+        else:
+            ttl = min(CONF.instance_locality_negative_cache_ttl,
+                      CONF.instance_locality_cache_ttl)
+        if not ttl:
+            return
+        self._entries.pop(instance_uuid, None)
+        self._entries[instance_uuid] = (time.time() + ttl, host, error)
+        while len(self._entries) > CONF.instance_locality_cache_size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+
+# Shared by all the requests of the process
+HOST_CACHE = InstanceHostCache()
+
+
 class InstanceLocalityFilter(filters.BaseBackendFilter):
     """Schedule volume on the same host as a given instance.
 
@@ -49,13 +125,28 @@ class InstanceLocalityFilter(filters.BaseBackendFilter):
 
     """
 
+    # Whether Nova has the Extended Server Attributes extension, it is only
+    # probed once per process.
+    _nova_ext_srv_attr = None
+
     def __init__(self):
-        # Cache Nova API answers directly into the Filter object.
-        # Since a BaseBackendFilter instance lives only during the volume's
-        # scheduling, the cache is re-created for every new volume creation.
+        # Nova answers and errors for the request being scheduled
         self._cache = {}
         super(InstanceLocalityFilter, self).__init__()
 
+    def prepare(self, filter_properties):
+        self._cache = {}
+        scheduler_hints = filter_properties.get('scheduler_hints') or {}
+        instance_uuid = scheduler_hints.get(HINT_KEYWORD, None)
+        if instance_uuid and uuidutils.is_uuid_like(instance_uuid):
+            # Look the instance up once before checking the backends
+            try:
+                self._get_instance_host(filter_properties['context'],
+                                        instance_uuid)
+            except Exception:
+                # Raised again when the backends are checked
+                pass
+
     def _nova_has_extended_server_attributes(self, context):
         """Check Extended Server Attributes presence
 
@@ -63,11 +154,62 @@ class InstanceLocalityFilter(filters.BaseBackendFilter):
         in Nova or not. Cache the result to query Nova only once.
         """
 
-        if not hasattr(self, '_nova_ext_srv_attr'):
-            self._nova_ext_srv_attr = nova.API().has_extension(
-                context, 'ExtendedServerAttributes', timeout=REQUESTS_TIMEOUT)
+        cls = InstanceLocalityFilter
+        if cls._nova_ext_srv_attr is None:
+            with metrics.timer('nova.has_extension'):
+                cls._nova_ext_srv_attr = nova.API().has_extension(
+                    context, 'ExtendedServerAttributes',
+                    timeout=REQUESTS_TIMEOUT)
+
+        return cls._nova_ext_srv_attr
+
+    def _lookup_instance_host(self, context, instance_uuid):
+        """Get the host of an instance from Nova and cache it."""
+        if not self._nova_has_extended_server_attributes(context):
+            LOG.warning('Hint "%s" dropped because '
+                        'ExtendedServerAttributes not active in Nova.',
+                        HINT_KEYWORD)
+            raise exception.CinderException(_('Hint "%s" not supported.') %
+                                            HINT_KEYWORD)
+
+        try:
+            with metrics.timer('nova.get_server'):
+                server = nova.API().get_server(context, instance_uuid,
+                                               privileged_user=True,
+                                               timeout=REQUESTS_TIMEOUT)
+        except exception.ServerNotFound as e:
+            HOST_CACHE.set(instance_uuid, error=e)
+            raise
+
+        if not hasattr(server, INSTANCE_HOST_PROP):
+            LOG.warning('Hint "%s" dropped because Nova did not return '
+                        'enough information. Either Nova policy needs to '
+                        'be changed or a privileged account for Nova '
+                        'should be specified in conf.', HINT_KEYWORD)
+            raise exception.CinderException(_('Hint "%s" not supported.') %
+                                            HINT_KEYWORD)
+
+        host = getattr(server, INSTANCE_HOST_PROP)
+        HOST_CACHE.set(instance_uuid, host)
+        return host
 
-        return self._nova_ext_srv_attr
+    def _get_instance_host(self, context, instance_uuid):
+        # First, lookup for already-known information in local cache
+        if instance_uuid in self._cache:
+            host = self._cache[instance_uuid]
+            if isinstance(host, Exception):
+                raise host
+            return host
+
+        try:
+            host = HOST_CACHE.get(instance_uuid)
+            if host is HOST_CACHE.MISSING:
+                host = self._lookup_instance_host(context, instance_uuid)
+        except Exception as e:
+            self._cache[instance_uuid] = e
+            raise
+        self._cache[instance_uuid] = host
+        return host
 
     def backend_passes(self, backend_state, filter_properties):
         context = filter_properties['context']
@@ -91,30 +233,5 @@ class InstanceLocalityFilter(filters.BaseBackendFilter):
         # enhancement would be to subscribe to Nova migration events (e.g. via
         # Ceilometer).
 
-        # First, lookup for already-known information in local cache
-        if instance_uuid in self._cache:
-            return self._cache[instance_uuid] == backend
-
-        if not self._nova_has_extended_server_attributes(context):
-            LOG.warning('Hint "%s" dropped because '
-                        'ExtendedServerAttributes not active in Nova.',
-                        HINT_KEYWORD)
-            raise exception.CinderException(_('Hint "%s" not supported.') %
-                                            HINT_KEYWORD)
-
-        server = nova.API().get_server(context, instance_uuid,
-                                       privileged_user=True,
-                                       timeout=REQUESTS_TIMEOUT)
-
-        if not hasattr(server, INSTANCE_HOST_PROP):
-            LOG.warning('Hint "%s" dropped because Nova did not return '
-                        'enough information. Either Nova policy needs to '
-                        'be changed or a privileged account for Nova '
-                        'should be specified in conf.', HINT_KEYWORD)
-            raise exception.CinderException(_('Hint "%s" not supported.') %
-                                            HINT_KEYWORD)
-
-        self._cache[instance_uuid] = getattr(server, INSTANCE_HOST_PROP)
-
         # Match if given instance is hosted on backend
-        return self._cache[instance_uuid] == backend
+        return self._get_instance_host(context, instance_uuid) == backend
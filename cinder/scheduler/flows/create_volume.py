@@ -118,26 +118,30 @@ class ScheduleCreateVolumeTask(flow_utils.CinderTask):
                           "payload %(payload)s",
                           {'topic': self.FAILURE_TOPIC, 'payload': payload})
 
+    def schedule_failed(self, context, request_spec, volume, cause):
+        """Record that scheduling a volume failed and error it out."""
+        self.message_api.create(
+            context,
+            message_field.Action.SCHEDULE_ALLOCATE_VOLUME,
+            resource_uuid=request_spec['volume_id'],
+            exception=cause)
+        try:
+            self._handle_failure(context, request_spec, cause)
+        finally:
+            common.error_out(volume, reason=cause)
+
     def execute(self, context, request_spec, filter_properties, volume):
         try:
             self.driver_api.schedule_create_volume(context, request_spec,
                                                    filter_properties)
         except Exception as e:
-            self.message_api.create(
-                context,
-                message_field.Action.SCHEDULE_ALLOCATE_VOLUME,
-                resource_uuid=request_spec['volume_id'],
-                exception=e)
             # An error happened, notify on the scheduler queue and log that
             # this happened and set the volume to errored out and reraise the
             # error *if* exception caught isn't NoValidBackend. Otherwise *do
             # not* reraise (since what's the point?)
             with excutils.save_and_reraise_exception(
                     reraise=not isinstance(e, exception.NoValidBackend)):
-                try:
-                    self._handle_failure(context, request_spec, e)
-                finally:
-                    common.error_out(volume, reason=e)
+                self.schedule_failed(context, request_spec, volume, e)
 
 
 def get_flow(context, driver_api, request_spec=None,
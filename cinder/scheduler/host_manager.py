@@ -18,7 +18,9 @@ Manage backends in the current zone.
 """
 
 import collections
+import time
 
+import eventlet
 from oslo_config import cfg
 from oslo_log import log as logging
 from oslo_utils import importutils
@@ -29,7 +31,9 @@ from cinder.common import constants
 from cinder import context as cinder_context
 from cinder import exception
 from cinder import objects
+from cinder.scheduler import claims
 from cinder.scheduler import filters
+from cinder.scheduler import metrics
 from cinder import utils
 from cinder.volume import utils as vol_utils
 from cinder.volume import volume_types
@@ -58,6 +62,16 @@ host_manager_opts = [
                default='cinder.scheduler.weights.OrderedHostWeightHandler',
                help='Which handler to use for selecting the host/pool '
                     'after weighing'),
+    cfg.IntOpt('scheduler_service_cache_ttl',
+               default=10,
+               min=0,
+               help='Number of seconds the scheduler reuses its list of '
+                    'volume services before reloading it from the database. '
+                    'Once expired the list is reloaded in the background '
+                    'while requests keep using the previous one, and it is '
+                    'reloaded right away when a capability report arrives '
+                    'from a backend the list does not show as up. 0 '
+                    'reloads it on every request.'),
 ]
 
 CONF = cfg.CONF
@@ -134,6 +148,10 @@ class BackendState(object):
         self.pools = {}
 
         self.updated = None
+        # Timestamp of the capability report the capacity comes from, and
+        # the capacity claimed since by other schedulers that we consumed.
+        self.report_timestamp = None
+        self.claimed_capacity_gb = 0
 
     @property
     def backend_id(self):
@@ -315,6 +333,21 @@ class BackendState(object):
             self.updated = timeutils.utcnow()
         LOG.debug("Consumed %s GB from backend: %s", volume['size'], self)
 
+    def consume_claims(self, claims):
+        """Consume the capacity claimed by other schedulers.
+
+        Only the claims made after the capability report our capacity comes
+        from are consumed, since the older ones are already reflected in it.
+        """
+        claimed = sum(claim.size for claim in claims
+                      if self.report_timestamp is None or
+                      claim.created_at > self.report_timestamp)
+        if claimed != self.claimed_capacity_gb:
+            self.consume_from_volume(
+                {'size': claimed - self.claimed_capacity_gb},
+                update_time=False)
+            self.claimed_capacity_gb = claimed
+
     def __repr__(self):
         # FIXME(zhiteng) backend level free_capacity_gb isn't as
         # meaningful as it used to be before pool is introduced, we'd
@@ -387,6 +420,10 @@ class PoolState(BackendState):
 
             self.multiattach = capability.get('multiattach', False)
 
+            # The capacity is now the reported one, without any claims
+            self.report_timestamp = capability['timestamp']
+            self.claimed_capacity_gb = 0
+
     def update_pools(self, capability):
         # Do nothing, since we don't have pools within pool, yet
         pass
@@ -410,6 +447,11 @@ class HostManager(object):
 
     def __init__(self):
         self.service_states = {}  # { <host|cluster>: {<service>: {cap k : v}}}
+        # { <host|cluster>: (<host>, <version of last report>)}
+        self._capabilities_versions = {}
+        # { <host|cluster>: <last report as received>}, deltas are applied
+        # to these as the pools in service_states get backend info added.
+        self._reported_capabilities = {}
         self.backend_state_map = {}
         self.filter_handler = filters.BackendFilterHandler('cinder.scheduler.'
                                                            'filters')
@@ -420,6 +462,11 @@ class HostManager(object):
         self.weight_classes = self.weight_handler.get_all_classes()
 
         self._no_capabilities_backends = set()  # Services without capabilities
+        self.claims_store = claims.get_claims_store()
+        self._services = None
+        self._services_loaded_at = 0
+        self._services_generation = 0
+        self._services_refreshing = False
         self._update_backend_state_map(cinder_context.get_admin_context())
         self.service_states_last_update = {}
 
@@ -495,14 +542,32 @@ class HostManager(object):
                                                        weight_properties)
 
     def update_service_capabilities(self, service_name, host, capabilities,
-                                    cluster_name, timestamp):
-        """Update the per-service capabilities based on this notification."""
+                                    cluster_name, timestamp,
+                                    capabilities_version=None,
+                                    base_version=None):
+        """Update the per-service capabilities based on this notification.
+
+        When base_version is set the capabilities are a delta over the report
+        with that version, and False is returned if we don't have that report
+        so the service must be asked for its full capabilities.
+        """
         if service_name != 'volume':
             LOG.debug('Ignoring %(service_name)s service update '
                       'from %(host)s',
                       {'service_name': service_name, 'host': host})
             return
 
+        backend = cluster_name or host
+        if base_version is not None:
+            if (self._capabilities_versions.get(backend) !=
+                    (host, base_version)):
+                LOG.info('Missed capability report from %(host)s, cannot '
+                         'apply delta over version %(version)s.',
+                         {'host': host, 'version': base_version})
+                return False
+            capabilities = vol_utils.apply_capabilities_delta(
+                self._reported_capabilities[backend], capabilities)
+
         # TODO(geguileo): In P - Remove the next line since we receive the
         # timestamp
         timestamp = timestamp or timeutils.utcnow()
@@ -511,7 +576,6 @@ class HostManager(object):
         capab_copy["timestamp"] = timestamp
 
         # Set the default capabilities in case None is set.
-        backend = cluster_name or host
         capab_old = self.service_states.get(backend, {"timestamp": 0})
         capab_last_update = self.service_states_last_update.get(
             backend, {"timestamp": 0})
@@ -534,6 +598,17 @@ class HostManager(object):
             self.service_states_last_update[backend] = capab_old
 
         self.service_states[backend] = capab_copy
+        if capabilities_version is None:
+            self._capabilities_versions.pop(backend, None)
+            self._reported_capabilities.pop(backend, None)
+        else:
+            self._capabilities_versions[backend] = (host,
+                                                    capabilities_version)
+            reported = dict(capabilities)
+            if reported.get('pools'):
+                reported['pools'] = [dict(pool)
+                                     for pool in reported['pools']]
+            self._reported_capabilities[backend] = reported
 
         cluster_msg = (('Cluster: %s - Host: ' % cluster_name) if cluster_name
                        else '')
@@ -543,7 +618,13 @@ class HostManager(object):
                    'cap': capabilities,
                    'cluster': cluster_msg})
 
+        # A report from a backend we don't consider up means a service has
+        # been added or has come back, so our view of the services is stale.
+        if (backend not in self.backend_state_map and
+                backend not in self._no_capabilities_backends):
+            self.invalidate_services()
         self._no_capabilities_backends.discard(backend)
+        return True
 
     def notify_service_capabilities(self, service_name, backend, capabilities,
                                     timestamp):
@@ -578,14 +659,48 @@ class HostManager(object):
     def has_all_capabilities(self):
         return len(self._no_capabilities_backends) == 0
 
+    def invalidate_services(self):
+        """Make the next request reload the volume services."""
+        self._services = None
+        self._services_generation += 1
+
+    def _load_volume_services(self, context):
+        generation = self._services_generation
+        topic = constants.VOLUME_TOPIC
+        services = objects.ServiceList.get_all(context,
+                                               {'topic': topic,
+                                                'disabled': False,
+                                                'frozen': False})
+        # Don't store a list that was invalidated while we were loading it
+        if generation == self._services_generation:
+            self._services = services
+            self._services_loaded_at = time.time()
+        return services
+
+    def _refresh_volume_services(self):
+        try:
+            self._load_volume_services(cinder_context.get_admin_context())
+        except Exception:
+            LOG.exception('Failed to refresh the volume services list.')
+        finally:
+            self._services_refreshing = False
+
+    def _get_volume_services(self, context):
+        """Return the volume services, reusing a recent list if possible."""
+        ttl = CONF.scheduler_service_cache_ttl
+        if not ttl or self._services is None:
+            return self._load_volume_services(context)
+
+        if (time.time() - self._services_loaded_at >= ttl and
+                not self._services_refreshing):
+            self._services_refreshing = True
+            eventlet.spawn_n(self._refresh_volume_services)
+        return self._services
+
     def _update_backend_state_map(self, context):
 
         # Get resource usage across the available volume nodes:
-        topic = constants.VOLUME_TOPIC
-        volume_services = objects.ServiceList.get_all(context,
-                                                      {'topic': topic,
-                                                       'disabled': False,
-                                                       'frozen': False})
+        volume_services = self._get_volume_services(context)
         active_backends = set()
         active_hosts = set()
         no_capabilities_backends = set()
@@ -638,6 +753,46 @@ class HostManager(object):
                          "scheduler cache.", {'backend': backend_key})
             del self.backend_state_map[backend_key]
 
+        self._consume_claims()
+
+    def _consume_claims(self):
+        """Consume the capacity claimed on the pools by other schedulers."""
+        if not self.claims_store:
+            return
+        try:
+            all_claims = self.claims_store.get_all()
+        except Exception:
+            LOG.exception('Failed to get the capacity claims of other '
+                          'schedulers.')
+            return
+
+        backend_claims = collections.defaultdict(list)
+        for claim in all_claims:
+            backend_claims[claim.backend].append(claim)
+        for state in self.backend_state_map.values():
+            for pool in state.pools.values():
+                pool.consume_claims(backend_claims.get(pool.backend_id, ()))
+
+    def claim_capacity(self, backend_state, volume):
+        """Consume capacity on a backend and share it with other schedulers.
+
+        :param backend_state: BackendState or PoolState where we consume.
+        :param volume: Volume properties, with the size we consume.
+        """
+        backend_state.consume_from_volume(volume)
+        if self.claims_store and volume['size'] > 0:
+            try:
+                self.claims_store.add(backend_state.backend_id,
+                                      volume['size'])
+            except Exception:
+                LOG.exception('Failed to share capacity claim on %s with '
+                              'other schedulers.', backend_state.backend_id)
+
+    def cleanup_claims(self):
+        """Remove the expired capacity claims."""
+        if self.claims_store:
+            self.claims_store.cleanup()
+
     def revert_volume_consumed_capacity(self, pool_name, size):
         for backend_key, state in self.backend_state_map.items():
             for key in state.pools:
@@ -656,7 +811,8 @@ class HostManager(object):
           {'192.168.1.100': BackendState(), ...}
         """
 
-        self._update_backend_state_map(context)
+        with metrics.timer('backend_state_refresh'):
+            self._update_backend_state_map(context)
 
         # build a pool_state map and return that map instead of
         # backend_state_map
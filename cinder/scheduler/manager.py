@@ -45,6 +45,7 @@ from cinder.objects import fields
 from cinder import quota
 from cinder import rpc
 from cinder.scheduler.flows import create_volume
+from cinder.scheduler import metrics
 from cinder.scheduler import rpcapi as scheduler_rpcapi
 from cinder.volume import rpcapi as volume_rpcapi
 
@@ -56,6 +57,7 @@ scheduler_driver_opt = cfg.StrOpt('scheduler_driver',
 
 CONF = cfg.CONF
 CONF.register_opt(scheduler_driver_opt)
+CONF.import_opt('scheduler_claims_ttl', 'cinder.scheduler.claims')
 
 QUOTAS = quota.QUOTAS
 
@@ -105,10 +107,16 @@ class SchedulerManager(manager.CleanableManager, manager.Manager):
     def _clean_expired_reservation(self, context):
         QUOTAS.expire(context)
 
+    @periodic_task.periodic_task(spacing=CONF.scheduler_claims_ttl,
+                                 run_immediately=True)
+    def _clean_expired_claims(self, context):
+        self.driver.host_manager.cleanup_claims()
+
     def update_service_capabilities(self, context, service_name=None,
                                     host=None, capabilities=None,
                                     cluster_name=None, timestamp=None,
-                                    **kwargs):
+                                    capabilities_version=None,
+                                    base_version=None, **kwargs):
         """Process a capability update from a service node."""
         if capabilities is None:
             capabilities = {}
@@ -117,11 +125,26 @@ class SchedulerManager(manager.CleanableManager, manager.Manager):
             timestamp = datetime.strptime(timestamp,
                                           timeutils.PERFECT_TIME_FORMAT)
 
-        self.driver.update_service_capabilities(service_name,
-                                                host,
-                                                capabilities,
-                                                cluster_name,
-                                                timestamp)
+        # Only pass the versions when we receive them, to support scheduler
+        # drivers that don't accept them.
+        version_args = {}
+        if capabilities_version is not None:
+            version_args = {'capabilities_version': capabilities_version,
+                            'base_version': base_version}
+
+        applied = self.driver.update_service_capabilities(service_name,
+                                                          host,
+                                                          capabilities,
+                                                          cluster_name,
+                                                          timestamp,
+                                                          **version_args)
+        if applied is False:
+            try:
+                self.volume_api.request_full_capabilities(context, host)
+            except exception.ServiceTooOld as e:
+                LOG.warning('Cannot request full capabilities from %(host)s, '
+                            'waiting for its next full report: %(e)s',
+                            {'host': host, 'e': e})
 
     def notify_service_capabilities(self, context, service_name,
                                     capabilities, host=None, backend=None,
@@ -194,6 +217,30 @@ class SchedulerManager(manager.CleanableManager, manager.Manager):
         with flow_utils.DynamicLogListener(flow_engine, logger=LOG):
             flow_engine.run()
 
+    @objects.Volume.set_workers
+    def create_volumes(self, context, volumes, request_specs,
+                       filter_properties_list):
+        """Schedule a batch of homogeneous volume creation requests."""
+        self._wait_for_scheduler()
+
+        filter_properties_list = [filter_properties or {}
+                                  for filter_properties
+                                  in filter_properties_list]
+        try:
+            results = self.driver.schedule_create_volumes(
+                context, request_specs, filter_properties_list)
+        except Exception as e:
+            LOG.exception("Failed to schedule a batch of %s volumes.",
+                          len(volumes))
+            results = [e] * len(volumes)
+
+        schedule_task = create_volume.ScheduleCreateVolumeTask(self.driver)
+        for volume, request_spec, result in zip(volumes, request_specs,
+                                                results):
+            if result is not None:
+                schedule_task.schedule_failed(context, request_spec, volume,
+                                              result)
+
     def create_snapshot(self, ctxt, volume, snapshot, backend,
                         request_spec=None, filter_properties=None):
         """Create snapshot for a volume.
@@ -207,7 +254,8 @@ class SchedulerManager(manager.CleanableManager, manager.Manager):
         try:
             tgt_backend = self.driver.backend_passes_filters(
                 ctxt, backend, request_spec, filter_properties)
-            tgt_backend.consume_from_volume(
+            self.driver.host_manager.claim_capacity(
+                tgt_backend,
                 {'size': request_spec['volume_properties']['size']})
         except exception.NoValidBackend as ex:
             self._set_snapshot_state_and_notify('create_snapshot',
@@ -362,7 +410,8 @@ class SchedulerManager(manager.CleanableManager, manager.Manager):
             backend = self.driver.backend_passes_filters(
                 context, volume.service_topic_queue, request_spec,
                 filter_properties)
-            backend.consume_from_volume({'size': volume.size})
+            self.driver.host_manager.claim_capacity(backend,
+                                                    {'size': volume.size})
 
         except exception.NoValidBackend as ex:
             self._set_snapshot_state_and_notify('manage_existing_snapshot',
@@ -383,6 +432,10 @@ class SchedulerManager(manager.CleanableManager, manager.Manager):
         """
         return self.driver.get_pools(context, filters)
 
+    def get_metrics(self, context):
+        """Get the timing metrics and outcome counters of the scheduler."""
+        return metrics.METRICS.snapshot()
+
     def validate_host_capacity(self, context, backend, request_spec,
                                filter_properties):
         try:
@@ -390,7 +443,8 @@ class SchedulerManager(manager.CleanableManager, manager.Manager):
                 context,
                 backend,
                 request_spec, filter_properties)
-            backend_state.consume_from_volume(
+            self.driver.host_manager.claim_capacity(
+                backend_state,
                 {'size': request_spec['volume_properties']['size']})
         except exception.NoValidBackend:
             LOG.error("Desired host %(host)s does not have enough "
@@ -416,8 +470,8 @@ class SchedulerManager(manager.CleanableManager, manager.Manager):
                 context,
                 volume.service_topic_queue,
                 request_spec, filter_properties)
-            backend_state.consume_from_volume(
-                {'size': new_size - volume.size})
+            self.driver.host_manager.claim_capacity(
+                backend_state, {'size': new_size - volume.size})
             volume_rpcapi.VolumeAPI().extend_volume(context, volume, new_size,
                                                     reservations)
         except exception.NoValidBackend as ex:
@@ -0,0 +1,219 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Timing metrics and decision log of the scheduler.
+
+Every step of a scheduling request (refreshing the backend states, each
+filter and weigher, the lookups some filters make and the final selection)
+records how long it took in a histogram, and every request increments a
+counter for its outcome.  The steps of a request are also collected in a
+decision trace, that is logged for a sample of the requests.
+"""
+
+import collections
+import contextlib
+import functools
+import inspect
+import random
+import threading
+
+from oslo_config import cfg
+from oslo_log import log as logging
+from oslo_utils import timeutils
+
+from cinder import exception
+
+
+metrics_opts = [
+    cfg.FloatOpt('scheduler_decision_log_sample_rate',
+                 default=0.0,
+                 min=0.0,
+                 max=1.0,
+                 help='Fraction of the scheduling requests whose decision is '
+                      'logged at info level, with the time each filter, '
+                      'weigher and lookup took and the number of backends '
+                      'each filter left. 0 disables the decision log and 1 '
+                      'logs every request.'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(metrics_opts)
+
+LOG = logging.getLogger(__name__)
+
+# Upper bounds, in seconds, of the buckets of the timing histograms
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, float('inf'))
+
+
+class Histogram(object):
+    """Distribution of the durations of a scheduling step."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * len(BUCKETS)
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+
+    def to_dict(self):
+        return {'count': self.count,
+                'sum': self.total,
+                'max': self.max,
+                'buckets': {'+Inf' if bound == float('inf') else str(bound):
+                            count
+                            for bound, count in zip(BUCKETS, self.buckets)}}
+
+
+class SchedulerMetrics(object):
+    """Timing histograms and outcome counters of a scheduler."""
+
+    def __init__(self):
+        self.timings = collections.defaultdict(Histogram)
+        self.counters = collections.Counter()
+
+    def observe(self, name, seconds):
+        self.timings[name].observe(seconds)
+
+    def increment(self, name, value=1):
+        self.counters[name] += value
+
+    def snapshot(self):
+        """Return the metrics as a serializable dictionary."""
+        return {'timings': {name: histogram.to_dict()
+                            for name, histogram in self.timings.items()},
+                'counters': dict(self.counters)}
+
+
+METRICS = SchedulerMetrics()
+
+
+class DecisionTrace(object):
+    """Steps of the scheduling of one request."""
+
+    def __init__(self, operation, resource_id):
+        self.operation = operation
+        self.resource_id = resource_id
+        self.outcome = None
+        self.steps = []
+
+    def add(self, name, seconds, detail=None):
+        self.steps.append((name, seconds, detail))
+
+    def format_steps(self):
+        return ', '.join(
+            '%s %.4fs%s' % (name, seconds,
+                            ' (%s)' % detail if detail is not None else '')
+            for name, seconds, detail in self.steps)
+
+
+# With eventlet monkey patching this is local to each greenthread
+_local = threading.local()
+
+
+def current_trace():
+    """Return the decision trace of the request being scheduled, if any."""
+    return getattr(_local, 'trace', None)
+
+
+def record(name, seconds, detail=None):
+    """Record the duration of a step of the current scheduling request."""
+    METRICS.observe(name, seconds)
+    trace = current_trace()
+    if trace is not None:
+        trace.add(name, seconds, detail)
+
+
+@contextlib.contextmanager
+def timer(name):
+    """Record how long the wrapped step takes."""
+    watch = timeutils.StopWatch()
+    watch.start()
+    try:
+        yield
+    finally:
+        record(name, watch.elapsed())
+
+
+@contextlib.contextmanager
+def trace_decision(operation, resource_id=None):
+    """Trace the scheduling of a request and account for its outcome.
+
+    The outcome is "scheduled" unless the wrapped code raises, or sets the
+    outcome of the yielded trace itself.  Nested calls are part of the
+    outermost request.
+    """
+    if current_trace() is not None:
+        yield current_trace()
+        return
+
+    trace = DecisionTrace(operation, resource_id)
+    _local.trace = trace
+    watch = timeutils.StopWatch()
+    watch.start()
+    try:
+        yield trace
+    except exception.NoValidBackend:
+        trace.outcome = trace.outcome or 'no_valid_backend'
+        raise
+    except Exception:
+        trace.outcome = trace.outcome or 'error'
+        raise
+    finally:
+        _local.trace = None
+        elapsed = watch.elapsed()
+        trace.outcome = trace.outcome or 'scheduled'
+        METRICS.observe('request.%s' % operation, elapsed)
+        METRICS.increment('outcome.%s.%s' % (operation, trace.outcome))
+        if random.random() < CONF.scheduler_decision_log_sample_rate:
+            LOG.info("Scheduling %(operation)s for %(resource)s was "
+                     "%(outcome)s in %(elapsed).4fs: %(steps)s",
+                     {'operation': operation, 'resource': resource_id,
+                      'outcome': trace.outcome, 'elapsed': elapsed,
+                      'steps': trace.format_steps()})
+
+
+def _resource_id(value):
+    if isinstance(value, (list, tuple)):
+        return ','.join(str(_resource_id(item)) for item in value)
+    resource_id = getattr(value, 'id', None)
+    if resource_id is None and hasattr(value, 'get'):
+        resource_id = value.get('volume_id')
+    return resource_id
+
+
+def traced(operation, resource_arg=None):
+    """Decorate a scheduler method to trace its decision.
+
+    :param operation: name of the scheduling operation.
+    :param resource_arg: name of the argument with the resource being
+                         scheduled, or with its request spec.
+    """
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            resource_id = None
+            if resource_arg:
+                call_args = inspect.getcallargs(f, *args, **kwargs)
+                resource_id = _resource_id(call_args[resource_arg])
+            with trace_decision(operation, resource_id):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator
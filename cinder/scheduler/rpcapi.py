@@ -72,9 +72,13 @@ class SchedulerAPI(rpc.RPCAPI):
         3.9 - Adds create_snapshot method
         3.10 - Adds backup_id to create_volume method.
         3.11 - Adds manage_existing_snapshot method.
+        3.12 - Adds capabilities_version and base_version to
+               update_service_capabilities to support delta reports.
+        3.13 - Adds create_volumes method.
+        3.14 - Adds get_metrics method.
     """
 
-    RPC_API_VERSION = '3.11'
+    RPC_API_VERSION = '3.14'
     RPC_DEFAULT_VERSION = '3.0'
     TOPIC = constants.SCHEDULER_TOPIC
     BINARY = 'cinder-scheduler'
@@ -108,6 +112,26 @@ class SchedulerAPI(rpc.RPCAPI):
             msg_args.pop('backup_id')
         return cctxt.cast(ctxt, 'create_volume', **msg_args)
 
+    def create_volumes(self, ctxt, volumes, request_specs,
+                       filter_properties_list):
+        if not self.client.can_send_version('3.13'):
+            for volume, request_spec, filter_properties in zip(
+                    volumes, request_specs, filter_properties_list):
+                self.create_volume(ctxt, volume,
+                                   snapshot_id=request_spec['snapshot_id'],
+                                   image_id=request_spec['image_id'],
+                                   request_spec=request_spec,
+                                   filter_properties=filter_properties,
+                                   backup_id=request_spec['backup_id'])
+            return
+
+        for volume in volumes:
+            volume.create_worker()
+        cctxt = self._get_cctxt(version='3.13')
+        msg_args = {'volumes': volumes, 'request_specs': request_specs,
+                    'filter_properties_list': filter_properties_list}
+        return cctxt.cast(ctxt, 'create_volumes', **msg_args)
+
     @rpc.assert_min_rpc_version('3.8')
     def validate_host_capacity(self, ctxt, backend, request_spec,
                                filter_properties=None):
@@ -202,15 +226,28 @@ class SchedulerAPI(rpc.RPCAPI):
         timestamp = timestamp or timeutils.utcnow()
         return jsonutils.to_primitive(timestamp)
 
+    def can_send_capabilities_delta(self):
+        return self.client.can_send_version('3.12')
+
     def update_service_capabilities(self, ctxt, service_name, host,
                                     capabilities, cluster_name,
-                                    timestamp=None):
+                                    timestamp=None, capabilities_version=None,
+                                    base_version=None):
         msg_args = dict(service_name=service_name, host=host,
                         capabilities=capabilities)
 
-        version = '3.3'
+        # Delta reports (with a base_version) must only be sent once
+        # can_send_capabilities_delta() returns True.
+        if (capabilities_version is not None and
+                self.client.can_send_version('3.12')):
+            version = '3.12'
+            msg_args.update(cluster_name=cluster_name,
+                            timestamp=self.prepare_timestamp(timestamp),
+                            capabilities_version=capabilities_version,
+                            base_version=base_version)
         # If server accepts timestamping the capabilities and the cluster name
-        if self.client.can_send_version(version):
+        elif self.client.can_send_version('3.3'):
+            version = '3.3'
             # Serialize the timestamp
             msg_args.update(cluster_name=cluster_name,
                             timestamp=self.prepare_timestamp(timestamp))
@@ -260,3 +297,8 @@ class SchedulerAPI(rpc.RPCAPI):
     def get_log_levels(self, context, service, log_request):
         cctxt = self._get_cctxt(server=service.host, version='3.7')
         return cctxt.call(context, 'get_log_levels', log_request=log_request)
+
+    @rpc.assert_min_rpc_version('3.14')
+    def get_metrics(self, context, service):
+        cctxt = self._get_cctxt(server=service.host, version='3.14')
+        return cctxt.call(context, 'get_metrics')
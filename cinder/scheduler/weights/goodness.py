@@ -39,6 +39,12 @@ class GoodnessWeigher(weights.BaseHostWeigher):
 
     """
 
+    # Statistics of the volume being scheduled, set by prepare
+    _request_stats = None
+
+    def prepare(self, weight_properties):
+        self._request_stats = self._generate_request_stats(weight_properties)
+
     def _weigh_object(self, host_state, weight_properties):
         """Determine host's goodness rating based on a goodness_function."""
         stats = self._generate_stats(host_state, weight_properties)
@@ -101,6 +107,18 @@ class GoodnessWeigher(weights.BaseHostWeigher):
 
         return result
 
+    @staticmethod
+    def _generate_request_stats(weight_properties):
+        """Generates the statistics of the volume being scheduled."""
+        volume_type = weight_properties.get('volume_type', {})
+        request_spec = weight_properties.get('request_spec', {})
+        return {
+            'extra_specs': volume_type.get('extra_specs', {}),
+            'qos_specs': weight_properties.get('qos_specs', {}),
+            'volume_stats': request_spec.get('volume_properties', {}),
+            'volume_type': volume_type,
+        }
+
     def _generate_stats(self, host_state, weight_properties):
         """Generates statistics from host and volume data."""
 
@@ -126,22 +144,12 @@ class GoodnessWeigher(weights.BaseHostWeigher):
                 host_caps['goodness_function'] is not None):
             goodness_function = six.text_type(host_caps['goodness_function'])
 
-        qos_specs = weight_properties.get('qos_specs', {})
-
-        volume_type = weight_properties.get('volume_type', {})
-        extra_specs = volume_type.get('extra_specs', {})
-
-        request_spec = weight_properties.get('request_spec', {})
-        volume_stats = request_spec.get('volume_properties', {})
-
-        stats = {
+        stats = dict(self._request_stats or
+                     self._generate_request_stats(weight_properties))
+        stats.update({
             'host_stats': host_stats,
             'host_caps': host_caps,
-            'extra_specs': extra_specs,
-            'qos_specs': qos_specs,
-            'volume_stats': volume_stats,
-            'volume_type': volume_type,
             'goodness_function': goodness_function,
-        }
+        })
 
         return stats
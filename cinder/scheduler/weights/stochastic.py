@@ -23,6 +23,7 @@ weight.
 import random
 
 from cinder.scheduler import base_weight
+from cinder.scheduler import metrics
 from cinder.scheduler import weights as wts
 
 
@@ -43,8 +44,11 @@ class StochasticHostWeightHandler(base_weight.BaseWeightHandler):
         # or normalization.
         weighed_objs = [wts.WeighedHost(obj, 0.0) for obj in obj_list]
         for weigher_cls in weigher_classes:
-            weigher = weigher_cls()
-            weights = weigher.weigh_objects(weighed_objs, weighing_properties)
+            with metrics.timer('weigher.%s' % weigher_cls.__name__):
+                weigher = self.get_instance(weigher_cls)
+                weigher.prepare(weighing_properties)
+                weights = weigher.weigh_objects(weighed_objs,
+                                                weighing_properties)
             for i, weight in enumerate(weights):
                 obj = weighed_objs[i]
                 obj.weight += weigher.weight_multiplier() * weight
@@ -67,6 +67,14 @@ service_opts = [
     cfg.IntOpt('periodic_interval',
                default=60,
                help='Interval, in seconds, between running periodic tasks'),
+    cfg.IntOpt('capabilities_full_report_interval',
+               default=10,
+               min=0,
+               help='Number of capability reports a volume service sends to '
+                    'the schedulers as deltas, containing only what changed '
+                    'since the previous report, between two full reports. '
+                    'Services in a cluster always send full reports. Set to '
+                    '0 to always send full reports.'),
     cfg.IntOpt('periodic_fuzzy_delay',
                default=60,
                help='Range, in seconds, to randomly delay when starting the'
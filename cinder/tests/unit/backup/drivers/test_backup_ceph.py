@@ -14,6 +14,7 @@
 #    under the License.
 """ Tests for Ceph backup service."""
 
+import contextlib
 import hashlib
 import os
 import tempfile
@@ -36,6 +37,7 @@ from cinder import db
 from cinder import exception
 from cinder.i18n import _
 from cinder import objects
+from cinder.objects import fields
 from cinder import test
 from cinder.tests.unit import fake_constants as fake
 
@@ -65,6 +67,43 @@ class MockObjectNotFoundException(MockException):
     """Used as mock for rados.MockObjectNotFoundException."""
 
 
+class FakeRBDImage(object):
+    """In-memory RBD image whose diff is given as a list of extents."""
+
+    def __init__(self, data=b'', extents=None, snaps=None):
+        self.data = bytearray(data)
+        self.extents = extents or []
+        self.snaps = snaps or []
+        self.discarded = []
+
+    def size(self):
+        return len(self.data)
+
+    def resize(self, size):
+        del self.data[size:]
+        self.data.extend(b'\0' * (size - len(self.data)))
+
+    def list_snaps(self):
+        return [{'name': name} for name in self.snaps]
+
+    def create_snap(self, name):
+        self.snaps.append(name)
+
+    def diff_iterate(self, offset, length, from_snapshot, iterate_cb):
+        for extent in self.extents:
+            iterate_cb(*extent)
+
+    def read(self, offset, length):
+        return bytes(self.data[offset:offset + length])
+
+    def write(self, data, offset):
+        self.data[offset:offset + len(data)] = data
+
+    def discard(self, offset, length):
+        self.discarded.append((offset, length))
+        self.data[offset:offset + length] = b'\0' * length
+
+
 def common_mocks(f):
     """Decorator to set mocks common to all tests.
 
@@ -437,6 +476,7 @@ class BackupCephTestCase(test.TestCase):
     @mock.patch('fcntl.fcntl', spec=True)
     @mock.patch('subprocess.Popen', spec=True)
     def test_backup_volume_from_rbd(self, mock_popen, mock_fnctl):
+        self.flags(backup_ceph_native_diff=False)
         backup_name = self.service._get_backup_base_name(self.backup_id,
                                                          diff_format=True)
 
@@ -526,7 +566,8 @@ class BackupCephTestCase(test.TestCase):
                                                    dest_name, dest_pool,
                                                    src_user, src_conf,
                                                    dest_user, dest_conf,
-                                                   src_snap, from_snap):
+                                                   src_snap, from_snap,
+                                                   backup):
                 raise exception.BackupRBDOperationFailed(_('mock'))
 
             # Raise a pseudo exception.BackupRBDOperationFailed.
@@ -623,7 +664,8 @@ class BackupCephTestCase(test.TestCase):
                                                        dest_name, dest_pool,
                                                        src_user, src_conf,
                                                        dest_user, dest_conf,
-                                                       src_snap, from_snap):
+                                                       src_snap, from_snap,
+                                                       backup):
                     raise exception.BackupRBDOperationFailed(_('mock'))
 
                 # Raise a pseudo exception.BackupRBDOperationFailed.
@@ -768,7 +810,7 @@ class BackupCephTestCase(test.TestCase):
                             src_conf='conf_foo',
                             dest_conf='/etc/ceph/ceph.conf',
                             dest_user='cinder', src_snap='new_snap',
-                            from_snap=None)
+                            from_snap=None, backup=self.backup)
 
     @common_mocks
     def test_backup_rbd_from_snap2(self):
@@ -808,7 +850,8 @@ class BackupCephTestCase(test.TestCase):
                             src_conf='conf_foo',
                             dest_conf='/etc/ceph/ceph.conf',
                             dest_user='cinder', src_snap='new_snap',
-                            from_snap='backup.mock.snap.153464362.12')
+                            from_snap='backup.mock.snap.153464362.12',
+                            backup=self.backup)
 
     @common_mocks
     def test_backup_vol_length_0(self):
@@ -898,11 +941,12 @@ class BackupCephTestCase(test.TestCase):
                                         self.service.chunk_size * 2)
 
             self.assertEqual(2, image.write.call_count)
-            self.assertEqual(2, image.flush.call_count)
+            self.assertEqual(1, image.flush.call_count)
             self.assertFalse(image.discard.called)
-            zeroes = '\0' * self.service.chunk_size
+            zeroes = b'\0' * self.service.chunk_size
             image.write.assert_has_calls([mock.call(zeroes, 0),
                                          mock.call(zeroes, self.chunk_size)])
+            self.assertEqual(self.chunk_size * 2, wrapped_rbd.tell())
 
         image.reset_mock()
         image.write.reset_mock()
@@ -912,18 +956,75 @@ class BackupCephTestCase(test.TestCase):
                 mock_file_is_rbd:
             mock_file_is_rbd.return_value = False
 
-            self.service._discard_bytes(wrapped_rbd, 0,
+            self.service._discard_bytes(wrapped_rbd, self.chunk_size,
                                         (self.service.chunk_size * 2) + 1)
 
             self.assertEqual(3, image.write.call_count)
-            self.assertEqual(3, image.flush.call_count)
+            self.assertEqual(1, image.flush.call_count)
             self.assertFalse(image.discard.called)
             image.write.assert_has_calls([mock.call(zeroes,
-                                                    self.chunk_size * 2),
+                                                    self.chunk_size),
                                           mock.call(zeroes,
-                                                    self.chunk_size * 3),
-                                          mock.call('\0',
-                                                    self.chunk_size * 4)])
+                                                    self.chunk_size * 2),
+                                          mock.call(b'\0',
+                                                    self.chunk_size * 3)])
+
+    @common_mocks
+    @mock.patch('cinder.volume.utils.punch_hole', return_value=True)
+    def test_discard_bytes_punch_hole(self, mock_punch_hole):
+        with tempfile.NamedTemporaryFile() as test_file:
+            self.service._discard_bytes(test_file, 1024, 4096)
+
+            mock_punch_hole.assert_called_once_with(test_file, 1024, 4096)
+            self.assertEqual(5120, test_file.tell())
+            self.assertEqual(0, os.fstat(test_file.fileno()).st_size)
+
+    @common_mocks
+    def test_find_zero_ranges(self):
+        self.service.zero_block_size = 4
+        data = b'\0' * 8 + b'abcd' + b'\0' * 4 + b'ef'
+
+        self.assertEqual([(0, 8, True), (8, 12, False), (12, 16, True),
+                          (16, 18, False)],
+                         self.service._find_zero_ranges(data))
+
+        self.service.zero_block_size = 0
+        self.assertEqual([(0, 18, False)],
+                         self.service._find_zero_ranges(data))
+
+    @common_mocks
+    def test_transfer_data_skips_zeroes(self):
+        self.service.chunk_size = 16
+        self.service.zero_block_size = 4
+        data = b'abcd' + b'\0' * 16 + b'efgh' + b'\0' * 8
+        src = six.BytesIO(data)
+        dest = mock.Mock(spec=['seek', 'write', 'flush'])
+
+        self.service._transfer_data(src, 'src_foo', dest, 'dest_foo',
+                                    len(data), dest_is_zeroed=True)
+
+        dest.write.assert_has_calls([mock.call(b'abcd'),
+                                     mock.call(b'efgh')])
+        self.assertEqual(2, dest.write.call_count)
+
+    @common_mocks
+    def test_transfer_data_discards_zeroes(self):
+        self.service.chunk_size = 16
+        self.service.zero_block_size = 4
+        data = b'abcd' + b'\0' * 16 + b'efgh' + b'\0' * 8
+        src = six.BytesIO(data)
+        image = self.mock_rbd.Image.return_value
+        dest = self._get_wrapped_rbd_io(image)
+
+        self.service._transfer_data(src, 'src_foo', dest, 'dest_foo',
+                                    len(data) + 4)
+
+        image.write.assert_has_calls([mock.call(b'abcd', 0),
+                                      mock.call(b'efgh', 20)])
+        self.assertEqual(2, image.write.call_count)
+        # The zeroes, and the bytes past the end of the source
+        image.discard.assert_has_calls([mock.call(4, 12), mock.call(16, 4),
+                                        mock.call(24, 8), mock.call(32, 4)])
 
     @common_mocks
     def test_delete_backup_snapshot(self):
@@ -1236,6 +1337,110 @@ class BackupCephTestCase(test.TestCase):
         self.assertEqual(['popen_init', 'popen_init',
                           'stdout_close', 'communicate'], self.callstack)
 
+    @common_mocks
+    @mock.patch('cinder.volume.utils.notify_about_backup_usage')
+    def test_copy_rbd_diff(self, mock_notify):
+        self.flags(backup_object_number_per_notification=2)
+        self.service.chunk_size = 4
+        src = FakeRBDImage(b'abcdefghijkl\0\0\0\0',
+                           extents=[(0, 12, True), (12, 4, False)])
+        dest = FakeRBDImage(b'x' * 20, snaps=['from_snap'])
+
+        self.service._copy_rbd_diff(src, dest, from_snap='from_snap',
+                                    backup=self.backup)
+
+        self.assertEqual(src.data, dest.data)
+        self.assertEqual([(12, 4)], dest.discarded)
+        # 4 extents once split in chunks, and the end of the transfer
+        self.assertEqual([50, 100, 100],
+                         [c[1]['extra_usage_info']['backup_percent']
+                          for c in mock_notify.call_args_list])
+
+    @common_mocks
+    def test_copy_rbd_diff_without_start_snapshot(self):
+        src = FakeRBDImage(b'abcd', extents=[(0, 4, True)])
+        dest = FakeRBDImage(b'', snaps=['other_snap'])
+
+        self.assertRaises(exception.BackupRBDOperationFailed,
+                          self.service._copy_rbd_diff, src, dest,
+                          from_snap='from_snap')
+        self.assertEqual(b'', dest.data)
+
+    @common_mocks
+    def test_copy_rbd_diff_read_error(self):
+        self.service.chunk_size = 4
+        src = FakeRBDImage(b'abcdefgh', extents=[(0, 8, True)])
+        src.read = mock.Mock(side_effect=MockImageNotFoundException)
+        dest = FakeRBDImage(b'\0' * 8)
+
+        self.assertRaises(MockImageNotFoundException,
+                          self.service._copy_rbd_diff, src, dest)
+
+    @common_mocks
+    @mock.patch('cinder.volume.utils.notify_about_backup_usage')
+    @mock.patch.object(driver.BackupStatusMonitor, 'refresh')
+    def test_copy_rbd_diff_cancelled(self, mock_refresh, mock_notify):
+        self.backup.status = fields.BackupStatus.DELETING
+        src = FakeRBDImage(b'abcd', extents=[(0, 4, True)])
+        dest = FakeRBDImage(b'\0' * 4)
+
+        self.assertRaises(exception.BackupOperationError,
+                          self.service._copy_rbd_diff, src, dest,
+                          backup=self.backup)
+        self.assertEqual(b'\0' * 4, dest.data)
+        mock_notify.assert_not_called()
+
+    @common_mocks
+    def test_rbd_diff_transfer_native(self):
+        self.service.chunk_size = 4
+        src = FakeRBDImage(b'abcdefgh', extents=[(0, 8, True)])
+        dest = FakeRBDImage(b'', snaps=['from_snap'])
+        images = {'src_name': src, 'dest_name': dest}
+        self.mock_object(
+            self.service, '_open_rbd_image',
+            lambda user, conf, pool, name, **kwargs:
+                contextlib.contextmanager(lambda: iter([images[name]]))())
+
+        self.service._rbd_diff_transfer('src_name', 'src_pool', 'dest_name',
+                                        'dest_pool', 'src_user', 'src_conf',
+                                        'dest_user', 'dest_conf',
+                                        src_snap='src_snap',
+                                        from_snap='from_snap')
+
+        self.assertEqual(b'abcdefgh', dest.data)
+        self.assertEqual(['from_snap', 'src_snap'], dest.snaps)
+
+    @common_mocks
+    def test_rbd_diff_transfer_native_error(self):
+        self.mock_rbd.Error = MockException
+        self.mock_rados.Error = MockObjectNotFoundException
+        self.mock_rbd.Image.side_effect = MockImageNotFoundException
+
+        self.assertRaises(exception.BackupRBDOperationFailed,
+                          self.service._rbd_diff_transfer,
+                          'src_name', 'src_pool', 'dest_name', 'dest_pool',
+                          'src_user', 'src_conf', 'dest_user', 'dest_conf')
+        self.assertTrue(self.mock_rados.Rados.return_value.shutdown.called)
+
+    @common_mocks
+    def test_backup_rbd_cancelled(self):
+        self.backup.status = fields.BackupStatus.DELETING
+        volume_file = mock.Mock(spec=['rbd_image', 'seek'])
+        with mock.patch.object(self.service, '_backup_rbd') as \
+                mock_backup_rbd, \
+                mock.patch.object(self.service, '_full_backup') as \
+                mock_full_backup, \
+                mock.patch.object(self.service, '_backup_metadata') as \
+                mock_backup_metadata:
+            mock_backup_rbd.side_effect = exception.BackupOperationError(
+                _('mock'))
+
+            self.assertEqual({}, self.service.backup(self.backup,
+                                                     volume_file))
+
+        self.assertFalse(mock_full_backup.called)
+        self.assertFalse(mock_backup_metadata.called)
+
     @common_mocks
     def test_restore_metdata(self):
         version = 2
@@ -14,6 +14,7 @@
 #    under the License.
 """ Tests for the backup service base driver. """
 
+import collections
 import uuid
 
 import mock
@@ -83,6 +84,45 @@ class BackupBaseDriverTestCase(test.TestCase):
         self.assertIsNone(self.driver.import_record(self.backup,
                                                     export_record))
 
+    @mock.patch.object(driver.time, 'time')
+    def test_status_monitor_interval(self, mock_time):
+        backup = mock.MagicMock(id=self.backup_id)
+        monitor = driver.BackupStatusMonitor(backup, interval=10)
+
+        mock_time.return_value = 100
+        self.assertTrue(monitor.refresh())
+        mock_time.return_value = 109
+        self.assertFalse(monitor.refresh())
+        mock_time.return_value = 110
+        self.assertTrue(monitor.refresh())
+        self.assertEqual(2, backup.refresh.call_count)
+        self.assertEqual(2, backup.as_read_deleted.call_count)
+
+    @mock.patch.object(driver.time, 'time', return_value=100)
+    def test_status_monitor_notify(self, mock_time):
+        backup = mock.MagicMock(id=self.backup_id)
+        monitor = driver.BackupStatusMonitor(backup, interval=10)
+        monitor.refresh()
+
+        driver.BackupStatusMonitor.notify(str(uuid.uuid4()))
+        self.assertFalse(monitor.refresh())
+        driver.BackupStatusMonitor.notify(self.backup_id)
+        self.assertTrue(monitor.refresh())
+        self.assertFalse(monitor.refresh())
+        self.assertEqual(2, backup.refresh.call_count)
+
+    def test_status_monitor_notify_bounded(self):
+        self.mock_object(driver.BackupStatusMonitor, '_changed',
+                         collections.OrderedDict())
+        self.mock_object(driver.BackupStatusMonitor, '_MAX_CHANGED', 2)
+        for backup_id in ('a', 'b', 'c', 'b'):
+            driver.BackupStatusMonitor.notify(backup_id)
+        self.assertEqual(['c', 'b'],
+                         list(driver.BackupStatusMonitor._changed))
+
+    def test_driver_is_abstract(self):
+        self.assertRaises(TypeError, driver.BackupDriver, self.ctxt)
+
 
 class BackupMetadataAPITestCase(test.TestCase):
 
@@ -263,6 +263,7 @@ class BackupNFSSwiftBasedTestCase(test.TestCase):
                 backup.destroy()
             original_refresh()
 
+        self.flags(backup_status_check_interval=0)
         volume_id = fake.VOLUME_ID
         self._create_backup_db_entry(volume_id=volume_id,
                                      container=None,
@@ -723,6 +724,7 @@ class BackupNFSSwiftBasedTestCase(test.TestCase):
 
         self.flags(backup_file_size=(1024 * 8))
         self.flags(backup_sha_block_size_bytes=1024)
+        self.flags(backup_status_check_interval=0)
 
         container_name = self.temp_dir.replace(tempfile.gettempdir() + '/',
                                                '', 1)
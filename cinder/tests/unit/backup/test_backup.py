@@ -1466,6 +1466,15 @@ class BackupTestCase(BaseBackupTest):
         self.backup_mgr.delete_backup(self.ctxt, backup)
         self.assertEqual(2, notify.call_count)
 
+    @mock.patch('cinder.backup.driver.BackupStatusMonitor.notify')
+    def test_delete_backup_notifies_status_monitor(self, mock_notify):
+        """Test running backups are told about the deletion."""
+        vol_id = self._create_volume_db_entry(size=1)
+        backup = self._create_backup_db_entry(
+            status=fields.BackupStatus.DELETING, volume_id=vol_id)
+        self.backup_mgr.delete_backup(self.ctxt, backup)
+        mock_notify.assert_called_once_with(backup.id)
+
     def test_list_backup(self):
         project_id = str(uuid.uuid4())
         backups = db.backup_get_all_by_project(self.ctxt, project_id)
@@ -14,7 +14,9 @@
 """Tests for the base chunkedbackupdriver class."""
 
 import json
+import os
 import uuid
+import zlib
 
 import mock
 from oslo_config import cfg
@@ -22,10 +24,12 @@ from oslo_utils import units
 
 from cinder.backup import chunkeddriver as cbd
 from cinder import context
+from cinder import db
 from cinder import exception
 from cinder import objects
 from cinder.objects import fields
 from cinder import test
+from cinder.tests.unit import fake_constants as fake
 
 
 CONF = cfg.CONF
@@ -94,7 +98,8 @@ class TestObjectReader(object):
         metadata['volume_id'] = 'volumeid'
         metadata['backup_name'] = 'backup_name'
         metadata['backup_description'] = 'backup_description'
-        metadata['objects'] = ['obj1']
+        metadata['objects'] = [{'obj1': {'offset': 0, 'length': 1,
+                                         'compression': 'none'}}]
         metadata['parent_id'] = 'parent_id'
         metadata['extra_metadata'] = 'extra_metadata'
         metadata['chunk_size'] = 1
@@ -208,6 +213,66 @@ class ChunkedDriverTestCase(test.TestCase):
         for algo in ['bz2', 'bzip2']:
             self.assertTrue('bz' in str(self.driver._get_compressor(algo)))
 
+    def test_get_compressor_zlib_level(self):
+        compressor = self.driver._get_compressor('zlib', 1)
+        self.assertTrue('zlib' in str(compressor))
+        self.assertEqual(TEST_DATA,
+                         compressor.decompress(compressor.compress(TEST_DATA)))
+
+    def test_get_compressor_zstd(self):
+        zstandard = mock.Mock()
+        zstandard.ZstdCompressor.return_value.compress.return_value = b'c'
+        zstandard.ZstdDecompressor.return_value.decompress.return_value = b'd'
+        with mock.patch.dict('sys.modules', {'zstandard': zstandard}):
+            compressor = self.driver._get_compressor('zstd', 5)
+            self.assertTrue('zstd' in str(compressor))
+            self.assertEqual(b'c', compressor.compress(TEST_DATA))
+            self.assertEqual(b'd', compressor.decompress(b'c'))
+
+        zstandard.ZstdCompressor.assert_called_once_with(level=5)
+
+    def test_get_compressor_lz4(self):
+        lz4 = mock.Mock()
+        lz4.frame.compress.return_value = b'c'
+        lz4.frame.decompress.return_value = b'd'
+        with mock.patch.dict('sys.modules', {'lz4': lz4,
+                                             'lz4.frame': lz4.frame}):
+            compressor = self.driver._get_compressor('lz4')
+            self.assertTrue('lz4' in str(compressor))
+            self.assertEqual(b'c', compressor.compress(TEST_DATA))
+            self.assertEqual(b'd', compressor.decompress(b'c'))
+
+        lz4.frame.compress.assert_called_once_with(TEST_DATA,
+                                                   compression_level=0)
+
+    def test_get_compressor_zstd_not_installed(self):
+        with mock.patch.dict('sys.modules', {'zstandard': None}):
+            self.assertRaises(ValueError, self.driver._get_compressor,
+                              'zstd')
+
+    def test_prepare_output_data_adaptive_incompressible(self):
+        self.driver.compressor = mock.Mock(wraps=zlib)
+        self.driver.adaptive_compression = True
+        data = os.urandom(4 * cbd._COMPRESSION_SAMPLE_BYTES)
+
+        self.assertEqual(('none', data),
+                         self.driver._prepare_output_data(data))
+
+        comp = self.driver.compressor.compress
+        comp.assert_called_once_with(mock.ANY)
+        self.assertEqual(cbd._COMPRESSION_SAMPLE_BYTES,
+                         len(comp.call_args[0][0]))
+
+    def test_prepare_output_data_adaptive_compressible(self):
+        self.driver.compressor = self.driver._get_compressor('zlib')
+        self.driver.adaptive_compression = True
+        data = b'\1' * 4 * cbd._COMPRESSION_SAMPLE_BYTES
+
+        algorithm, output = self.driver._prepare_output_data(data)
+
+        self.assertEqual('zlib', algorithm)
+        self.assertLess(len(output), len(data))
+
     def test_get_compressor_invalid(self):
         self.assertRaises(ValueError, self.driver._get_compressor, 'winzip')
 
@@ -448,6 +513,232 @@ class ChunkedDriverTestCase(test.TestCase):
 
         mock_notify.assert_called()
 
+    @mock.patch('cinder.volume.utils.notify_about_backup_usage')
+    def test_backup_parallel_writers(self, mock_notify):
+        self.driver.object_writers = 3
+        self.driver.max_pending_chunks = 4
+        chunks = [TEST_DATA[i:i + 10] for i in range(0, len(TEST_DATA), 10)]
+        volume_file = mock.Mock()
+        volume_file.tell.side_effect = [i * 10
+                                        for i in range(len(chunks) + 1)]
+        volume_file.read.side_effect = chunks + [b'']
+        written = {}
+
+        def _get_writer(container, object_name, extra_metadata=None):
+            writer = TestObjectWriter(container, object_name)
+            written[object_name] = writer
+            return writer
+
+        with mock.patch.object(self.driver, 'get_object_writer',
+                               side_effect=_get_writer), \
+                mock.patch.object(self.driver, '_finalize_backup') as final:
+            self.driver.backup(self.backup, volume_file,
+                               backup_metadata=False)
+
+        object_meta = final.call_args[0][2]
+        self.assertEqual(len(chunks) + 1, object_meta['id'])
+        for idx, obj in enumerate(object_meta['list']):
+            object_name, info = list(obj.items())[0]
+            self.assertEqual('test--%05d' % (idx + 1), object_name)
+            self.assertEqual(idx * 10, info['offset'])
+            self.assertEqual(chunks[idx], written[object_name].written_data)
+            self.assertIn('md5', info)
+
+    @mock.patch('cinder.volume.utils.notify_about_backup_usage')
+    def test_backup_parallel_writer_failure(self, mock_notify):
+        self.driver.object_writers = 2
+        volume_file = mock.Mock()
+        volume_file.tell.return_value = 0
+        volume_file.read.side_effect = [TEST_DATA, TEST_DATA, b'']
+
+        with mock.patch.object(self.driver, 'get_object_writer',
+                               side_effect=IOError), \
+                mock.patch.object(self.driver, '_finalize_backup') as final:
+            self.assertRaises(IOError, self.driver.backup, self.backup,
+                              volume_file)
+
+        final.assert_not_called()
+
+    @mock.patch('cinder.volume.utils.notify_about_backup_usage')
+    def test_backup_zero_blocks(self, mock_notify):
+        self.driver.detect_zero_blocks = True
+        self.driver.sha_block_size_bytes = 4
+        self.driver.chunk_size_bytes = 16
+        chunks = [b'\0' * 16, b'abcd' + b'\0' * 8 + b'efgh', b'\0' * 4]
+        volume_file = mock.Mock()
+        volume_file.tell.side_effect = [0, 16, 32, 36]
+        volume_file.read.side_effect = chunks + [b'']
+        written = {}
+
+        def _get_writer(container, object_name, extra_metadata=None):
+            writer = TestObjectWriter(container, object_name)
+            written[object_name] = writer
+            return writer
+
+        with mock.patch.object(self.driver, 'get_object_writer',
+                               side_effect=_get_writer), \
+                mock.patch.object(self.driver, '_finalize_backup') as final:
+            self.driver.backup(self.backup, volume_file,
+                               backup_metadata=False)
+
+        object_meta = final.call_args[0][2]
+        self.assertEqual([[0, 16], [20, 8], [32, 4]],
+                         object_meta['zero_extents'])
+        self.assertEqual([16, 28],
+                         [list(obj.values())[0]['offset']
+                          for obj in object_meta['list']])
+        self.assertEqual([b'abcd', b'efgh'],
+                         [written[name].written_data
+                          for name in sorted(written)])
+
+    def test_find_zero_blocks(self):
+        self.driver.sha_block_size_bytes = 4
+        self.assertEqual([True, False, True],
+                         self.driver._find_zero_blocks(b'\0' * 4 + b'a' +
+                                                       b'\0' * 5))
+
+    def test_write_metadata_zero_extents(self):
+        obj_writer = TestObjectWriter('', '')
+        with mock.patch.object(self.driver, 'get_object_writer',
+                               return_value=obj_writer):
+            self.driver._write_metadata(self.backup, 'volid', 'contain_name',
+                                        ['obj1'], 'volume_meta',
+                                        zero_extents=[[0, 1]])
+
+        metadata = json.loads(obj_writer.written_data.decode('utf-8'))
+        self.assertEqual(self.driver.SPARSE_DRIVER_VERSION,
+                         metadata['version'])
+        self.assertEqual([[0, 1]], metadata['zero_extents'])
+
+    def test_write_dedup_chunk(self):
+        object_info = {}
+        written = {}
+
+        def _get_writer(container, object_name, extra_metadata=None):
+            writer = TestObjectWriter(container, object_name)
+            written[object_name] = writer
+            return writer
+
+        with mock.patch.object(self.driver, 'get_object_writer',
+                               side_effect=_get_writer):
+            self.driver._write_dedup_chunk(self.backup, 'abc', object_info,
+                                           TEST_DATA, None)
+
+        self.assertEqual(['chunk-abc.none'], list(written))
+        self.assertEqual(TEST_DATA, written['chunk-abc.none'].written_data)
+        self.assertEqual('cinder-backup-dedup', object_info['container'])
+        self.assertEqual('chunk-abc.none', object_info['object'])
+        self.assertEqual('none', object_info['compression'])
+        self.assertEqual('b4bc937908ab6be6039b6d4141200de8',
+                         object_info['md5'])
+        refs = db.backup_dedup_ref_get_all(self.ctxt, 'cinder-backup-dedup',
+                                           'abc')
+        self.assertEqual([(self.backup.id, 'chunk-abc.none')],
+                         [(ref.backup_id, ref.object_name) for ref in refs])
+
+    def test_write_dedup_chunk_already_stored(self):
+        object_info = {}
+        db.backup_dedup_ref_create(self.ctxt,
+                                   {'container': 'cinder-backup-dedup',
+                                    'dedup_key': 'abc',
+                                    'object_name': 'chunk-abc.zlib',
+                                    'backup_id': fake.BACKUP2_ID})
+
+        with mock.patch.object(self.driver,
+                               'get_object_writer') as mock_writer:
+            self.driver._write_dedup_chunk(self.backup, 'abc', object_info,
+                                           TEST_DATA, None)
+
+        mock_writer.assert_not_called()
+        self.assertEqual('chunk-abc.zlib', object_info['object'])
+        self.assertEqual('zlib', object_info['compression'])
+        refs = db.backup_dedup_ref_get_all(self.ctxt, 'cinder-backup-dedup',
+                                           'abc')
+        self.assertEqual({self.backup.id, fake.BACKUP2_ID},
+                         {ref.backup_id for ref in refs})
+
+    @mock.patch('cinder.volume.utils.notify_about_backup_usage')
+    def test_backup_deduplication(self, mock_notify):
+        self.driver.deduplication = True
+        volume_file = mock.Mock()
+        volume_file.tell.side_effect = [0, len(TEST_DATA)]
+        volume_file.read.side_effect = [TEST_DATA, b'']
+        shas = self.driver._calculate_sha(TEST_DATA)
+
+        with mock.patch.object(self.driver, '_write_dedup_chunk') as mock_w, \
+                mock.patch.object(self.driver, '_finalize_backup'):
+            self.driver.backup(self.backup, volume_file,
+                               backup_metadata=False)
+
+        mock_w.assert_called_once_with(self.backup,
+                                       self.driver._dedup_key(shas),
+                                       mock.ANY, TEST_DATA, mock.ANY)
+
+    def _test_backup_deduplication_failure(self, failing_method):
+        self.driver.deduplication = True
+        volume_file = mock.Mock()
+        volume_file.tell.side_effect = [0, len(TEST_DATA)]
+        volume_file.read.side_effect = [TEST_DATA, b'']
+        dedup_key = self.driver._dedup_key(
+            self.driver._calculate_sha(TEST_DATA))
+
+        with mock.patch.object(self.driver, 'get_object_writer',
+                               side_effect=TestObjectWriter), \
+                mock.patch.object(self.driver, failing_method,
+                                  side_effect=IOError), \
+                mock.patch.object(self.driver, 'delete_backup'), \
+                mock.patch.object(self.driver, 'delete_object') as mock_del:
+            self.assertRaises(IOError, self.driver.backup, self.backup,
+                              volume_file)
+
+        self.assertEqual([], db.backup_dedup_ref_get_all(
+            self.ctxt, 'cinder-backup-dedup', dedup_key))
+        mock_del.assert_called_once_with('cinder-backup-dedup',
+                                         'chunk-%s.none' % dedup_key)
+
+    @mock.patch('cinder.volume.utils.notify_about_backup_usage')
+    def test_backup_deduplication_metadata_failure(self, mock_notify):
+        self._test_backup_deduplication_failure('_backup_metadata')
+
+    @mock.patch('cinder.volume.utils.notify_about_backup_usage')
+    def test_backup_deduplication_finalize_failure(self, mock_notify):
+        self._test_backup_deduplication_failure('_finalize_backup')
+
+    def test_release_dedup_chunks(self):
+        object_list = [
+            {'test--00001': {'container': 'dedup', 'object': 'chunk-a.none'}},
+            {'test--00002': {'container': 'dedup', 'object': 'chunk-b.zlib'}},
+            {'test--00003': {'container': 'dedup', 'object': 'chunk-a.none'}},
+            {'test--00004': {'offset': 0}},
+        ]
+        for key, object_name, backup_id in (
+                ('a', 'chunk-a.none', self.backup.id),
+                ('b', 'chunk-b.zlib', self.backup.id),
+                ('b', 'chunk-b.zlib', fake.BACKUP2_ID)):
+            db.backup_dedup_ref_create(self.ctxt,
+                                       {'container': 'dedup',
+                                        'dedup_key': key,
+                                        'object_name': object_name,
+                                        'backup_id': backup_id})
+
+        with mock.patch.object(self.driver, 'delete_object') as mock_delete:
+            self.driver._release_dedup_chunks(self.backup, object_list)
+
+        mock_delete.assert_called_once_with('dedup', 'chunk-a.none')
+        self.assertEqual([], db.backup_dedup_ref_get_all(self.ctxt, 'dedup',
+                                                         'a'))
+        refs = db.backup_dedup_ref_get_all(self.ctxt, 'dedup', 'b')
+        self.assertEqual([fake.BACKUP2_ID], [ref.backup_id for ref in refs])
+
+    def test_create_container_deduplication(self):
+        self.driver.deduplication = True
+        with mock.patch.object(self.driver, 'put_container') as mock_put:
+            container = self.driver._create_container(self.backup)
+
+        self.assertEqual([mock.call(container),
+                          mock.call('cinder-backup-dedup')],
+                         mock_put.call_args_list)
+
     def test_backup_invalid_size(self):
         self.driver.chunk_size_bytes = 999
         self.driver.sha_block_size_bytes = 1024
@@ -457,9 +748,29 @@ class ChunkedDriverTestCase(test.TestCase):
                           mock.Mock())
 
     def test_restore(self):
+        volume_file = mock.Mock()
+        restore_test = mock.Mock()
+        self.driver._restore_extents = restore_test
+
+        # Create a second backup
+        backup = self._create_backup_db_entry(
+            self.volume, parent_id=self.backup.id)
+
+        with mock.patch.object(self.driver, 'put_metadata') as mock_put:
+            self.driver.restore(backup, self.volume, volume_file)
+            self.assertEqual(2, mock_put.call_count)
+
+        restore_test.assert_called_once_with(mock.ANY, self.volume,
+                                             volume_file, backup)
+        backup_chain = restore_test.call_args[0][0]
+        self.assertEqual([self.backup.id, backup.id],
+                         [b.id for b, _metadata in backup_chain])
+
+    def test_restore_unmergeable_version(self):
         volume_file = mock.Mock()
         restore_test = mock.Mock()
         self.driver._restore_v1 = restore_test
+        self.driver.EXTENT_MAP_VERSIONS = ()
 
         # Create a second backup
         backup = self._create_backup_db_entry(
@@ -469,7 +780,150 @@ class ChunkedDriverTestCase(test.TestCase):
             self.driver.restore(backup, self.volume, volume_file)
             self.assertEqual(2, mock_put.call_count)
 
-        restore_test.assert_called()
+        self.assertEqual(2, restore_test.call_count)
+
+    def test_restore_extent_map(self):
+        extent_map = cbd._RestoreExtentMap()
+        extent_map.add(0, 100, 'full')
+        extent_map.add(10, 10, 'incr1')
+        extent_map.add(15, 20, 'incr2')
+        extent_map.add(90, 20, 'incr3')
+
+        self.assertEqual([(0, 10, 'full', 0),
+                          (10, 15, 'incr1', 0),
+                          (15, 35, 'incr2', 0),
+                          (35, 90, 'full', 35),
+                          (90, 110, 'incr3', 0)],
+                         list(extent_map))
+
+    def _fake_chain(self):
+        full = self._create_backup_db_entry(self.volume)
+        incr = self._create_backup_db_entry(self.volume, parent_id=full.id)
+        full_metadata = {'objects': [
+            {'full-00001': {'offset': 0, 'length': 4, 'compression': 'none'}},
+            {'full-00002': {'offset': 4, 'length': 4, 'compression': 'none'}},
+        ]}
+        incr_metadata = {'objects': [
+            {'incr-00001': {'offset': 0, 'length': 4, 'compression': 'none'}},
+        ]}
+        return [(full, full_metadata), (incr, incr_metadata)]
+
+    @mock.patch.object(cbd.ChunkedBackupDriver, '_check_restore_objects')
+    def test_plan_restore_skips_overwritten_objects(self, mock_check):
+        backup_chain = self._fake_chain()
+
+        plan = self.driver._plan_restore(backup_chain)
+
+        self.assertEqual(['incr-00001', 'full-00002'],
+                         [item[2] for item in plan])
+        self.assertEqual([[(0, 0, 4)], [(4, 0, 4)]],
+                         [item[4] for item in plan])
+        self.assertEqual(2, mock_check.call_count)
+
+    @mock.patch.object(cbd.ChunkedBackupDriver, '_check_restore_objects')
+    def test_plan_restore_zero_extents(self, mock_check):
+        backup_chain = self._fake_chain()
+        backup_chain[-1][1]['zero_extents'] = [[2, 4]]
+
+        plan = self.driver._plan_restore(backup_chain)
+
+        self.assertEqual(['incr-00001', None, 'full-00002'],
+                         [item[2] for item in plan])
+        self.assertEqual([[(0, 0, 2)], [(2, 0, 4)], [(6, 2, 2)]],
+                         [item[4] for item in plan])
+
+    @mock.patch('cinder.volume.utils.punch_hole', return_value=False)
+    def test_restore_zeroes_without_hole_punching(self, mock_punch):
+        self.driver.chunk_size_bytes = 4
+        volume_file = mock.Mock(spec=['seek', 'write', 'fileno'])
+
+        self.assertFalse(self.driver._restore_zeroes(volume_file, 8, 10))
+
+        mock_punch.assert_called_once_with(volume_file, 8, 10)
+        volume_file.seek.assert_called_once_with(8)
+        written = [c[0][0] for c in volume_file.write.call_args_list]
+        self.assertEqual([b'\0' * 4, b'\0' * 4, b'\0' * 2], written)
+        self.assertEqual([bytes] * 3, [type(w) for w in written])
+
+    @mock.patch('cinder.volume.utils.punch_hole', return_value=True)
+    def test_restore_zeroes_hole_punching(self, mock_punch):
+        volume_file = mock.Mock(spec=['seek', 'write', 'fileno'])
+
+        self.assertTrue(self.driver._restore_zeroes(volume_file, 8, 10))
+
+        volume_file.write.assert_not_called()
+
+    @mock.patch('cinder.volume.utils.punch_hole')
+    def test_restore_zeroes_rbd(self, mock_punch):
+        volume_file = mock.Mock()
+
+        self.assertTrue(self.driver._restore_zeroes(volume_file, 8, 10))
+
+        volume_file.rbd_image.discard.assert_called_once_with(8, 10)
+        mock_punch.assert_not_called()
+        volume_file.write.assert_not_called()
+
+    @mock.patch.object(cbd.ChunkedBackupDriver, '_check_restore_objects')
+    def test_restore_extents(self, mock_check):
+        self.driver.object_readers = 2
+        backup_chain = self._fake_chain()
+        requested_backup = backup_chain[-1][0]
+        requested_backup.status = fields.BackupStatus.RESTORING
+        requested_backup.save()
+        data = {'incr-00001': b'BBBB', 'full-00002': b'cccc'}
+        volume_file = mock.Mock()
+
+        with mock.patch.object(
+                self.driver, '_read_restore_object',
+                side_effect=lambda b, m, name, o: data[name]) as mock_read, \
+                mock.patch('os.fsync'):
+            self.driver._restore_extents(backup_chain, self.volume,
+                                         volume_file, requested_backup)
+
+        self.assertEqual(2, mock_read.call_count)
+        volume_file.seek.assert_called_once_with(0)
+        written = [c[0][0] for c in volume_file.write.call_args_list]
+        self.assertEqual([b'BBBB', b'cccc'], written)
+        self.assertEqual([bytes, bytes], [type(w) for w in written])
+        volume_file.flush.assert_called_once_with()
+
+    @mock.patch('cinder.volume.utils.punch_hole', return_value=True)
+    @mock.patch.object(cbd.ChunkedBackupDriver, '_check_restore_objects')
+    def test_restore_extents_partial_objects(self, mock_check, mock_punch):
+        backup_chain = self._fake_chain()
+        backup_chain[-1][1]['zero_extents'] = [[2, 4]]
+        requested_backup = backup_chain[-1][0]
+        requested_backup.status = fields.BackupStatus.RESTORING
+        requested_backup.save()
+        data = {'incr-00001': b'BBBB', 'full-00002': b'cccc'}
+        volume_file = mock.Mock(spec=['seek', 'write', 'flush', 'fileno'])
+
+        with mock.patch.object(
+                self.driver, '_read_restore_object',
+                side_effect=lambda b, m, name, o: data[name]), \
+                mock.patch('os.fsync'):
+            self.driver._restore_extents(backup_chain, self.volume,
+                                         volume_file, requested_backup)
+
+        mock_punch.assert_called_once_with(volume_file, 2, 4)
+        self.assertEqual([mock.call(0), mock.call(6)],
+                         volume_file.seek.call_args_list)
+        written = [c[0][0] for c in volume_file.write.call_args_list]
+        self.assertEqual([b'BB', b'cc'], written)
+        self.assertEqual([bytes, bytes], [type(w) for w in written])
+
+    def test_delete_backup_dedup_chunks(self):
+        metadata = {'objects': [{'test--00001': {'container': 'dedup',
+                                                 'object': 'chunk-a.none'}}]}
+        with mock.patch.object(self.driver, '_read_metadata',
+                               return_value=metadata), \
+                mock.patch.object(self.driver,
+                                  '_release_dedup_chunks') as mock_release, \
+                mock.patch.object(self.driver, 'delete_object'):
+            self.driver.delete_backup(self.backup)
+
+        mock_release.assert_called_once_with(self.backup,
+                                             metadata['objects'])
 
     def test_delete_backup(self):
         with mock.patch.object(self.driver, 'delete_object') as mock_delete:
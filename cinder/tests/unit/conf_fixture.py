@@ -28,6 +28,7 @@ CONF.import_opt('volume_driver', 'cinder.volume.manager',
 CONF.import_opt('backup_driver', 'cinder.backup.manager')
 CONF.import_opt('backend', 'cinder.keymgr', group='key_manager')
 CONF.import_opt('scheduler_driver', 'cinder.scheduler.manager')
+CONF.import_opt('scheduler_service_cache_ttl', 'cinder.scheduler.host_manager')
 
 def_vol_type = 'fake_vol_type'
 
@@ -51,6 +52,8 @@ def set_defaults(conf):
                      group='key_manager')
     conf.set_default('scheduler_driver',
                      'cinder.scheduler.filter_scheduler.FilterScheduler')
+    # Tests change the services between requests, don't cache them
+    conf.set_default('scheduler_service_cache_ttl', 0)
     conf.set_default('state_path', os.path.abspath(
         os.path.join(os.path.dirname(__file__), '..', '..', '..')))
     conf.set_default('policy_dirs', [], group='oslo_policy')
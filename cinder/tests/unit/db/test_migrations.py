@@ -405,6 +405,31 @@ class MigrationsMixin(test_migrations.WalkVersionsMixin):
         volume_attachment = db_utils.get_table(engine, 'volume_attachment')
         self.assertIn('connector', volume_attachment.c)
 
+    def _check_123(self, engine, data):
+        self.assertTrue(engine.dialect.has_table(engine.connect(),
+                                                 "scheduler_claims"))
+        claims = db_utils.get_table(engine, 'scheduler_claims')
+
+        self.assertIsInstance(claims.c.id.type, self.INTEGER_TYPE)
+        self.assertIsInstance(claims.c.backend.type, self.VARCHAR_TYPE)
+        self.assertIsInstance(claims.c.size.type, self.INTEGER_TYPE)
+        self.assertIsInstance(claims.c.scheduler.type, self.VARCHAR_TYPE)
+        self.assertIsInstance(claims.c.created_at.type, self.TIME_TYPE)
+        self.assertTrue(db_utils.index_exists_on_columns(
+            engine, 'scheduler_claims', ['created_at']))
+
+    def _check_124(self, engine, data):
+        self.assertTrue(engine.dialect.has_table(engine.connect(),
+                                                 "backup_dedup_refs"))
+        refs = db_utils.get_table(engine, 'backup_dedup_refs')
+
+        self.assertIsInstance(refs.c.id.type, self.INTEGER_TYPE)
+        self.assertIsInstance(refs.c.container.type, self.VARCHAR_TYPE)
+        self.assertIsInstance(refs.c.dedup_key.type, self.VARCHAR_TYPE)
+        self.assertIsInstance(refs.c.object_name.type, self.VARCHAR_TYPE)
+        self.assertIsInstance(refs.c.backup_id.type, self.VARCHAR_TYPE)
+        self.assertIsInstance(refs.c.created_at.type, self.TIME_TYPE)
+
     def test_walk_versions(self):
         self.walk_versions(False, False)
         self.assert_each_foreign_key_is_part_of_an_index()
@@ -0,0 +1,160 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import errno
+import os
+
+import fixtures
+import mock
+from oslo_utils import units
+
+from cinder.image import file_cache
+from cinder import test
+from cinder.tests.unit import fake_constants as fake
+
+IMAGE_A = 'a0e1b2c3-0000-4000-8000-000000000001'
+IMAGE_B = 'b0e1b2c3-0000-4000-8000-000000000002'
+IMAGE_C = 'c0e1b2c3-0000-4000-8000-000000000003'
+
+
+class ImageFileCacheTestCase(test.TestCase):
+
+    def setUp(self):
+        super(ImageFileCacheTestCase, self).setUp()
+        self.tmp_dir = self.useFixture(fixtures.TempDir()).path
+        self.cache_dir = os.path.join(self.tmp_dir, 'cache')
+        self.cache = file_cache.ImageFileCache(cache_dir=self.cache_dir,
+                                               max_size_gb=1)
+        self.image_meta = {'checksum': 'abc123',
+                           'updated_at': '2018-01-01T00:00:00'}
+        self.downloads = []
+
+    def _download(self, data):
+        def download(path):
+            self.downloads.append(path)
+            with open(path, 'wb') as f:
+                f.write(data)
+        return download
+
+    def _fetch(self, image_id=fake.IMAGE_ID, image_meta=None, data=b'data',
+               name='image'):
+        path = os.path.join(self.tmp_dir, name)
+        result = self.cache.fetch(image_id, image_meta or self.image_meta,
+                                  path, self._download(data))
+        return result, path
+
+    def _read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_enabled(self):
+        self.assertTrue(self.cache.enabled)
+        self.assertFalse(file_cache.ImageFileCache(cache_dir=self.cache_dir,
+                                                   max_size_gb=0).enabled)
+        # Disabled by default
+        self.assertFalse(file_cache.ImageFileCache().enabled)
+
+    def test_fetch_miss_then_hit(self):
+        result, path = self._fetch()
+        self.assertTrue(result)
+        self.assertEqual(b'data', self._read(path))
+        self.assertEqual(1, len(self.downloads))
+
+        result, path2 = self._fetch(name='image2')
+        self.assertTrue(result)
+        self.assertEqual(b'data', self._read(path2))
+        # Served from the cache
+        self.assertEqual(1, len(self.downloads))
+        self.assertEqual(1, len(os.listdir(self.cache_dir)))
+
+    def test_fetch_is_hard_link(self):
+        result, path = self._fetch()
+        entry = os.path.join(self.cache_dir,
+                             os.listdir(self.cache_dir)[0])
+        self.assertTrue(os.path.samefile(entry, path))
+
+        # The image stays usable once evicted
+        os.remove(entry)
+        self.assertEqual(b'data', self._read(path))
+
+    @mock.patch('os.link', side_effect=OSError(errno.EXDEV, 'cross-device'))
+    def test_fetch_copies_across_file_systems(self, mock_link):
+        result, path = self._fetch()
+
+        self.assertTrue(result)
+        self.assertEqual(b'data', self._read(path))
+        self.assertTrue(mock_link.called)
+
+    def test_fetch_without_checksum(self):
+        result, path = self._fetch(image_meta={'checksum': None})
+
+        self.assertFalse(result)
+        self.assertEqual([], self.downloads)
+        self.assertFalse(os.path.exists(path))
+
+    def test_fetch_disabled(self):
+        self.cache.max_size = 0
+
+        result, path = self._fetch()
+
+        self.assertFalse(result)
+        self.assertFalse(os.path.exists(self.cache_dir))
+
+    def test_fetch_updated_image(self):
+        self._fetch(data=b'old')
+        image_meta = dict(self.image_meta, updated_at='2018-02-01T00:00:00')
+
+        result, path = self._fetch(image_meta=image_meta, data=b'new')
+
+        self.assertEqual(b'new', self._read(path))
+        self.assertEqual(2, len(self.downloads))
+        # The entry of the previous version is gone
+        self.assertEqual(1, len(os.listdir(self.cache_dir)))
+
+    def test_fetch_download_error(self):
+        def download(path):
+            with open(path, 'wb') as f:
+                f.write(b'partial')
+            raise IOError()
+
+        self.assertRaises(IOError, self.cache.fetch, fake.IMAGE_ID,
+                          self.image_meta,
+                          os.path.join(self.tmp_dir, 'image'), download)
+        self.assertEqual([], os.listdir(self.cache_dir))
+
+    def _entry(self, image_id):
+        return [name for name in os.listdir(self.cache_dir)
+                if name.startswith(image_id)][0]
+
+    def test_evict_least_recently_used(self):
+        self.cache.max_size = 10
+        self._fetch(image_id=IMAGE_A, data=b'a' * 4)
+        self._fetch(image_id=IMAGE_B, data=b'b' * 4)
+        os.utime(os.path.join(self.cache_dir, self._entry(IMAGE_A)),
+                 (1000, 1000))
+        os.utime(os.path.join(self.cache_dir, self._entry(IMAGE_B)),
+                 (2000, 2000))
+
+        # Using the first image makes the second one the least recently used
+        self._fetch(image_id=IMAGE_A, data=b'a' * 4)
+        self._fetch(image_id=IMAGE_C, data=b'c' * 4)
+
+        self.assertEqual(2, len(os.listdir(self.cache_dir)))
+        self.assertRaises(IndexError, self._entry, IMAGE_B)
+        self._entry(IMAGE_A)
+        self._entry(IMAGE_C)
+        self.assertEqual(3, len(self.downloads))
+
+    def test_max_size(self):
+        cache = file_cache.ImageFileCache(cache_dir=self.cache_dir,
+                                          max_size_gb=2)
+        self.assertEqual(2 * units.Gi, cache.max_size)
@@ -172,3 +172,29 @@ class TestBaseFilterHandler(test.TestCase):
             result = self._get_filtered_objects(filter_classes, index=2)
             self.assertEqual(filter_objs_expected, result)
             self.assertEqual(1, fake5_filter_all.call_count)
+
+    def test_get_filtered_objects_reuses_instances(self):
+        filter_classes = [FakeFilter1]
+
+        with mock.patch.object(FakeFilter1, '__init__',
+                               return_value=None) as fake1_init, \
+                mock.patch.object(FakeFilter1, 'prepare') as fake1_prepare:
+            self._get_filtered_objects(filter_classes)
+            self._get_filtered_objects(filter_classes)
+
+        fake1_init.assert_called_once_with()
+        fake1_prepare.assert_has_calls([mock.call({'x': 'y'})] * 2)
+
+    def test_get_filtered_objects_prepare_not_shared(self):
+        class PreparedFilter(BaseFakeFilter):
+            def prepare(self, filter_properties):
+                self.value = filter_properties['x']
+
+            def _filter_one(self, obj, filter_properties):
+                return self.value == filter_properties['x']
+
+        filter_classes = [PreparedFilter]
+        result = self._get_filtered_objects(filter_classes)
+        self.assertEqual([1, 2, 3, 4], result)
+        self.assertFalse(hasattr(
+            self.handler.get_instance(PreparedFilter), 'value'))
@@ -0,0 +1,125 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Tests for the scheduler capacity claims stores."""
+
+import datetime
+
+import mock
+from oslo_utils import timeutils
+from tooz import coordination as tooz_coordination
+
+from cinder.scheduler import claims
+from cinder import test
+
+
+class ClaimsStoreTestCase(test.TestCase):
+    def test_get_claims_store_none(self):
+        self.assertIsNone(claims.get_claims_store())
+
+    def test_get_claims_store(self):
+        self.flags(scheduler_claims_store='cinder.scheduler.claims.'
+                                          'DBClaimsStore')
+        self.assertIsInstance(claims.get_claims_store(),
+                              claims.DBClaimsStore)
+
+
+class DBClaimsStoreTestCase(test.TestCase):
+    def test_claims(self):
+        store1 = claims.DBClaimsStore()
+        store2 = claims.DBClaimsStore()
+        now = timeutils.utcnow()
+
+        with mock.patch.object(timeutils, 'utcnow',
+                               return_value=now - datetime.timedelta(
+                                   minutes=10)):
+            store2.add('host@lvm#old', 1)
+        store1.add('host@lvm#pool', 1)
+        store2.add('host@lvm#pool', 2)
+
+        self.assertEqual([('host@lvm#pool', 2)],
+                         [(c.backend, c.size) for c in store1.get_all()])
+        self.assertEqual([('host@lvm#pool', 1)],
+                         [(c.backend, c.size) for c in store2.get_all()])
+
+    @mock.patch('cinder.db.cleanup_expired_scheduler_claims')
+    def test_cleanup(self, mock_cleanup):
+        self.flags(scheduler_claims_ttl=60)
+        now = timeutils.utcnow()
+        store = claims.DBClaimsStore()
+
+        with mock.patch.object(timeutils, 'utcnow', return_value=now):
+            store.cleanup()
+
+        mock_cleanup.assert_called_once_with(
+            store.context, now - datetime.timedelta(seconds=60))
+
+
+class ToozClaimsStoreTestCase(test.TestCase):
+    def setUp(self):
+        super(ToozClaimsStoreTestCase, self).setUp()
+        self.mock_coordinator = mock.Mock()
+        self.mock_object(claims.coordination.Coordinator, 'start')
+        self.store = claims.ToozClaimsStore()
+        self.store.coordinator.coordinator = self.mock_coordinator
+
+    def test_add(self):
+        self.mock_coordinator.create_group.return_value.get.side_effect = (
+            tooz_coordination.GroupAlreadyExist(claims.ToozClaimsStore.GROUP))
+        now = timeutils.utcnow()
+
+        with mock.patch.object(timeutils, 'utcnow',
+                               return_value=now - datetime.timedelta(
+                                   minutes=10)):
+            self.store.add('host@lvm#old', 1)
+        with mock.patch.object(timeutils, 'utcnow', return_value=now):
+            self.store.add('host@lvm#pool', 2)
+
+        self.mock_coordinator.join_group.assert_called_once_with(
+            claims.ToozClaimsStore.GROUP, [])
+        # Expired claims are not published any longer
+        self.mock_coordinator.update_capabilities.assert_called_with(
+            claims.ToozClaimsStore.GROUP,
+            [['host@lvm#pool', 2,
+              now.strftime(timeutils.PERFECT_TIME_FORMAT)]])
+
+    def test_get_all(self):
+        now = timeutils.utcnow()
+        old = now - datetime.timedelta(minutes=10)
+        capabilities = {
+            b'member1': [['host@lvm#pool1', 1,
+                          now.strftime(timeutils.PERFECT_TIME_FORMAT)],
+                         ['host@lvm#pool2', 2,
+                          old.strftime(timeutils.PERFECT_TIME_FORMAT)]],
+            b'member2': [['host@lvm#pool2', 3,
+                          now.strftime(timeutils.PERFECT_TIME_FORMAT)]],
+        }
+
+        def get_capabilities(group, member):
+            result = mock.Mock()
+            if member in capabilities:
+                result.get.return_value = capabilities[member]
+            else:
+                result.get.side_effect = tooz_coordination.MemberNotJoined(
+                    group, member)
+            return result
+
+        self.mock_coordinator.get_members.return_value.get.return_value = [
+            b'member1', b'member2', b'gone', self.store.member_id]
+        self.mock_coordinator.get_member_capabilities.side_effect = (
+            get_capabilities)
+
+        result = self.store.get_all()
+
+        self.assertEqual([('host@lvm#pool1', 1), ('host@lvm#pool2', 3)],
+                         [(c.backend, c.size) for c in result])
+        self.assertEqual(3, self.mock_coordinator.get_member_capabilities.
+                         call_count)
@@ -229,6 +229,75 @@ class FilterSchedulerTestCase(test_scheduler.SchedulerTestCase):
         weighed_host = sched._schedule(fake_context, request_spec, {})
         self.assertIn(resource_backend, weighed_host.obj.host)
 
+    def _get_batch_specs(self, count, size):
+        request_specs = [objects.RequestSpec.from_primitives(
+            {'volume_properties': {'project_id': 1, 'size': size},
+             'volume_type': {'name': 'LVM_iSCSI'},
+             'volume_id': volume_id})
+            for volume_id in (fake.VOLUME_ID, fake.VOLUME2_ID,
+                              fake.VOLUME3_ID)[:count]]
+        return request_specs, [{} for __ in request_specs]
+
+    @mock.patch('cinder.scheduler.driver.volume_update_db')
+    @mock.patch('cinder.db.service_get_all')
+    def test_schedule_create_volumes(self, _mock_service_get_all,
+                                     _mock_volume_update_db):
+        sched = fakes.FakeFilterScheduler()
+        sched.host_manager = fakes.FakeHostManager()
+        fakes.mock_host_manager_db_calls(_mock_service_get_all)
+        fake_context = context.RequestContext('user', 'project',
+                                              is_admin=True)
+        request_specs, filter_properties_list = self._get_batch_specs(3, 400)
+
+        with mock.patch.object(sched.host_manager, 'get_filtered_backends',
+                               wraps=sched.host_manager.get_filtered_backends
+                               ) as mock_filtered, \
+                mock.patch.object(sched.volume_rpcapi,
+                                  'create_volume') as mock_create:
+            results = sched.schedule_create_volumes(fake_context,
+                                                    request_specs,
+                                                    filter_properties_list)
+
+        self.assertEqual([None, None, None], results)
+        # Consumed capacity spreads the requests between backends
+        self.assertEqual(
+            [mock.call(fake_context, fake.VOLUME_ID, 'host1#lvm1', None),
+             mock.call(fake_context, fake.VOLUME2_ID, 'host1#lvm1', None),
+             mock.call(fake_context, fake.VOLUME3_ID, 'host5#_pool0',
+                       None)],
+            _mock_volume_update_db.call_args_list)
+        self.assertEqual(3, mock_create.call_count)
+        # Only the first placement runs all the filters
+        self.assertEqual(['CapacityFilter', 'CapacityFilter'],
+                         [c[0][2] for c in mock_filtered.call_args_list[1:]])
+        for filter_properties in filter_properties_list:
+            self.assertNotIn('context', filter_properties)
+            self.assertEqual(1, filter_properties['retry']['num_attempts'])
+
+    @mock.patch('cinder.scheduler.driver.volume_update_db')
+    @mock.patch('cinder.db.service_get_all')
+    def test_schedule_create_volumes_no_capacity_left(
+            self, _mock_service_get_all, _mock_volume_update_db):
+        sched = fakes.FakeFilterScheduler()
+        sched.host_manager = fakes.FakeHostManager()
+        fakes.mock_host_manager_db_calls(_mock_service_get_all)
+        fake_context = context.RequestContext('user', 'project',
+                                              is_admin=True)
+        # Only host1 can hold one of them, the other backends are disabled
+        for backend in ('host2', 'host3', 'host4', 'host5'):
+            sched.host_manager.service_states[backend] = {}
+        request_specs, filter_properties_list = self._get_batch_specs(2, 600)
+
+        with mock.patch.object(sched.volume_rpcapi, 'create_volume'):
+            results = sched.schedule_create_volumes(fake_context,
+                                                    request_specs,
+                                                    filter_properties_list)
+
+        self.assertIsNone(results[0])
+        self.assertIsInstance(results[1], exception.NoValidBackend)
+        _mock_volume_update_db.assert_called_once_with(
+            fake_context, fake.VOLUME_ID, 'host1#lvm1', None)
+
     def test_max_attempts(self):
         self.flags(scheduler_max_attempts=4)
 
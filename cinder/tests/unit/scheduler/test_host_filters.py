@@ -26,6 +26,7 @@ from cinder import db
 from cinder import exception
 from cinder.scheduler import filters
 from cinder.scheduler.filters import extra_specs_ops
+from cinder.scheduler.filters import instance_locality_filter
 from cinder import test
 from cinder.tests.unit import fake_constants as fake
 from cinder.tests.unit.scheduler import fakes
@@ -598,6 +599,7 @@ class CapacityFilterTestCase(BackendFiltersTestCase):
         self.assertTrue(filt_cls.backend_passes(host, filter_properties))
 
 
+@ddt.ddt
 class AffinityFilterTestCase(BackendFiltersTestCase):
     @mock.patch('cinder.objects.service.Service.is_up',
                 new_callable=mock.PropertyMock)
@@ -818,6 +820,84 @@ class AffinityFilterTestCase(BackendFiltersTestCase):
 
         self.assertFalse(filt_cls.backend_passes(host, filter_properties))
 
+    def _filter_all(self, filt_cls, hosts, hints):
+        filter_properties = {'context': self.context.elevated(),
+                             'scheduler_hints': hints}
+        return [h.host for h in filt_cls.filter_all(hosts, filter_properties)]
+
+    def test_different_filter_all_single_query(self):
+        filt_cls = self.class_map['DifferentBackendFilter']()
+        hosts = [fakes.FakeBackendState(h, {})
+                 for h in ('host1@lvm#pool0', 'host1@lvm#pool1',
+                           'host2@lvm#pool0', 'host3@lvm#pool0')]
+        volume1 = utils.create_volume(self.context, host='host1@lvm#pool1')
+        volume2 = utils.create_volume(self.context, host='host2@lvm#pool0')
+
+        with mock.patch.object(filt_cls.volume_api, 'get_all',
+                               wraps=filt_cls.volume_api.get_all) as get_all:
+            result = self._filter_all(
+                filt_cls, hosts,
+                {'different_host': [volume1.id, volume2.id]})
+
+        self.assertEqual(['host1@lvm#pool0', 'host3@lvm#pool0'], result)
+        get_all.assert_called_once_with(
+            mock.ANY, filters={'id': [volume1.id, volume2.id],
+                               'deleted': False})
+
+    def test_same_filter_all_single_query(self):
+        filt_cls = self.class_map['SameBackendFilter']()
+        hosts = [fakes.FakeBackendState(h, {})
+                 for h in ('host1', 'host1@lvm#pool0', 'host2@lvm#pool0',
+                           'host2@lvm')]
+        volume = utils.create_volume(self.context, host='host2@lvm#pool0')
+
+        with mock.patch.object(filt_cls.volume_api, 'get_all',
+                               wraps=filt_cls.volume_api.get_all) as get_all:
+            result = self._filter_all(filt_cls, hosts,
+                                      {'same_host': volume.id})
+
+        self.assertEqual(['host2@lvm#pool0', 'host2@lvm'], result)
+        get_all.assert_called_once()
+
+    def test_same_filter_all_cluster(self):
+        filt_cls = self.class_map['SameBackendFilter']()
+        host1 = fakes.FakeBackendState('host1@lvm#pool0',
+                                       {'cluster_name': 'cluster@lvm'})
+        host2 = fakes.FakeBackendState('host2@lvm#pool0',
+                                       {'cluster_name': 'other@lvm'})
+        volume = utils.create_volume(self.context, host='host3@lvm#pool0',
+                                     cluster_name='cluster@lvm#pool0')
+
+        result = self._filter_all(filt_cls, [host1, host2],
+                                  {'same_host': [volume.id]})
+
+        self.assertEqual(['host1@lvm#pool0'], result)
+
+    @ddt.data('DifferentBackendFilter', 'SameBackendFilter')
+    def test_filter_all_invalid_hint(self, filter_name):
+        filt_cls = self.class_map[filter_name]()
+        hosts = [fakes.FakeBackendState('host1', {})]
+        hint = 'different_host' if filter_name.startswith('D') else 'same_host'
+
+        with mock.patch.object(filt_cls.volume_api, 'get_all') as get_all:
+            result = self._filter_all(filt_cls, hosts,
+                                      {hint: [fake.VOLUME_ID, 'invalid']})
+
+        self.assertEqual([], result)
+        get_all.assert_not_called()
+
+    @ddt.data('DifferentBackendFilter', 'SameBackendFilter')
+    def test_filter_all_no_hint(self, filter_name):
+        filt_cls = self.class_map[filter_name]()
+        hosts = [fakes.FakeBackendState('host1', {}),
+                 fakes.FakeBackendState('host2', {})]
+
+        with mock.patch.object(filt_cls.volume_api, 'get_all') as get_all:
+            result = self._filter_all(filt_cls, hosts, None)
+
+        self.assertEqual(['host1', 'host2'], result)
+        get_all.assert_not_called()
+
 
 class DriverFilterTestCase(BackendFiltersTestCase):
     def test_passing_function(self):
@@ -846,6 +926,24 @@ class DriverFilterTestCase(BackendFiltersTestCase):
 
         self.assertFalse(filt_cls.backend_passes(host1, filter_properties))
 
+    def test_prepared_request_stats(self):
+        filt_cls = self.class_map['DriverFilter']()
+        host1 = fakes.FakeBackendState(
+            'host1', {
+                'capabilities': {
+                    'filter_function': 'volume.size < 5',
+                }
+            })
+        filter_properties = {
+            'volume_type': {},
+            'request_spec': {'volume_properties': {'size': 1}}}
+
+        filt_cls.prepare(filter_properties)
+        # Request statistics are not generated again for each backend
+        filter_properties['request_spec']['volume_properties'] = {'size': 10}
+
+        self.assertTrue(filt_cls.backend_passes(host1, filter_properties))
+
     def test_no_filter_function(self):
         filt_cls = self.class_map['DriverFilter']()
         host1 = fakes.FakeBackendState(
@@ -1017,6 +1115,10 @@ class InstanceLocalityFilterTestCase(BackendFiltersTestCase):
               [{'publicURL': 'http://novahost:8774/v2/e3f0833dc08b4cea'}]},
              {'type': 'identity', 'name': 'keystone', 'endpoints':
               [{'publicURL': 'http://keystonehost:5000/v2.0'}]}]
+        # Nova answers are shared by all the requests of the process
+        self.mock_object(instance_locality_filter.InstanceLocalityFilter,
+                         '_nova_ext_srv_attr', None)
+        self.addCleanup(instance_locality_filter.HOST_CACHE.clear)
 
     @mock.patch('novaclient.client.discover_extensions')
     @mock.patch('cinder.compute.nova.novaclient')
@@ -1110,6 +1212,122 @@ class InstanceLocalityFilterTestCase(BackendFiltersTestCase):
         self.assertRaises(exception.APITimeout,
                           filt_cls.backend_passes, host, filter_properties)
 
+    def _get_locality_filter_properties(self, instance_uuid):
+        return {'context': self.context,
+                'scheduler_hints': {'local_to_instance': instance_uuid},
+                'request_spec': {'volume_id': fake.VOLUME_ID}}
+
+    @mock.patch('cinder.compute.nova.API.get_server')
+    @mock.patch('cinder.compute.nova.API.has_extension', return_value=True)
+    def test_cache_shared_between_requests(self, mock_has_extension,
+                                           mock_get_server):
+        mock_get_server.return_value = fakes.FakeNovaClient.Server('host1')
+        host1 = fakes.FakeBackendState('host1', {})
+        host2 = fakes.FakeBackendState('host2', {})
+        filter_properties = self._get_locality_filter_properties(
+            fake.INSTANCE_ID)
+
+        for __ in range(2):
+            filt_cls = self.class_map['InstanceLocalityFilter']()
+            filt_cls.prepare(filter_properties)
+            self.assertTrue(filt_cls.backend_passes(host1, filter_properties))
+            self.assertFalse(filt_cls.backend_passes(host2,
+                                                     filter_properties))
+
+        mock_has_extension.assert_called_once_with(
+            self.context, 'ExtendedServerAttributes', timeout=mock.ANY)
+        mock_get_server.assert_called_once_with(
+            self.context, fake.INSTANCE_ID, privileged_user=True,
+            timeout=mock.ANY)
+
+    @mock.patch('time.time')
+    @mock.patch('cinder.compute.nova.API.get_server')
+    @mock.patch('cinder.compute.nova.API.has_extension', return_value=True)
+    def test_cache_expiration(self, mock_has_extension, mock_get_server,
+                              mock_time):
+        self.flags(instance_locality_cache_ttl=60)
+        mock_time.return_value = 1000
+        mock_get_server.side_effect = [fakes.FakeNovaClient.Server('host1'),
+                                       fakes.FakeNovaClient.Server('host2')]
+        host = fakes.FakeBackendState('host1', {})
+        filter_properties = self._get_locality_filter_properties(
+            fake.INSTANCE_ID)
+
+        self.assertTrue(self.class_map['InstanceLocalityFilter']().
+                        backend_passes(host, filter_properties))
+        mock_time.return_value = 1059
+        self.assertTrue(self.class_map['InstanceLocalityFilter']().
+                        backend_passes(host, filter_properties))
+        mock_time.return_value = 1060
+        self.assertFalse(self.class_map['InstanceLocalityFilter']().
+                         backend_passes(host, filter_properties))
+        self.assertEqual(2, mock_get_server.call_count)
+
+    @mock.patch('time.time', return_value=1000)
+    @mock.patch('cinder.compute.nova.API.get_server')
+    @mock.patch('cinder.compute.nova.API.has_extension', return_value=True)
+    def test_negative_cache(self, mock_has_extension, mock_get_server,
+                            mock_time):
+        self.flags(instance_locality_negative_cache_ttl=5)
+        mock_get_server.side_effect = [
+            exception.ServerNotFound(uuid=fake.INSTANCE_ID),
+            fakes.FakeNovaClient.Server(None),
+            fakes.FakeNovaClient.Server('host1')]
+        host = fakes.FakeBackendState('host1', {})
+        filter_properties = self._get_locality_filter_properties(
+            fake.INSTANCE_ID)
+
+        for __ in range(2):
+            # Errors found when preparing the request are raised for backends
+            filt_cls = self.class_map['InstanceLocalityFilter']()
+            filt_cls.prepare(filter_properties)
+            self.assertRaises(exception.ServerNotFound,
+                              filt_cls.backend_passes, host,
+                              filter_properties)
+        self.assertEqual(1, mock_get_server.call_count)
+
+        # Instances that are not on a host yet are not cached for long either
+        for now in (1005, 1009):
+            mock_time.return_value = now
+            self.assertFalse(self.class_map['InstanceLocalityFilter']().
+                             backend_passes(host, filter_properties))
+        self.assertEqual(2, mock_get_server.call_count)
+        mock_time.return_value = 1010
+        self.assertTrue(self.class_map['InstanceLocalityFilter']().
+                        backend_passes(host, filter_properties))
+
+    @mock.patch('cinder.compute.nova.API.get_server')
+    @mock.patch('cinder.compute.nova.API.has_extension', return_value=True)
+    def test_cache_disabled(self, mock_has_extension, mock_get_server):
+        self.flags(instance_locality_cache_ttl=0)
+        mock_get_server.return_value = fakes.FakeNovaClient.Server('host1')
+        host = fakes.FakeBackendState('host1', {})
+        filter_properties = self._get_locality_filter_properties(
+            fake.INSTANCE_ID)
+
+        for __ in range(2):
+            filt_cls = self.class_map['InstanceLocalityFilter']()
+            filt_cls.prepare(filter_properties)
+            self.assertTrue(filt_cls.backend_passes(host, filter_properties))
+            self.assertTrue(filt_cls.backend_passes(host, filter_properties))
+
+        # Still queried once per request
+        self.assertEqual(2, mock_get_server.call_count)
+
+    def test_cache_size(self):
+        self.flags(instance_locality_cache_size=2)
+        cache = instance_locality_filter.InstanceHostCache()
+        cache.set('instance1', 'host1')
+        cache.set('instance2', 'host2')
+        self.assertEqual('host1', cache.get('instance1'))
+
+        cache.set('instance3', 'host3')
+
+        # The least recently used instance is dropped
+        self.assertIs(cache.MISSING, cache.get('instance2'))
+        self.assertEqual('host1', cache.get('instance1'))
+        self.assertEqual('host3', cache.get('instance3'))
+
 
 class TestFilter(filters.BaseBackendFilter):
     pass
@@ -1264,6 +1482,9 @@ class BasicFiltersTestCase(BackendFiltersTestCase):
                                        'service': service})
         assertion = self.assertTrue if passes else self.assertFalse
         assertion(filt_cls.backend_passes(host, filter_properties))
+        # The requirements compiled once per request give the same result
+        filt_cls.prepare(filter_properties)
+        assertion(filt_cls.backend_passes(host, filter_properties))
 
     def test_capability_filter_passes_extra_specs_simple(self):
         self._do_test_type_filter_extra_specs(
@@ -29,6 +29,7 @@ from cinder import context
 from cinder import db
 from cinder import exception
 from cinder import objects
+from cinder.scheduler import claims
 from cinder.scheduler import filters
 from cinder.scheduler import host_manager
 from cinder import test
@@ -535,6 +536,212 @@ class HostManagerTestCase(test.TestCase):
                                                       None, timestamp)
         self.assertTrue(self.host_manager.has_all_capabilities())
 
+    def test_claim_capacity(self):
+        self.host_manager.claims_store = mock.Mock()
+        backend_state = mock.Mock(backend_id='host1@lvm#pool0')
+
+        self.host_manager.claim_capacity(backend_state, {'size': 2})
+
+        backend_state.consume_from_volume.assert_called_once_with(
+            {'size': 2})
+        self.host_manager.claims_store.add.assert_called_once_with(
+            'host1@lvm#pool0', 2)
+
+    def test_claim_capacity_store_error(self):
+        self.host_manager.claims_store = mock.Mock()
+        self.host_manager.claims_store.add.side_effect = Exception
+        backend_state = mock.Mock(backend_id='host1@lvm#pool0')
+
+        self.host_manager.claim_capacity(backend_state, {'size': 2})
+
+        backend_state.consume_from_volume.assert_called_once_with(
+            {'size': 2})
+
+    def test_claim_capacity_no_store(self):
+        backend_state = mock.Mock(backend_id='host1@lvm#pool0')
+        self.host_manager.claim_capacity(backend_state, {'size': 2})
+        backend_state.consume_from_volume.assert_called_once_with(
+            {'size': 2})
+
+    def test_consume_claims(self):
+        claim1 = claims.Claim('host1@lvm#pool0', 1, timeutils.utcnow())
+        claim2 = claims.Claim('host1@lvm#pool1', 2, timeutils.utcnow())
+        self.host_manager.claims_store = mock.Mock()
+        self.host_manager.claims_store.get_all.return_value = [claim1,
+                                                               claim2]
+        pool0 = mock.Mock(backend_id='host1@lvm#pool0')
+        pool2 = mock.Mock(backend_id='host1@lvm#pool2')
+        self.host_manager.backend_state_map = {
+            'host1@lvm': mock.Mock(pools={'pool0': pool0, 'pool2': pool2})}
+
+        self.host_manager._consume_claims()
+
+        pool0.consume_claims.assert_called_once_with([claim1])
+        pool2.consume_claims.assert_called_once_with(())
+
+    def test_consume_claims_store_error(self):
+        self.host_manager.claims_store = mock.Mock()
+        self.host_manager.claims_store.get_all.side_effect = Exception
+        pool0 = mock.Mock(backend_id='host1@lvm#pool0')
+        self.host_manager.backend_state_map = {
+            'host1@lvm': mock.Mock(pools={'pool0': pool0})}
+
+        self.host_manager._consume_claims()
+
+        pool0.consume_claims.assert_not_called()
+
+    def test_update_service_capabilities_delta(self):
+        timestamp = jsonutils.to_primitive(datetime.utcnow())
+        capabilities = {'volume_backend_name': 'lvm',
+                        'pools': [{'pool_name': 'pool1',
+                                   'free_capacity_gb': 10},
+                                  {'pool_name': 'pool2',
+                                   'free_capacity_gb': 20}]}
+        self.assertTrue(self.host_manager.update_service_capabilities(
+            'volume', 'host1', capabilities, None, timestamp,
+            capabilities_version=1))
+
+        delta = {'updated': {}, 'removed': [],
+                 'pools': {'pool2': {'updated': {'free_capacity_gb': 15},
+                                     'removed': []}},
+                 'removed_pools': []}
+        self.assertTrue(self.host_manager.update_service_capabilities(
+            'volume', 'host1', delta, None, timestamp,
+            capabilities_version=2, base_version=1))
+
+        expected = {'volume_backend_name': 'lvm',
+                    'pools': [{'pool_name': 'pool1', 'free_capacity_gb': 10},
+                              {'pool_name': 'pool2', 'free_capacity_gb': 15}],
+                    'timestamp': timestamp}
+        self.assertEqual(expected, self.host_manager.service_states['host1'])
+        self.assertEqual(('host1', 2),
+                         self.host_manager._capabilities_versions['host1'])
+
+    @mock.patch('cinder.db.service_get_all')
+    @mock.patch('cinder.objects.service.Service.is_up',
+                new_callable=mock.PropertyMock, return_value=True)
+    def test_update_service_capabilities_delta_after_consume(
+            self, mock_is_up, mock_service_get_all):
+        ctxt = context.get_admin_context()
+        mock_service_get_all.return_value = [
+            dict(id=1, host='host1', topic='volume', disabled=False,
+                 availability_zone='zone1', updated_at=timeutils.utcnow(),
+                 binary=None, deleted=False, created_at=None, modified_at=None,
+                 report_count=0, deleted_at=None, disabled_reason=None,
+                 uuid='a3a593da-7f8d-4bb7-8b4c-f2bc1e0b4824')]
+        capabilities = {'volume_backend_name': 'lvm',
+                        'pools': [{'pool_name': 'pool1',
+                                   'total_capacity_gb': 100,
+                                   'free_capacity_gb': 10,
+                                   'reserved_percentage': 0}]}
+        self.host_manager.update_service_capabilities(
+            'volume', 'host1', capabilities, None, timeutils.utcnow(),
+            capabilities_version=1)
+        pool = list(self.host_manager.get_all_backend_states(ctxt))[0]
+        pool.consume_from_volume({'size': 1})
+
+        delta = {'updated': {}, 'removed': [],
+                 'pools': {'pool1': {'updated': {'free_capacity_gb': 5},
+                                     'removed': []}},
+                 'removed_pools': []}
+        self.assertTrue(self.host_manager.update_service_capabilities(
+            'volume', 'host1', delta, None, timeutils.utcnow(),
+            capabilities_version=2, base_version=1))
+        pool = list(self.host_manager.get_all_backend_states(ctxt))[0]
+
+        self.assertEqual(5, pool.free_capacity_gb)
+
+    @ddt.data((None, 1), ('host1', 2), ('host2', 1))
+    @ddt.unpack
+    def test_update_service_capabilities_delta_gap(self, host, version):
+        timestamp = jsonutils.to_primitive(datetime.utcnow())
+        capabilities = {'free_capacity_gb': 10}
+        if host:
+            self.host_manager.update_service_capabilities(
+                'volume', host, capabilities, 'cluster', timestamp,
+                capabilities_version=version)
+
+        delta = {'updated': {'free_capacity_gb': 5}, 'removed': []}
+        self.assertFalse(self.host_manager.update_service_capabilities(
+            'volume', 'host1', delta, 'cluster', timestamp,
+            capabilities_version=3, base_version=1))
+        self.assertEqual(10 if host else None,
+                         self.host_manager.service_states.get(
+                             'cluster', {}).get('free_capacity_gb'))
+
+    @mock.patch('eventlet.spawn_n')
+    @mock.patch('time.time')
+    @mock.patch('cinder.objects.ServiceList.get_all')
+    def test_volume_services_cached(self, mock_get_all, mock_time,
+                                    mock_spawn):
+        self.flags(scheduler_service_cache_ttl=10)
+        ctxt = context.get_admin_context()
+        mock_time.return_value = 100
+        self.host_manager.invalidate_services()
+
+        services = self.host_manager._get_volume_services(ctxt)
+        mock_time.return_value = 109
+        self.assertIs(services,
+                      self.host_manager._get_volume_services(ctxt))
+        mock_get_all.assert_called_once_with(
+            ctxt, {'topic': constants.VOLUME_TOPIC, 'disabled': False,
+                   'frozen': False})
+        mock_spawn.assert_not_called()
+
+        # Once expired the stale list is returned and refreshed in the
+        # background, only once.
+        mock_time.return_value = 110
+        self.assertIs(services,
+                      self.host_manager._get_volume_services(ctxt))
+        self.host_manager._get_volume_services(ctxt)
+        mock_spawn.assert_called_once_with(
+            self.host_manager._refresh_volume_services)
+
+        mock_get_all.return_value = mock.sentinel.new_services
+        self.host_manager._refresh_volume_services()
+        self.assertFalse(self.host_manager._services_refreshing)
+        self.assertEqual(mock.sentinel.new_services,
+                         self.host_manager._get_volume_services(ctxt))
+        self.assertEqual(2, mock_get_all.call_count)
+
+    @mock.patch('cinder.objects.ServiceList.get_all')
+    def test_volume_services_no_cache(self, mock_get_all):
+        ctxt = context.get_admin_context()
+        self.host_manager._get_volume_services(ctxt)
+        self.host_manager._get_volume_services(ctxt)
+        self.assertEqual(2, mock_get_all.call_count)
+
+    @mock.patch('cinder.objects.ServiceList.get_all')
+    def test_volume_services_invalidated_while_loading(self, mock_get_all):
+        self.flags(scheduler_service_cache_ttl=10)
+        ctxt = context.get_admin_context()
+
+        def invalidate(*args, **kwargs):
+            self.host_manager.invalidate_services()
+            return mock.sentinel.services
+
+        mock_get_all.side_effect = invalidate
+        self.host_manager.invalidate_services()
+
+        self.assertEqual(mock.sentinel.services,
+                         self.host_manager._get_volume_services(ctxt))
+        self.assertIsNone(self.host_manager._services)
+
+    @mock.patch('cinder.scheduler.host_manager.HostManager.'
+                'invalidate_services')
+    def test_update_service_capabilities_new_backend_invalidates(
+            self, mock_invalidate):
+        timestamp = jsonutils.to_primitive(datetime.utcnow())
+        self.host_manager.backend_state_map['host1'] = mock.sentinel.state
+
+        self.host_manager.update_service_capabilities('volume', 'host1', {},
+                                                      None, timestamp)
+        mock_invalidate.assert_not_called()
+
+        self.host_manager.update_service_capabilities('volume', 'host2', {},
+                                                      None, timestamp)
+        mock_invalidate.assert_called_once_with()
+
     @mock.patch('cinder.db.service_get_all')
     @mock.patch('cinder.objects.service.Service.is_up',
                 new_callable=mock.PropertyMock)
@@ -1375,6 +1582,37 @@ class BackendStateTestCase(test.TestCase):
 class PoolStateTestCase(test.TestCase):
     """Test case for BackendState class."""
 
+    def test_consume_claims(self):
+        fake_pool = host_manager.PoolState('host1', None, None, 'pool0')
+        report_time = timeutils.utcnow()
+        volume_capability = {'total_capacity_gb': 1024,
+                             'free_capacity_gb': 512,
+                             'allocated_capacity_gb': 0,
+                             'provisioned_capacity_gb': 512,
+                             'timestamp': report_time}
+        fake_pool.update_from_volume_capability(volume_capability)
+        fake_claims = [
+            claims.Claim('host1#pool0', 5,
+                         report_time - timedelta(seconds=1)),
+            claims.Claim('host1#pool0', 2, report_time + timedelta(seconds=1)),
+            claims.Claim('host1#pool0', 3, report_time + timedelta(seconds=2)),
+        ]
+
+        # Claims already in the report are ignored, and claims are consumed
+        # only once.
+        fake_pool.consume_claims(fake_claims)
+        fake_pool.consume_claims(fake_claims)
+        self.assertEqual(507, fake_pool.free_capacity_gb)
+        self.assertEqual(517, fake_pool.provisioned_capacity_gb)
+
+        # A new report includes the claims
+        volume_capability = dict(volume_capability, free_capacity_gb=507,
+                                 timestamp=report_time + timedelta(seconds=3))
+        fake_pool.update_from_volume_capability(volume_capability)
+        fake_pool.consume_claims(fake_claims)
+        self.assertEqual(507, fake_pool.free_capacity_gb)
+        self.assertEqual(0, fake_pool.claimed_capacity_gb)
+
     def test_update_from_volume_capability(self):
         fake_pool = host_manager.PoolState('host1', None, None, 'pool0')
         self.assertIsNone(fake_pool.free_capacity_gb)
@@ -0,0 +1,122 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Tests for the scheduler metrics and decision log."""
+
+import mock
+
+from cinder import exception
+from cinder.scheduler import base_filter
+from cinder.scheduler import metrics
+from cinder import test
+
+
+class FakeFilter(base_filter.BaseFilter):
+    def _filter_one(self, obj, filter_properties):
+        return obj > 1
+
+
+class SchedulerMetricsTestCase(test.TestCase):
+    def setUp(self):
+        super(SchedulerMetricsTestCase, self).setUp()
+        self.metrics = metrics.SchedulerMetrics()
+        self.mock_object(metrics, 'METRICS', self.metrics)
+
+    def test_histogram(self):
+        histogram = metrics.Histogram()
+        for seconds in (0.0005, 0.002, 0.003, 10):
+            histogram.observe(seconds)
+
+        result = histogram.to_dict()
+
+        self.assertEqual(4, result['count'])
+        self.assertAlmostEqual(10.0055, result['sum'])
+        self.assertEqual(10, result['max'])
+        self.assertEqual(1, result['buckets']['0.001'])
+        self.assertEqual(2, result['buckets']['0.005'])
+        self.assertEqual(1, result['buckets']['+Inf'])
+
+    def test_record_outside_request(self):
+        metrics.record('step', 0.5)
+
+        self.assertEqual(1, self.metrics.timings['step'].count)
+        self.assertIsNone(metrics.current_trace())
+
+    def test_trace_decision(self):
+        with metrics.trace_decision('create_volume', 'vol1') as trace:
+            metrics.record('filter.FakeFilter', 0.5, '4 -> 2')
+            with metrics.trace_decision('inner') as inner_trace:
+                metrics.record('selection', 0.25)
+
+        self.assertIs(trace, inner_trace)
+        self.assertIsNone(metrics.current_trace())
+        self.assertEqual([('filter.FakeFilter', 0.5, '4 -> 2'),
+                          ('selection', 0.25, None)], trace.steps)
+        self.assertEqual('scheduled', trace.outcome)
+        self.assertEqual({'outcome.create_volume.scheduled': 1},
+                         self.metrics.snapshot()['counters'])
+        self.assertEqual(1,
+                         self.metrics.timings['request.create_volume'].count)
+
+    def test_trace_decision_outcomes(self):
+        for exc in (exception.NoValidBackend(reason=''), ValueError()):
+            self.assertRaises(type(exc), self._raise_in_trace, exc)
+        with metrics.trace_decision('create_volumes') as trace:
+            trace.outcome = 'partial'
+
+        self.assertEqual({'outcome.create_volume.no_valid_backend': 1,
+                          'outcome.create_volume.error': 1,
+                          'outcome.create_volumes.partial': 1},
+                         self.metrics.snapshot()['counters'])
+
+    def _raise_in_trace(self, exc):
+        with metrics.trace_decision('create_volume'):
+            raise exc
+
+    @mock.patch.object(metrics.LOG, 'info')
+    def test_decision_log_sampling(self, mock_log):
+        with metrics.trace_decision('create_volume', 'vol1'):
+            pass
+        mock_log.assert_not_called()
+
+        self.flags(scheduler_decision_log_sample_rate=1)
+        with metrics.trace_decision('create_volume', 'vol1'):
+            metrics.record('selection', 0.25)
+
+        mock_log.assert_called_once_with(mock.ANY, mock.ANY)
+        params = mock_log.call_args[0][1]
+        self.assertEqual('vol1', params['resource'])
+        self.assertEqual('scheduled', params['outcome'])
+        self.assertEqual('selection 0.2500s', params['steps'])
+
+    def test_traced(self):
+        class FakeScheduler(object):
+            @metrics.traced('create_volume', 'request_spec')
+            def schedule(self, context, request_spec):
+                return metrics.current_trace()
+
+        trace = FakeScheduler().schedule(None,
+                                         request_spec={'volume_id': 'vol1'})
+
+        self.assertEqual('create_volume', trace.operation)
+        self.assertEqual('vol1', trace.resource_id)
+
+    @mock.patch('cinder.scheduler.base_handler.extension.ExtensionManager')
+    def test_filter_timing(self, mock_ext_mgr):
+        handler = base_filter.BaseFilterHandler(base_filter.BaseFilter,
+                                                'fake_filters')
+
+        with metrics.trace_decision('create_volume') as trace:
+            handler.get_filtered_objects([FakeFilter], [1, 2, 3], {})
+
+        self.assertEqual([('filter.FakeFilter', mock.ANY, '3 -> 2')],
+                         trace.steps)
+        self.assertEqual(1, self.metrics.timings['filter.FakeFilter'].count)
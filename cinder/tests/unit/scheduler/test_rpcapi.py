@@ -62,6 +62,23 @@ class SchedulerRPCAPITestCase(test.RPCAPITestCase):
                            timestamp='123')
         can_send_version.assert_called_once_with('3.3')
 
+    @ddt.data('3.3', '3.12')
+    @mock.patch('oslo_messaging.RPCClient.can_send_version')
+    def test_update_service_capabilities_versioned(self, version,
+                                                   can_send_version):
+        can_send_version.side_effect = lambda x: x == version
+        self._test_rpc_api('update_service_capabilities',
+                           rpc_method='cast',
+                           service_name='fake_name',
+                           host='fake_host',
+                           cluster_name='cluster_name',
+                           capabilities={},
+                           fanout=True,
+                           version=version,
+                           timestamp='123',
+                           capabilities_version=2,
+                           base_version=1)
+
     @ddt.data('3.0', '3.10')
     @mock.patch('oslo_messaging.RPCClient.can_send_version')
     def test_create_volume(self, version, can_send_version):
@@ -79,6 +96,36 @@ class SchedulerRPCAPITestCase(test.RPCAPITestCase):
         create_worker_mock.assert_called_once()
         can_send_version.assert_called_once_with('3.10')
 
+    @mock.patch('oslo_messaging.RPCClient.can_send_version',
+                return_value=True)
+    def test_create_volumes(self, can_send_version):
+        create_worker_mock = self.mock_object(self.fake_volume,
+                                              'create_worker')
+        self._test_rpc_api('create_volumes',
+                           rpc_method='cast',
+                           volumes=[self.fake_volume],
+                           request_specs=[self.fake_rs_obj],
+                           filter_properties_list=[self.fake_fp_dict],
+                           version='3.13')
+        create_worker_mock.assert_called_once()
+        can_send_version.assert_called_once_with('3.13')
+
+    @mock.patch('oslo_messaging.RPCClient.can_send_version',
+                return_value=False)
+    @mock.patch('cinder.scheduler.rpcapi.SchedulerAPI.create_volume')
+    def test_create_volumes_capped(self, create_volume_mock,
+                                   can_send_version):
+        request_spec = objects.RequestSpec(
+            snapshot_id=fake_constants.SNAPSHOT_ID,
+            image_id=None, backup_id=None)
+        self.rpcapi().create_volumes(self.context, [self.fake_volume],
+                                     [request_spec], [self.fake_fp_dict])
+        create_volume_mock.assert_called_once_with(
+            self.context, self.fake_volume,
+            snapshot_id=fake_constants.SNAPSHOT_ID, image_id=None,
+            request_spec=request_spec, filter_properties=self.fake_fp_dict,
+            backup_id=None)
+
     @mock.patch('oslo_messaging.RPCClient.can_send_version',
                 return_value=True)
     def test_create_snapshot(self, can_send_version_mock):
@@ -301,3 +348,12 @@ class SchedulerRPCAPITestCase(test.RPCAPITestCase):
                            service=service,
                            log_request='log_request',
                            version='3.7')
+
+    @mock.patch('oslo_messaging.RPCClient.can_send_version', mock.Mock())
+    def test_get_metrics(self):
+        service = objects.Service(self.context, host='host1')
+        self._test_rpc_api('get_metrics',
+                           rpc_method='call',
+                           server=service.host,
+                           service=service,
+                           version='3.14')
@@ -28,6 +28,7 @@ from cinder import context
 from cinder import exception
 from cinder.message import message_field
 from cinder import objects
+from cinder.scheduler import claims
 from cinder.scheduler import driver
 from cinder.scheduler import manager
 from cinder import test
@@ -173,6 +174,15 @@ class SchedulerManagerTestCase(test.TestCase):
 
         mock_clean.assert_called_once_with(self.context)
 
+    @mock.patch('cinder.scheduler.claims.DBClaimsStore.cleanup')
+    def test_clean_expired_claims(self, mock_cleanup):
+        self.manager.driver.host_manager.claims_store = (
+            claims.DBClaimsStore())
+
+        self.manager._clean_expired_claims(self.context)
+
+        mock_cleanup.assert_called_once_with()
+
     @mock.patch('cinder.scheduler.driver.Scheduler.'
                 'update_service_capabilities')
     def test_update_service_capabilities_empty_dict(self, _mock_update_cap):
@@ -200,6 +210,42 @@ class SchedulerManagerTestCase(test.TestCase):
         _mock_update_cap.assert_called_once_with(service, host, capabilities,
                                                  None, None)
 
+    @mock.patch('cinder.volume.rpcapi.VolumeAPI.request_full_capabilities')
+    @mock.patch('cinder.scheduler.driver.Scheduler.'
+                'update_service_capabilities')
+    def test_update_service_capabilities_delta(self, _mock_update_cap,
+                                               _mock_request_full):
+        capabilities = {'updated': {}, 'removed': []}
+        _mock_update_cap.return_value = True
+
+        self.manager.update_service_capabilities(self.context,
+                                                 service_name='volume',
+                                                 host='fake_host',
+                                                 capabilities=capabilities,
+                                                 capabilities_version=2,
+                                                 base_version=1)
+        _mock_update_cap.assert_called_once_with(
+            'volume', 'fake_host', capabilities, None, None,
+            capabilities_version=2, base_version=1)
+        _mock_request_full.assert_not_called()
+
+    @ddt.data(None, exception.ServiceTooOld(thing='volume', ver='3.16'))
+    @mock.patch('cinder.volume.rpcapi.VolumeAPI.request_full_capabilities')
+    @mock.patch('cinder.scheduler.driver.Scheduler.'
+                'update_service_capabilities', return_value=False)
+    def test_update_service_capabilities_delta_gap(self, side_effect,
+                                                   _mock_update_cap,
+                                                   _mock_request_full):
+        _mock_request_full.side_effect = side_effect
+
+        self.manager.update_service_capabilities(self.context,
+                                                 service_name='volume',
+                                                 host='fake_host',
+                                                 capabilities={},
+                                                 capabilities_version=2,
+                                                 base_version=1)
+        _mock_request_full.assert_called_once_with(self.context, 'fake_host')
+
     @mock.patch('cinder.scheduler.driver.Scheduler.'
                 'notify_service_capabilities')
     def test_notify_service_capabilities_no_timestamp(self, _mock_notify_cap):
@@ -264,6 +310,40 @@ class SchedulerManagerTestCase(test.TestCase):
             resource_uuid=volume.id,
             exception=mock.ANY)
 
+    @mock.patch('cinder.scheduler.metrics.METRICS')
+    def test_get_metrics(self, mock_metrics):
+        result = self.manager.get_metrics(self.context)
+        self.assertEqual(mock_metrics.snapshot.return_value, result)
+
+    @mock.patch('cinder.scheduler.driver.Scheduler.schedule_create_volume')
+    @mock.patch('cinder.message.api.API.create')
+    @mock.patch('cinder.db.volume_update')
+    def test_create_volumes(self, _mock_volume_update, _mock_message_create,
+                            _mock_sched_create):
+        # Requests that can't be placed error out their volume only
+        _mock_sched_create.side_effect = [
+            None, exception.NoValidBackend(reason="")]
+        volumes = [fake_volume.fake_volume_obj(self.context,
+                                               id=fake.VOLUME_ID),
+                   fake_volume.fake_volume_obj(self.context,
+                                               id=fake.VOLUME2_ID)]
+        request_specs = [objects.RequestSpec.from_primitives(
+            {'volume_id': volume.id}) for volume in volumes]
+
+        self.manager.create_volumes(self.context, volumes, request_specs,
+                                    [{}, None])
+
+        _mock_sched_create.assert_has_calls(
+            [mock.call(self.context, request_specs[0], {}),
+             mock.call(self.context, request_specs[1], {})])
+        _mock_volume_update.assert_called_once_with(self.context,
+                                                    fake.VOLUME2_ID,
+                                                    {'status': 'error'})
+        _mock_message_create.assert_called_once_with(
+            self.context, message_field.Action.SCHEDULE_ALLOCATE_VOLUME,
+            resource_uuid=fake.VOLUME2_ID,
+            exception=mock.ANY)
+
     @mock.patch('cinder.scheduler.driver.Scheduler.schedule_create_volume')
     @mock.patch('eventlet.sleep')
     def test_create_volume_no_delay(self, _mock_sleep, _mock_sched_create):
@@ -17,6 +17,8 @@
 Tests For Scheduler weights.
 """
 
+import mock
+
 from cinder.scheduler import base_weight
 from cinder import test
 
@@ -52,3 +54,31 @@ class TestWeightHandler(test.TestCase):
         for seq, result, minval, maxval in map_:
             ret = base_weight.normalize(seq, minval=minval, maxval=maxval)
             self.assertEqual(result, tuple(ret))
+
+    @mock.patch('cinder.scheduler.base_handler.extension.ExtensionManager')
+    def test_weighers_reused_per_request(self, mock_ext_mgr):
+        class FakeWeigher(base_weight.BaseWeigher):
+            instances = 0
+
+            def __init__(self):
+                FakeWeigher.instances += 1
+
+            def prepare(self, weight_properties):
+                self.offset = weight_properties['offset']
+
+            def _weigh_object(self, obj, weight_properties):
+                return obj + self.offset
+
+        handler = base_weight.BaseWeightHandler(base_weight.BaseWeigher,
+                                                'fake_weighers')
+        result1 = handler.get_weighed_objects([FakeWeigher], [1, 2],
+                                              {'offset': 0})
+        result2 = handler.get_weighed_objects([FakeWeigher], [1, 3],
+                                              {'offset': 10})
+
+        self.assertEqual(1, FakeWeigher.instances)
+        self.assertEqual([(2, 1.0), (1, 0.0)],
+                         [(w.obj, w.weight) for w in result1])
+        # Normalization bounds of a request don't leak into the next one
+        self.assertEqual([(3, 1.0), (1, 0.0)],
+                         [(w.obj, w.weight) for w in result2])
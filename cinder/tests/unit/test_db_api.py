@@ -2477,6 +2477,69 @@ class DBAPIMessageTestCase(BaseTest):
             self.assertEqual(2, len(messages))
 
 
+class DBAPISchedulerClaimTestCase(BaseTest):
+
+    """Tests for scheduler capacity claim operations"""
+    def setUp(self):
+        super(DBAPISchedulerClaimTestCase, self).setUp()
+        self.context = context.get_admin_context()
+
+    def _create_claim(self, backend, created_at):
+        db.scheduler_claim_create(self.context,
+                                  {'backend': backend,
+                                   'size': 1,
+                                   'scheduler': fake.UUID1,
+                                   'created_at': created_at})
+
+    def test_scheduler_claims(self):
+        now = timeutils.utcnow()
+        self._create_claim('old', now - datetime.timedelta(minutes=10))
+        self._create_claim('new', now)
+
+        claims = db.scheduler_claim_get_all(
+            self.context, now - datetime.timedelta(minutes=5))
+        self.assertEqual(['new'], [claim.backend for claim in claims])
+
+        db.cleanup_expired_scheduler_claims(
+            self.context, now - datetime.timedelta(minutes=5))
+        claims = db.scheduler_claim_get_all(
+            self.context, now - datetime.timedelta(days=1))
+        self.assertEqual(['new'], [claim.backend for claim in claims])
+
+
+class DBAPIBackupDedupRefTestCase(BaseTest):
+
+    """Tests for backup deduplication reference operations"""
+    def _create_ref(self, dedup_key, backup_id):
+        return db.backup_dedup_ref_create(self.ctxt,
+                                          {'container': 'dedup',
+                                           'dedup_key': dedup_key,
+                                           'object_name': 'chunk-%s.zlib' %
+                                                          dedup_key,
+                                           'backup_id': backup_id})
+
+    def test_backup_dedup_refs(self):
+        self.assertTrue(self._create_ref('a', fake.BACKUP_ID))
+        self.assertFalse(self._create_ref('a', fake.BACKUP_ID))
+        self.assertTrue(self._create_ref('a', fake.BACKUP2_ID))
+        self.assertTrue(self._create_ref('b', fake.BACKUP_ID))
+
+        refs = db.backup_dedup_ref_get_all(self.ctxt, 'dedup', 'a')
+        self.assertEqual({fake.BACKUP_ID, fake.BACKUP2_ID},
+                         {ref.backup_id for ref in refs})
+        self.assertEqual(['chunk-a.zlib'] * 2,
+                         [ref.object_name for ref in refs])
+
+        self.assertEqual(1, db.backup_dedup_ref_destroy(
+            self.ctxt, 'dedup', 'a', fake.BACKUP_ID))
+        self.assertEqual(0, db.backup_dedup_ref_destroy(
+            self.ctxt, 'dedup', 'a', fake.BACKUP2_ID))
+        self.assertEqual([], db.backup_dedup_ref_get_all(self.ctxt, 'dedup',
+                                                         'a'))
+        self.assertEqual(1, len(db.backup_dedup_ref_get_all(self.ctxt,
+                                                            'dedup', 'b')))
+
+
 class DBAPIQuotaClassTestCase(BaseTest):
 
     """Tests for db.api.quota_class_* methods."""
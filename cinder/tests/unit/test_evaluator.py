@@ -13,6 +13,10 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
+
+import mock
+
 from cinder import exception
 from cinder.scheduler.evaluator import evaluator
 from cinder import test
@@ -137,3 +141,34 @@ class EvaluatorTestCase(test.TestCase):
         self.assertRaises(exception.EvaluatorParseException,
                           evaluator.evaluate,
                           "7 / 0")
+
+    def test_compiled_expression_reused(self):
+        expression = evaluator.compile_expression("stats.free * 2")
+
+        self.assertIs(expression,
+                      evaluator.compile_expression("stats.free * 2"))
+        self.assertEqual(2, expression.evaluate(stats={'free': 1}))
+        self.assertEqual(6, expression.evaluate(stats={'free': 3}))
+        self.assertEqual(4, evaluator.evaluate("stats.free * 2",
+                                               stats={'free': 2}))
+
+    @mock.patch.object(evaluator, '_EXPRESSIONS_CACHE_SIZE', 2)
+    @mock.patch.object(evaluator, '_expressions', collections.OrderedDict())
+    def test_compiled_expression_cache_eviction(self):
+        first = evaluator.compile_expression("1 + 1")
+        evaluator.compile_expression("2 + 2")
+        evaluator.compile_expression("1 + 1")
+        evaluator.compile_expression("3 + 3")
+
+        self.assertEqual(["1 + 1", "3 + 3"], list(evaluator._expressions))
+        self.assertIs(first, evaluator.compile_expression("1 + 1"))
+
+    @mock.patch.object(evaluator, '_expressions', collections.OrderedDict())
+    def test_bad_expression_cached(self):
+        with mock.patch.object(evaluator, 'Expression',
+                               wraps=evaluator.Expression) as mock_expr:
+            for i in range(2):
+                self.assertRaises(exception.EvaluatorParseException,
+                                  evaluator.evaluate, "1/*1")
+
+        mock_expr.assert_called_once_with("1/*1")
@@ -16,11 +16,16 @@
 
 import ddt
 import errno
+import hashlib
 import math
+import os
+import tempfile
 
 import mock
 from oslo_concurrency import processutils
 from oslo_utils import units
+import six
+from six.moves import range
 
 from cinder import exception
 from cinder.image import image_utils
@@ -62,6 +67,44 @@ class TestQemuImgInfo(test.TestCase):
                                           prlimit=image_utils.QEMU_IMG_LIMITS)
         self.assertEqual(mock_info.return_value, output)
 
+    @mock.patch('os.name', new='posix')
+    @mock.patch('oslo_utils.imageutils.QemuImgInfo')
+    @mock.patch('cinder.utils.execute', return_value=('out', 'err'))
+    def test_qemu_img_info_temporary_image(self, mock_exec, mock_info):
+        self.mock_object(image_utils, 'TEMPORARY_IMAGE_INFO',
+                         {mock.sentinel.tmp: None})
+
+        for i in range(2):
+            output = image_utils.qemu_img_info(mock.sentinel.tmp)
+            self.assertEqual(mock_info.return_value, output)
+            image_utils.qemu_img_info(mock.sentinel.path)
+
+        # Only the temporary image is inspected once
+        self.assertEqual(3, mock_exec.call_count)
+        self.assertEqual(2, mock_exec.call_args_list.count(
+            mock.call('env', 'LC_ALL=C', 'qemu-img', 'info',
+                      mock.sentinel.path, run_as_root=True,
+                      prlimit=image_utils.QEMU_IMG_LIMITS)))
+
+    @mock.patch('cinder.image.image_utils.fetch_verify_image')
+    @mock.patch('cinder.image.image_utils.temporary_file')
+    def test_temporary_images_inspected_once(self, mock_temp, mock_verify):
+        tmp = mock.sentinel.tmp
+        mock_temp.return_value.__enter__.return_value = tmp
+        ctxt = mock.Mock(user_id=fake.USER_ID)
+
+        def _verify(context, image_service, image_id, dest):
+            self.assertIn(dest, image_utils.TEMPORARY_IMAGE_INFO)
+
+        mock_verify.side_effect = _verify
+
+        with image_utils.TemporaryImages.fetch(FakeImageService(), ctxt,
+                                               fake.IMAGE_ID) as tmp_img:
+            self.assertEqual(tmp, tmp_img)
+            self.assertIn(tmp, image_utils.TEMPORARY_IMAGE_INFO)
+        self.assertNotIn(tmp, image_utils.TEMPORARY_IMAGE_INFO)
+        self.assertTrue(mock_verify.called)
+
     @mock.patch('cinder.image.image_utils.os')
     @mock.patch('oslo_utils.imageutils.QemuImgInfo')
     @mock.patch('cinder.utils.execute')
@@ -278,6 +321,101 @@ class TestConvertImage(test.TestCase):
                                           '-O', 'vpc',
                                           source, dest, run_as_root=True)
 
+    def _set_tuning(self, **kwargs):
+        image_utils.ConversionTuning.set_default(
+            image_utils.ConversionTuning(**kwargs))
+        self.addCleanup(image_utils.ConversionTuning.set_default, None)
+
+    @mock.patch('cinder.image.image_utils.get_qemu_img_version',
+                return_value=[2, 12, 0])
+    @mock.patch('cinder.image.image_utils.qemu_img_info')
+    @mock.patch('cinder.utils.execute')
+    @mock.patch('cinder.utils.is_blk_device', return_value=True)
+    @mock.patch('cinder.volume.utils.check_for_odirect_support',
+                return_value=True)
+    def test_convert_tuning(self, mock_odirect, mock_isblk, mock_exec,
+                            mock_info, mock_version):
+        source = mock.sentinel.source
+        dest = mock.sentinel.dest
+        self._set_tuning(coroutines=16, out_of_order_writes=True,
+                         target_is_zero=True)
+
+        image_utils.convert_image(source, dest, 'raw')
+
+        # Only new volumes are known to be zeroed
+        mock_exec.assert_called_once_with('qemu-img', 'convert', '-O', 'raw',
+                                          '-t', 'none', '-m', '16', '-W',
+                                          source, dest, run_as_root=True)
+
+    @mock.patch('cinder.image.image_utils.get_qemu_img_version',
+                return_value=[2, 8, 0])
+    @mock.patch('cinder.image.image_utils.qemu_img_info')
+    @mock.patch('cinder.utils.execute')
+    @mock.patch('cinder.utils.is_blk_device', return_value=False)
+    def test_convert_tuning_old_qemu_img(self, mock_isblk, mock_exec,
+                                         mock_info, mock_version):
+        source = mock.sentinel.source
+        dest = mock.sentinel.dest
+        self._set_tuning(coroutines=16, out_of_order_writes=True)
+
+        image_utils.convert_image(source, dest, 'raw')
+
+        mock_exec.assert_called_once_with('qemu-img', 'convert', '-O', 'raw',
+                                          source, dest, run_as_root=True)
+
+    @mock.patch('cinder.image.image_utils.get_qemu_img_version',
+                return_value=[5, 0, 0])
+    @mock.patch('cinder.image.image_utils.qemu_img_info')
+    @mock.patch('cinder.utils.execute')
+    @mock.patch('cinder.utils.is_blk_device', return_value=True)
+    @mock.patch('cinder.volume.utils.check_for_odirect_support',
+                return_value=False)
+    def test_convert_target_is_zero(self, mock_odirect, mock_isblk,
+                                    mock_exec, mock_info, mock_version):
+        source = mock.sentinel.source
+        dest = mock.sentinel.dest
+        self._set_tuning(target_is_zero=True)
+
+        image_utils.convert_image(source, dest, 'raw', target_is_zero=True)
+        mock_exec.assert_called_once_with('qemu-img', 'convert', '-O', 'raw',
+                                          '-n', '--target-is-zero',
+                                          source, dest, run_as_root=True)
+
+        # Only raw volumes are written to in place
+        mock_exec.reset_mock()
+        image_utils.convert_image(source, dest, 'qcow2', target_is_zero=True)
+        mock_exec.assert_called_once_with('qemu-img', 'convert', '-O',
+                                          'qcow2', source, dest,
+                                          run_as_root=True)
+
+    @mock.patch('cinder.image.image_utils.get_qemu_img_version',
+                return_value=[5, 0, 0])
+    @mock.patch('cinder.image.image_utils.qemu_img_info')
+    @mock.patch('cinder.utils.execute')
+    @mock.patch('cinder.utils.is_blk_device', return_value=False)
+    def test_convert_target_is_zero_file(self, mock_isblk, mock_exec,
+                                         mock_info, mock_version):
+        source = mock.sentinel.source
+        self._set_tuning(target_is_zero=True)
+
+        with tempfile.NamedTemporaryFile() as dest:
+            # Temporary files are created by qemu-img
+            image_utils.convert_image(source, dest.name, 'raw',
+                                      target_is_zero=True)
+            mock_exec.assert_called_once_with('qemu-img', 'convert', '-O',
+                                              'raw', source, dest.name,
+                                              run_as_root=True)
+
+            dest.write(b'\0' * 512)
+            dest.flush()
+            mock_exec.reset_mock()
+            image_utils.convert_image(source, dest.name, 'raw',
+                                      target_is_zero=True)
+            mock_exec.assert_called_once_with('qemu-img', 'convert', '-O',
+                                              'raw', '-n', '--target-is-zero',
+                                              source, dest.name,
+                                              run_as_root=True)
+
 
 class TestResizeImage(test.TestCase):
     @mock.patch('cinder.utils.execute')
@@ -526,10 +664,9 @@ class TestUploadVolume(test.TestCase):
                                            volume_path)
 
         self.assertIsNone(output)
-        mock_convert.assert_called_once_with(volume_path,
-                                             temp_file,
-                                             output_format,
-                                             run_as_root=True)
+        mock_convert.assert_called_once_with(
+            volume_path, temp_file, output_format, run_as_root=True,
+            src_virtual_size=mock_info.return_value.virtual_size)
         mock_info.assert_called_with(temp_file, run_as_root=True)
         self.assertEqual(2, mock_info.call_count)
         mock_open.assert_called_once_with(temp_file, 'rb')
@@ -553,6 +690,7 @@ class TestUploadVolume(test.TestCase):
         volume_path = mock.sentinel.volume_path
         mock_os.name = 'posix'
         mock_os.access.return_value = False
+        mock_conf.image_upload_stream_raw = False
 
         output = image_utils.upload_volume(ctxt, image_service, image_meta,
                                            volume_path)
@@ -582,6 +720,7 @@ class TestUploadVolume(test.TestCase):
         volume_path = mock.sentinel.volume_path
         mock_os.name = 'nt'
         mock_os.access.return_value = False
+        mock_conf.image_upload_stream_raw = False
 
         output = image_utils.upload_volume(ctxt, image_service, image_meta,
                                            volume_path)
@@ -616,15 +755,147 @@ class TestUploadVolume(test.TestCase):
         self.assertRaises(exception.ImageUnacceptable,
                           image_utils.upload_volume,
                           ctxt, image_service, image_meta, volume_path)
-        mock_convert.assert_called_once_with(volume_path,
-                                             temp_file,
-                                             mock.sentinel.disk_format,
-                                             run_as_root=True)
+        mock_convert.assert_called_once_with(
+            volume_path, temp_file, mock.sentinel.disk_format,
+            run_as_root=True,
+            src_virtual_size=mock_info.return_value.virtual_size)
         mock_info.assert_called_with(temp_file, run_as_root=True)
         self.assertEqual(2, mock_info.call_count)
         self.assertFalse(image_service.update.called)
 
 
+class TestStreamVolumeUpload(test.TestCase):
+    def setUp(self):
+        super(TestStreamVolumeUpload, self).setUp()
+        self.mock_object(image_utils, 'STREAM_BUFFER_SIZE', 4)
+        self.ctxt = mock.sentinel.context
+        self.image_service = mock.Mock()
+        self.uploaded = []
+        self.image_service.update.side_effect = self._update
+        fd, self.volume_path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, self.volume_path)
+
+    def _update(self, context, image_id, image_meta, data):
+        while True:
+            block = data.read(3)
+            if not block:
+                break
+            self.uploaded.append(block)
+
+    def _write_volume(self, data):
+        with open(self.volume_path, 'wb') as volume_file:
+            volume_file.write(data)
+
+    def _map_output(self, *extents):
+        lines = ['Offset          Length          Mapped to       File']
+        for start, length, offset in extents:
+            lines.append('%#-16x %#-16x %#-16x %s' %
+                         (start, length, offset, self.volume_path))
+        return '\n'.join(lines) + '\n', ''
+
+    def _upload(self, image_format='raw', volume_format='raw'):
+        image_meta = {'id': fake.IMAGE_ID, 'disk_format': image_format}
+        image_utils.upload_volume(self.ctxt, self.image_service, image_meta,
+                                  self.volume_path,
+                                  volume_format=volume_format)
+
+    @mock.patch('cinder.image.image_utils._read_at',
+                side_effect=image_utils._read_at)
+    @mock.patch('cinder.utils.execute')
+    def test_raw_file_skips_holes(self, mock_exec, mock_read):
+        self._write_volume(b'abcdefgh' + b'\0' * 8 + b'ijklmn')
+        mock_exec.return_value = self._map_output((0, 8, 0), (16, 6, 16))
+
+        self._upload()
+
+        self.assertEqual(b'abcdefgh' + b'\0' * 8 + b'ijklmn',
+                         b''.join(self.uploaded))
+        mock_exec.assert_called_once_with(
+            'qemu-img', 'map', '-f', 'raw', self.volume_path,
+            run_as_root=True, prlimit=image_utils.QEMU_IMG_LIMITS)
+        # The hole is not read
+        self.assertEqual([0, 4, 16, 20],
+                         [c[0][1] for c in mock_read.call_args_list])
+
+    @mock.patch('cinder.image.image_utils.qemu_img_info')
+    @mock.patch('cinder.image.image_utils.convert_image')
+    @mock.patch('cinder.utils.execute')
+    def test_qcow2_volume(self, mock_exec, mock_convert, mock_info):
+        # Clusters of the volume are stored out of order after its header
+        self._write_volume(b'HEADER' + b'ijkl' + b'abcdef')
+        mock_exec.return_value = self._map_output((0, 6, 10), (10, 4, 6))
+        mock_info.return_value.file_format = 'qcow2'
+        mock_info.return_value.backing_file = None
+        mock_info.return_value.virtual_size = 16
+
+        self._upload(volume_format='qcow2')
+
+        self.assertEqual(b'abcdef' + b'\0' * 4 + b'ijkl' + b'\0' * 2,
+                         b''.join(self.uploaded))
+        mock_exec.assert_called_once_with(
+            'qemu-img', 'map', '-f', 'qcow2', self.volume_path,
+            run_as_root=True, prlimit=image_utils.QEMU_IMG_LIMITS)
+        self.assertFalse(mock_convert.called)
+
+    @mock.patch('cinder.image.image_utils.qemu_img_info')
+    @mock.patch('cinder.image.image_utils.convert_image')
+    @mock.patch('cinder.utils.execute')
+    def test_qcow2_volume_not_mappable(self, mock_exec, mock_convert,
+                                       mock_info):
+        # Compressed clusters
+        mock_exec.side_effect = processutils.ProcessExecutionError
+        mock_info.return_value.file_format = 'qcow2'
+        mock_info.return_value.backing_file = None
+        mock_info.return_value.virtual_size = 16
+        # Checked after the conversion
+        mock_info.side_effect = [mock_info.return_value,
+                                 mock.Mock(file_format='raw')]
+
+        self._upload(volume_format='qcow2')
+
+        self.assertTrue(mock_convert.called)
+        self.assertEqual(1, self.image_service.update.call_count)
+
+    @mock.patch('cinder.utils.execute')
+    def test_external_data_file(self, mock_exec):
+        mock_exec.return_value = ('Offset Length Mapped to File\n'
+                                  '0 0x10 0 /other/file\n', '')
+
+        self.assertIsNone(image_utils._get_volume_data_map(
+            self.volume_path, 'qcow2'))
+
+    @mock.patch('cinder.utils.is_blk_device', return_value=True)
+    @mock.patch('cinder.utils.execute')
+    def test_raw_block_device(self, mock_exec, mock_isblk):
+        self._write_volume(b'abcdefghij')
+
+        self._upload()
+
+        self.assertEqual(b'abcdefghij', b''.join(self.uploaded))
+        self.assertFalse(mock_exec.called)
+
+    def test_read_error(self):
+        def blocks():
+            yield b'abcd'
+            raise exception.ImageCopyFailure(reason='test')
+
+        stream = image_utils._VolumeDataStream(blocks())
+        self.addCleanup(stream.close)
+
+        self.assertEqual(b'ab', stream.read(2))
+        self.assertEqual(b'cd', stream.read(4))
+        self.assertRaises(exception.ImageCopyFailure, stream.read, 4)
+
+    def test_read_all(self):
+        stream = image_utils._VolumeDataStream(iter([b'ab', b'cd', b'e']))
+        self.addCleanup(stream.close)
+
+        self.assertEqual(b'a', stream.read(1))
+        self.assertEqual(b'bcde', stream.read())
+        self.assertEqual(b'', stream.read(1))
+
+
 class TestFetchToVhd(test.TestCase):
     @mock.patch('cinder.image.image_utils.fetch_to_volume_format')
     def test_defaults(self, mock_fetch_to):
@@ -762,7 +1033,9 @@ class TestFetchToVolumeFormat(test.TestCase):
         mock_convert.assert_called_once_with(tmp, dest, volume_format,
                                              out_subformat=out_subformat,
                                              run_as_root=True,
-                                             src_format='raw')
+                                             src_format='raw',
+                                             target_is_zero=True,
+                                             src_virtual_size=1234)
 
     @mock.patch('cinder.image.image_utils.check_available_space')
     @mock.patch('cinder.image.image_utils.convert_image')
@@ -813,7 +1086,9 @@ class TestFetchToVolumeFormat(test.TestCase):
         mock_convert.assert_called_once_with(tmp, dest, volume_format,
                                              out_subformat=out_subformat,
                                              run_as_root=run_as_root,
-                                             src_format='raw')
+                                             src_format='raw',
+                                             target_is_zero=True,
+                                             src_virtual_size=1234)
 
     @mock.patch('cinder.image.image_utils.check_available_space')
     @mock.patch('cinder.image.image_utils.convert_image')
@@ -865,7 +1140,9 @@ class TestFetchToVolumeFormat(test.TestCase):
         mock_convert.assert_called_once_with(tmp, dest, volume_format,
                                              out_subformat=out_subformat,
                                              run_as_root=run_as_root,
-                                             src_format=expect_format)
+                                             src_format=expect_format,
+                                             target_is_zero=True,
+                                             src_virtual_size=1234)
 
     @mock.patch('cinder.image.image_utils.check_available_space')
     @mock.patch('cinder.image.image_utils.convert_image')
@@ -914,7 +1191,9 @@ class TestFetchToVolumeFormat(test.TestCase):
         mock_convert.assert_called_once_with(tmp, dest, volume_format,
                                              out_subformat=out_subformat,
                                              run_as_root=run_as_root,
-                                             src_format=expect_format)
+                                             src_format=expect_format,
+                                             target_is_zero=True,
+                                             src_virtual_size=1234)
 
     @mock.patch('cinder.image.image_utils.check_available_space',
                 new=mock.Mock())
@@ -958,9 +1237,10 @@ class TestFetchToVolumeFormat(test.TestCase):
 
         self.assertIsNone(output)
         self.assertEqual(2, mock_temp.call_count)
+        # The temporary image tells qemu-img works, dummy is not probed
         mock_info.assert_has_calls([
             mock.call(tmp, force_share=False, run_as_root=True),
-            mock.call(dummy, force_share=False, run_as_root=True),
+            mock.call(tmp, force_share=False, run_as_root=True),
             mock.call(tmp, run_as_root=True)])
         mock_fetch.assert_called_once_with(ctxt, image_service, image_id,
                                            tmp, None, None)
@@ -969,7 +1249,9 @@ class TestFetchToVolumeFormat(test.TestCase):
         mock_convert.assert_called_once_with(tmp, dest, volume_format,
                                              out_subformat=out_subformat,
                                              run_as_root=True,
-                                             src_format='raw')
+                                             src_format='raw',
+                                             target_is_zero=True,
+                                             src_virtual_size=1234)
 
     @mock.patch('cinder.image.image_utils.convert_image')
     @mock.patch('cinder.image.image_utils.volume_utils.copy_volume')
@@ -1034,7 +1316,7 @@ class TestFetchToVolumeFormat(test.TestCase):
                                  mock_fetch, mock_is_xen, mock_repl_xen,
                                  mock_copy, mock_convert):
         ctxt = mock.sentinel.context
-        image_service = mock.Mock()
+        image_service = mock.Mock(temp_images=None)
         image_id = mock.sentinel.image_id
         dest = mock.sentinel.dest
         volume_format = mock.sentinel.volume_format
@@ -1345,7 +1627,9 @@ class TestFetchToVolumeFormat(test.TestCase):
         mock_convert.assert_called_once_with(tmp, dest, volume_format,
                                              out_subformat=None,
                                              run_as_root=run_as_root,
-                                             src_format='raw')
+                                             src_format='raw',
+                                             target_is_zero=True,
+                                             src_virtual_size=1234)
 
     @mock.patch('cinder.image.image_utils.fetch')
     @mock.patch('cinder.image.image_utils.qemu_img_info',
@@ -1430,6 +1714,209 @@ class TestFetchToVolumeFormat(test.TestCase):
             dest, run_as_root=run_as_root)
 
 
+@ddt.ddt
+class TestStreamRawImage(test.TestCase):
+    def setUp(self):
+        super(TestStreamRawImage, self).setUp()
+        self.flags(image_stream_raw_download=True)
+        self.ctxt = mock.sentinel.context
+        self.image_id = fake.IMAGE_ID
+        self.mock_object(image_utils, 'STREAM_BUFFER_SIZE', 1024)
+        dest = tempfile.NamedTemporaryFile()
+        self.addCleanup(dest.close)
+        self.dest = dest.name
+
+    def _get_image_service(self, data, chunk_size=100, **meta):
+        image_service = mock.Mock(temp_images=None)
+        image_service.download.return_value = [
+            data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+        image_meta = {'disk_format': 'raw',
+                      'container_format': 'bare',
+                      'size': len(data),
+                      'checksum': hashlib.md5(data).hexdigest()}
+        image_meta.update(meta)
+        image_service.show.return_value = image_meta
+        return image_service, image_meta
+
+    def _read_dest(self):
+        with open(self.dest, 'rb') as dest:
+            return dest.read()
+
+    def test_stream_raw_image(self):
+        data = os.urandom(3000)
+        image_service, image_meta = self._get_image_service(data)
+
+        image_utils.stream_raw_image(self.ctxt, image_service, self.image_id,
+                                     image_meta, self.dest, size=1)
+
+        self.assertEqual(data, self._read_dest())
+        image_service.download.assert_called_once_with(self.ctxt,
+                                                       self.image_id)
+
+    def test_stream_raw_image_does_not_truncate(self):
+        with open(self.dest, 'wb') as dest:
+            dest.write(b'x' * 200)
+        data = b'a' * 100
+        image_service, image_meta = self._get_image_service(data)
+
+        image_utils.stream_raw_image(self.ctxt, image_service, self.image_id,
+                                     image_meta, self.dest)
+
+        self.assertEqual(data + b'x' * 100, self._read_dest())
+
+    @ddt.data((b'QFI\xfb\x00\x00\x00\x03', 'qcow2'),
+              (b'# Disk DescriptorFile\n', 'vmdk'),
+              (b'\0' * 64 + b'\x7f\x10\xda\xbe', 'vdi'))
+    @ddt.unpack
+    def test_stream_raw_image_other_format(self, header, disk_format):
+        data = header + b'\0' * (2000 - len(header))
+        image_service, image_meta = self._get_image_service(data)
+
+        exc = self.assertRaises(exception.ImageUnacceptable,
+                                image_utils.stream_raw_image, self.ctxt,
+                                image_service, self.image_id, image_meta,
+                                self.dest)
+        self.assertIn(disk_format, six.text_type(exc))
+        # Nothing was written to the volume
+        self.assertEqual(b'', self._read_dest())
+
+    def test_stream_raw_image_small_image_other_format(self):
+        data = b'QFI\xfb'
+        image_service, image_meta = self._get_image_service(data)
+
+        self.assertRaises(exception.ImageUnacceptable,
+                          image_utils.stream_raw_image, self.ctxt,
+                          image_service, self.image_id, image_meta,
+                          self.dest)
+
+    def test_stream_raw_image_checksum_mismatch(self):
+        data = os.urandom(3000)
+        image_service, image_meta = self._get_image_service(
+            data, checksum='0' * 32)
+
+        self.assertRaises(exception.ImageCopyFailure,
+                          image_utils.stream_raw_image, self.ctxt,
+                          image_service, self.image_id, image_meta,
+                          self.dest)
+
+    def test_stream_raw_image_truncated_download(self):
+        data = os.urandom(3000)
+        image_service, image_meta = self._get_image_service(data)
+        image_service.download.return_value.pop()
+
+        self.assertRaises(exception.ImageCopyFailure,
+                          image_utils.stream_raw_image, self.ctxt,
+                          image_service, self.image_id, image_meta,
+                          self.dest)
+
+    def test_stream_raw_image_too_big(self):
+        image_service, image_meta = self._get_image_service(
+            b'', size=2 * units.Gi)
+
+        self.assertRaises(exception.ImageUnacceptable,
+                          image_utils.stream_raw_image, self.ctxt,
+                          image_service, self.image_id, image_meta,
+                          self.dest, size=1)
+        self.assertFalse(image_service.download.called)
+
+    @ddt.data(({'disk_format': 'raw', 'container_format': 'bare',
+                'size': 1}, True),
+              ({'disk_format': 'qcow2', 'container_format': 'bare',
+                'size': 1}, False),
+              ({'disk_format': 'raw', 'container_format': 'ovf',
+                'size': 1}, False),
+              ({'disk_format': 'raw', 'container_format': 'bare',
+                'size': None}, False))
+    @ddt.unpack
+    def test_is_streamable_raw_image(self, image_meta, expected):
+        self.assertEqual(expected,
+                         image_utils.is_streamable_raw_image(image_meta))
+
+        self.flags(image_stream_raw_download=False)
+        self.assertFalse(image_utils.is_streamable_raw_image(image_meta))
+
+    @mock.patch('cinder.image.image_utils.stream_raw_image')
+    @mock.patch('cinder.image.image_utils.fetch')
+    def test_fetch_to_volume_format_streams(self, mock_fetch, mock_stream):
+        image_service, image_meta = self._get_image_service(b'a' * 100)
+
+        image_utils.fetch_to_volume_format(self.ctxt, image_service,
+                                           self.image_id, self.dest, 'raw',
+                                           mock.sentinel.blocksize, size=1)
+
+        mock_stream.assert_called_once_with(self.ctxt, image_service,
+                                            self.image_id, image_meta,
+                                            self.dest, size=1)
+        self.assertFalse(mock_fetch.called)
+
+    @mock.patch('cinder.image.image_utils.stream_raw_image')
+    @mock.patch('cinder.image.image_utils.convert_image')
+    @mock.patch('cinder.image.image_utils.check_available_space')
+    @mock.patch('cinder.image.image_utils.qemu_img_info')
+    @mock.patch('cinder.image.image_utils.fetch')
+    def test_fetch_to_volume_format_converts(self, mock_fetch, mock_info,
+                                             mock_check_space, mock_convert,
+                                             mock_stream):
+        image_service, image_meta = self._get_image_service(b'a' * 100)
+        mock_info.return_value.backing_file = None
+        mock_info.return_value.virtual_size = 100
+
+        image_utils.fetch_to_volume_format(self.ctxt, image_service,
+                                           self.image_id, self.dest, 'qcow2',
+                                           mock.sentinel.blocksize)
+
+        self.assertFalse(mock_stream.called)
+        self.assertTrue(mock_convert.called)
+
+
+class TestFetchFromFileCache(test.TestCase):
+    def setUp(self):
+        super(TestFetchFromFileCache, self).setUp()
+        self.ctxt = mock.sentinel.context
+        self.image_service = mock.Mock()
+        self.image_meta = {'disk_format': 'qcow2',
+                           'container_format': 'bare',
+                           'checksum': 'abc123'}
+
+    @mock.patch('cinder.image.image_utils.fetch')
+    @mock.patch('cinder.image.file_cache.ImageFileCache.fetch')
+    def test_disabled(self, mock_cache_fetch, mock_fetch):
+        self.assertFalse(image_utils._fetch_from_file_cache(
+            self.ctxt, self.image_service, fake.IMAGE_ID, self.image_meta,
+            mock.sentinel.path))
+        self.assertFalse(mock_cache_fetch.called)
+
+    @mock.patch('cinder.image.image_utils.fetch')
+    @mock.patch('cinder.image.file_cache.ImageFileCache.fetch')
+    def test_enabled(self, mock_cache_fetch, mock_fetch):
+        self.flags(image_file_cache_max_size_gb=1)
+
+        result = image_utils._fetch_from_file_cache(
+            self.ctxt, self.image_service, fake.IMAGE_ID, self.image_meta,
+            mock.sentinel.path, mock.sentinel.user_id,
+            mock.sentinel.project_id)
+
+        self.assertEqual(mock_cache_fetch.return_value, result)
+        mock_cache_fetch.assert_called_once_with(
+            fake.IMAGE_ID, self.image_meta, mock.sentinel.path, mock.ANY)
+        # The cache downloads the image with fetch()
+        mock_cache_fetch.call_args[0][3](mock.sentinel.cache_path)
+        mock_fetch.assert_called_once_with(
+            self.ctxt, self.image_service, fake.IMAGE_ID,
+            mock.sentinel.cache_path, mock.sentinel.user_id,
+            mock.sentinel.project_id)
+
+    @mock.patch('cinder.image.file_cache.ImageFileCache.fetch')
+    def test_xenserver_image(self, mock_cache_fetch):
+        self.flags(image_file_cache_max_size_gb=1)
+        self.image_meta.update(disk_format='vhd', container_format='ovf')
+
+        self.assertFalse(image_utils._fetch_from_file_cache(
+            self.ctxt, self.image_service, fake.IMAGE_ID, self.image_meta,
+            mock.sentinel.path))
+        self.assertFalse(mock_cache_fetch.called)
+
+
 class TestXenserverUtils(test.TestCase):
     def test_is_xenserver_format(self):
         image_meta1 = {'disk_format': 'vhd', 'container_format': 'ovf'}
@@ -1584,6 +2071,34 @@ class TestVhdUtils(test.TestCase):
         mock_delete.assert_called_once_with(image_file)
         mock_rename.assert_called_once_with(mock_coal.return_value, image_file)
 
+    @mock.patch('os.name', new='posix')
+    @mock.patch('oslo_utils.imageutils.QemuImgInfo')
+    @mock.patch('cinder.utils.execute', return_value=('out', 'err'))
+    @mock.patch('cinder.image.image_utils.temporary_dir')
+    @mock.patch('cinder.image.image_utils.os.rename')
+    @mock.patch('cinder.image.image_utils.fileutils.delete_if_exists')
+    @mock.patch('cinder.image.image_utils.coalesce_chain')
+    @mock.patch('cinder.image.image_utils.fix_vhd_chain')
+    @mock.patch('cinder.image.image_utils.discover_vhd_chain')
+    @mock.patch('cinder.image.image_utils.extract_targz')
+    def test_replace_xenserver_temporary_image(
+            self, mock_targz, mock_discover, mock_fix, mock_coal, mock_delete,
+            mock_rename, mock_temp, mock_exec, mock_info):
+        image_file = mock.sentinel.image_file
+        self.mock_object(image_utils, 'TEMPORARY_IMAGE_INFO',
+                         {image_file: mock.sentinel.tarball_info})
+
+        image_utils.replace_xenserver_image_with_coalesced_vhd(image_file)
+
+        # The coalesced image is inspected again
+        self.assertEqual(mock_info.return_value,
+                         image_utils.qemu_img_info(image_file))
+        mock_exec.assert_called_once_with(
+            'env', 'LC_ALL=C', 'qemu-img', 'info', image_file,
+            run_as_root=True, prlimit=image_utils.QEMU_IMG_LIMITS)
+        self.assertEqual(mock_info.return_value,
+                         image_utils.TEMPORARY_IMAGE_INFO[image_file])
+
 
 class TestCreateTemporaryFile(test.TestCase):
     @mock.patch('cinder.image.image_utils.os.close')
@@ -55,3 +55,85 @@ class TestManager(test.TestCase):
 
         self.assertEqual(set(six.text_type(r) for r in result.objects),
                          set(six.text_type(e) for e in expected))
+
+
+@mock.patch('cinder.scheduler.rpcapi.SchedulerAPI')
+class TestSchedulerDependentManager(test.TestCase):
+    def _publish(self, manager_obj, capabilities):
+        manager_obj.update_service_capabilities(capabilities)
+        manager_obj._publish_service_capabilities(mock.sentinel.context)
+        update = manager_obj.scheduler_rpcapi.update_service_capabilities
+        args = update.call_args
+        update.reset_mock()
+        return args[0][3], args[1]
+
+    def test_publish_delta(self, mock_rpcapi):
+        self.flags(capabilities_full_report_interval=2)
+        service = manager.SchedulerDependentManager(host='host@lvm',
+                                                    service_name='volume')
+
+        caps, kwargs = self._publish(service, {'free_capacity_gb': 10})
+        self.assertEqual({'free_capacity_gb': 10}, caps)
+        self.assertIsNone(kwargs['base_version'])
+        version = kwargs['capabilities_version']
+
+        # The manager must not depend on the capabilities dict not being
+        # modified after it's reported.
+        caps = {'free_capacity_gb': 10}
+        self._publish(service, caps)
+        caps['free_capacity_gb'] = 5
+        caps, kwargs = self._publish(service, caps)
+        self.assertEqual({'updated': {'free_capacity_gb': 5}, 'removed': []},
+                         caps)
+        self.assertEqual({'capabilities_version': version + 2,
+                          'base_version': version + 1}, kwargs)
+
+        # After 2 deltas a full report is sent
+        caps, kwargs = self._publish(service, {'free_capacity_gb': 5})
+        self.assertEqual({'free_capacity_gb': 5}, caps)
+        self.assertEqual({'capabilities_version': version + 3,
+                          'base_version': None}, kwargs)
+
+    def test_publish_full(self, mock_rpcapi):
+        self.flags(capabilities_full_report_interval=0)
+        service = manager.SchedulerDependentManager(host='host@lvm',
+                                                    service_name='volume')
+
+        self._publish(service, {'free_capacity_gb': 10})
+        caps, kwargs = self._publish(service, {'free_capacity_gb': 5})
+        self.assertEqual({'free_capacity_gb': 5}, caps)
+        self.assertIsNone(kwargs['base_version'])
+
+    def test_publish_full_clustered(self, mock_rpcapi):
+        service = manager.SchedulerDependentManager(host='host@lvm',
+                                                    service_name='volume',
+                                                    cluster='cluster@lvm')
+
+        self._publish(service, {'free_capacity_gb': 10})
+        caps, kwargs = self._publish(service, {'free_capacity_gb': 5})
+        self.assertEqual({'free_capacity_gb': 5}, caps)
+        self.assertIsNone(kwargs['base_version'])
+
+    def test_publish_full_scheduler_too_old(self, mock_rpcapi):
+        mock_rpcapi.return_value.can_send_capabilities_delta.return_value = (
+            False)
+        service = manager.SchedulerDependentManager(host='host@lvm',
+                                                    service_name='volume')
+
+        self._publish(service, {'free_capacity_gb': 10})
+        caps, kwargs = self._publish(service, {'free_capacity_gb': 5})
+        self.assertEqual({'free_capacity_gb': 5}, caps)
+        self.assertIsNone(kwargs['base_version'])
+
+    def test_request_full_capabilities(self, mock_rpcapi):
+        service = manager.SchedulerDependentManager(host='host@lvm',
+                                                    service_name='volume')
+        self._publish(service, {'free_capacity_gb': 10})
+
+        service.request_full_capabilities(mock.sentinel.context)
+
+        update = service.scheduler_rpcapi.update_service_capabilities
+        update.assert_called_once_with(
+            mock.sentinel.context, 'volume', 'host@lvm',
+            {'free_capacity_gb': 10}, None, capabilities_version=mock.ANY,
+            base_version=None)
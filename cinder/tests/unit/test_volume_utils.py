@@ -20,6 +20,7 @@ import datetime
 import io
 import mock
 import six
+import tempfile
 
 from castellan import key_manager
 import ddt
@@ -514,6 +515,41 @@ class OdirectSupportTestCase(test.TestCase):
                                           'of=/dev/def', 'oflag=direct',
                                           run_as_root=True)
 
+    @mock.patch('cinder.utils.execute')
+    def test_check_for_odirect_support_cached(self, mock_exec):
+        self.mock_object(volume_utils, 'ODIRECT_SUPPORT', set())
+        with tempfile.NamedTemporaryFile() as dest:
+            for i in range(2):
+                output = volume_utils.check_for_odirect_support('/dev/abc',
+                                                                dest.name)
+                self.assertTrue(output)
+
+            # Probed once for the file system of dest
+            mock_exec.assert_called_once_with('dd', 'count=0', 'if=/dev/abc',
+                                              'of=%s' % dest.name,
+                                              'oflag=direct',
+                                              run_as_root=True)
+
+            # The input of the copy is probed separately
+            output = volume_utils.check_for_odirect_support(dest.name,
+                                                            '/dev/def',
+                                                            'iflag=direct')
+            self.assertTrue(output)
+            self.assertEqual(2, mock_exec.call_count)
+
+    @mock.patch('cinder.utils.execute',
+                side_effect=processutils.ProcessExecutionError)
+    def test_check_for_odirect_support_error_not_cached(self, mock_exec):
+        self.mock_object(volume_utils, 'ODIRECT_SUPPORT', set())
+        with tempfile.NamedTemporaryFile() as dest:
+            for i in range(2):
+                output = volume_utils.check_for_odirect_support('/dev/abc',
+                                                                dest.name)
+                self.assertFalse(output)
+
+        self.assertEqual(2, mock_exec.call_count)
+        self.assertEqual(set(), volume_utils.ODIRECT_SUPPORT)
+
 
 class ClearVolumeTestCase(test.TestCase):
     @mock.patch('cinder.volume.utils.copy_volume', return_value=None)
@@ -704,6 +740,31 @@ class VolumeUtilsTestCase(test.TestCase):
         self.assertEqual('1', volume_utils.null_safe_str(1))
         self.assertEqual('True', volume_utils.null_safe_str(True))
 
+    @mock.patch('sys.platform', 'linux2')
+    def test_punch_hole(self):
+        with tempfile.TemporaryFile() as handle:
+            handle.write(b'x' * 8192)
+            # Punching past the end of the file grows it.
+            if not volume_utils.punch_hole(handle, 4096, 8192):
+                self.skipTest('fallocate hole punching is not supported')
+            handle.seek(0)
+            data = handle.read()
+
+        self.assertEqual(12288, len(data))
+        self.assertEqual(b'x' * 4096, data[:4096])
+        self.assertEqual(b'\0' * 8192, data[4096:])
+
+    @mock.patch('sys.platform', 'win32')
+    def test_punch_hole_unsupported_platform(self):
+        handle = mock.Mock()
+        self.assertFalse(volume_utils.punch_hole(handle, 0, 4096))
+        handle.flush.assert_not_called()
+
+    def test_punch_hole_no_fileno(self):
+        handle = mock.Mock()
+        handle.fileno.side_effect = IOError
+        self.assertFalse(volume_utils.punch_hole(handle, 0, 4096))
+
     @mock.patch('cinder.utils.get_root_helper')
     @mock.patch('cinder.brick.local_dev.lvm.LVM.supports_thin_provisioning')
     def test_supports_thin_provisioning(self, mock_supports_thin, mock_helper):
@@ -1080,3 +1141,49 @@ class VolumeUtilsTestCase(test.TestCase):
                 self.assertEqual(max_over_subscription_ratio, mosr)
             else:
                 self.assertEqual(float(max_over_subscription_ratio), mosr)
+
+    def test_capabilities_delta(self):
+        old = {'volume_backend_name': 'lvm', 'driver_version': '1.0',
+               'pools': [{'pool_name': 'pool1', 'free_capacity_gb': 10,
+                          'multiattach': True},
+                         {'pool_name': 'pool2', 'free_capacity_gb': 20},
+                         {'pool_name': 'pool3', 'free_capacity_gb': 30}]}
+        new = {'volume_backend_name': 'lvm', 'vendor_name': 'Open Source',
+               'pools': [{'pool_name': 'pool1', 'free_capacity_gb': 5},
+                         {'pool_name': 'pool2', 'free_capacity_gb': 20},
+                         {'pool_name': 'pool4', 'free_capacity_gb': 40}]}
+
+        delta = volume_utils.get_capabilities_delta(old, new)
+
+        self.assertEqual(
+            {'updated': {'vendor_name': 'Open Source'},
+             'removed': ['driver_version'],
+             'pools': {'pool1': {'updated': {'free_capacity_gb': 5},
+                                 'removed': ['multiattach']},
+                       'pool4': {'updated': {'pool_name': 'pool4',
+                                             'free_capacity_gb': 40},
+                                 'removed': []}},
+             'removed_pools': ['pool3']},
+            delta)
+        self.assertEqual(new,
+                         volume_utils.apply_capabilities_delta(old, delta))
+
+    def test_capabilities_delta_no_pools(self):
+        old = {'volume_backend_name': 'lvm', 'free_capacity_gb': 10}
+        new = {'volume_backend_name': 'lvm', 'free_capacity_gb': 5}
+
+        delta = volume_utils.get_capabilities_delta(old, new)
+
+        self.assertEqual({'updated': {'free_capacity_gb': 5}, 'removed': []},
+                         delta)
+        self.assertEqual(new,
+                         volume_utils.apply_capabilities_delta(old, delta))
+
+    @ddt.data(({'pools': []}, {}),
+              ({'pools': [{'free_capacity_gb': 10}]},
+               {'pools': [{'free_capacity_gb': 5}]}),
+              ({'pools': []},
+               {'pools': [{'pool_name': 'pool1'}, {'pool_name': 'pool1'}]}))
+    @ddt.unpack
+    def test_capabilities_delta_not_possible(self, old, new):
+        self.assertIsNone(volume_utils.get_capabilities_delta(old, new))
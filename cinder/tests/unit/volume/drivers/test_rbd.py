@@ -183,6 +183,8 @@ class RBDTestCase(test.TestCase):
         self.cfg.rbd_store_chunk_size = 4
         self.cfg.rados_connection_retries = 3
         self.cfg.rados_connection_interval = 5
+        self.cfg.rados_connection_pool_size = 5
+        self.cfg.rbd_usage_scan_interval = 3600
 
         mock_exec = mock.Mock()
         mock_exec.return_value = ('', '')
@@ -1686,7 +1688,7 @@ class RBDTestCase(test.TestCase):
                 'vol_pool', None, None)
 
         mock_driver._disconnect_from_rados.assert_called_once_with(
-            'fake_cl', 'fake_io')
+            'fake_cl', 'fake_io', None)
 
     def test_rbd_volume_proxy_external_conn_error(self):
         mock_driver = mock.Mock(name='driver')
@@ -1773,6 +1775,92 @@ class RBDTestCase(test.TestCase):
         self.assertEqual(
             3, self.mock_rados.Rados.return_value.shutdown.call_count)
 
+    def test_rbd_volume_proxy_exit_error(self):
+        mock_driver = mock.Mock(name='driver')
+        mock_driver._connect_to_rados.return_value = ('fake_cl', 'fake_io')
+        error = Exception()
+
+        def _use_volume():
+            with driver.RBDVolumeProxy(mock_driver, self.volume_a.name):
+                raise error
+
+        self.assertRaises(Exception, _use_volume)
+        mock_driver._disconnect_from_rados.assert_called_once_with(
+            'fake_cl', 'fake_io', error)
+
+    @common_mocks
+    def test_connect_to_rados_reuses_connection(self):
+        self.cfg.rados_connect_timeout = -1
+        client = self.mock_rados.Rados.return_value
+        client.state = 'connected'
+
+        ret = self.driver._connect_to_rados()
+        self.driver._disconnect_from_rados(*ret)
+        ret2 = self.driver._connect_to_rados()
+
+        self.assertEqual(ret, ret2)
+        self.assertEqual(1, self.mock_rados.Rados.call_count)
+        client.connect.assert_called_once_with()
+        client.open_ioctx.assert_called_once_with(self.cfg.rbd_pool)
+        client.shutdown.assert_not_called()
+
+        # A new ioctx is opened on the pooled client for another pool
+        self.driver._disconnect_from_rados(*ret2)
+        ret3 = self.driver._connect_to_rados('alt_pool')
+        self.assertEqual(1, self.mock_rados.Rados.call_count)
+        client.open_ioctx.assert_called_with('alt_pool')
+        self.driver._disconnect_from_rados(*ret3)
+
+    @common_mocks
+    def test_connect_to_rados_pool_size(self):
+        self.cfg.rados_connect_timeout = -1
+        self.driver._rados_pool.max_idle = 1
+        clients = [mock.Mock(state='connected') for i in range(2)]
+        self.mock_rados.Rados.side_effect = clients
+
+        ret = self.driver._connect_to_rados()
+        ret2 = self.driver._connect_to_rados()
+        self.driver._disconnect_from_rados(*ret)
+        self.driver._disconnect_from_rados(*ret2)
+
+        clients[0].shutdown.assert_not_called()
+        clients[1].shutdown.assert_called_once_with()
+        ret2[1].close.assert_called_once_with()
+
+    @common_mocks
+    def test_connect_to_rados_pool_disabled(self):
+        self.cfg.rados_connect_timeout = -1
+        self.driver._rados_pool.max_idle = 0
+        client = self.mock_rados.Rados.return_value
+        client.state = 'connected'
+
+        ret = self.driver._connect_to_rados()
+        self.driver._disconnect_from_rados(*ret)
+
+        ret[1].close.assert_called_once_with()
+        client.shutdown.assert_called_once_with()
+
+    @common_mocks
+    def test_connect_to_rados_discards_broken_connection(self):
+        self.cfg.rados_connect_timeout = -1
+        clients = [mock.Mock(state='connected') for i in range(3)]
+        self.mock_rados.Rados.side_effect = clients
+
+        # Released after a librados error
+        ret = self.driver._connect_to_rados()
+        self.driver._disconnect_from_rados(ret[0], ret[1],
+                                           self.mock_rados.Error())
+        clients[0].shutdown.assert_called_once_with()
+
+        # Disconnected while idle
+        ret = self.driver._connect_to_rados()
+        self.driver._disconnect_from_rados(*ret)
+        clients[1].state = 'shutdown'
+        ret = self.driver._connect_to_rados()
+
+        self.assertEqual(clients[2], ret[0])
+        clients[1].shutdown.assert_called_once_with()
+
     @common_mocks
     def test_failover_host_no_replication(self):
         self.driver._is_replication_enabled = False
@@ -1975,6 +2063,7 @@ class RBDTestCase(test.TestCase):
                 size_mock = mock.Mock(return_value=size * units.Gi)
             return mock.Mock(return_value=mock.Mock(size=size_mock))
 
+        self.cfg.rbd_usage_scan_interval = 0
         volumes = ['volume-1', 'non-existent', 'non-cinder-volume']
 
         client = client_mock.return_value.__enter__.return_value
@@ -2003,6 +2092,54 @@ class RBDTestCase(test.TestCase):
 
         self.assertEqual(3.00, total_provision)
 
+    @mock.patch('eventlet.spawn_n')
+    @mock.patch.object(driver.RBDDriver, '_scan_usage_info')
+    def test__get_usage_info_background_scan(self, mock_scan, mock_spawn):
+        mock_scan.return_value = {'volume-1': units.Gi}
+
+        # Nothing is reported until the first scan has finished
+        self.assertIsNone(self.driver._get_usage_info())
+        mock_spawn.assert_called_once_with(self.driver._refresh_usage_info)
+        self.assertIsNone(self.driver._get_usage_info())
+        self.assertEqual(1, mock_spawn.call_count)
+
+        # Changes made during the scan are applied on top of its results
+        self.driver._usage.set('volume-2', 2 * units.Gi)
+        self.driver._refresh_usage_info()
+        self.assertEqual(3, self.driver._get_usage_info())
+        self.assertEqual(1, mock_spawn.call_count)
+
+        # Until the next scan is due, driver operations update the total
+        self.driver._usage.remove('volume-1')
+        self.driver._usage.set('volume-2', 4 * units.Gi)
+        self.assertEqual(4, self.driver._get_usage_info())
+        self.assertEqual(1, mock_scan.call_count)
+
+        with mock.patch('time.time',
+                        return_value=self.driver._usage.last_scan + 3600):
+            self.driver._get_usage_info()
+        self.assertEqual(2, mock_spawn.call_count)
+
+    @mock.patch.object(driver.RBDDriver, '_scan_usage_info',
+                       side_effect=Exception)
+    def test__get_usage_info_scan_error(self, mock_scan):
+        self.cfg.rbd_usage_scan_interval = 0
+
+        self.assertIsNone(self.driver._get_usage_info())
+        self.assertFalse(self.driver._usage.scanning)
+
+    def test_usage_tracker_rename(self):
+        tracker = driver.RBDUsageTracker()
+        tracker.start_scan()
+        tracker.set('volume-1', 1)
+        tracker.rename('volume-1', 'volume-1.deleted')
+        tracker.finish_scan({'volume-1': 1, 'volume-2': 2}, 0)
+
+        self.assertEqual(3, tracker.total)
+        tracker.rename('volume-2', 'volume-3')
+        tracker.remove('volume-1.deleted')
+        self.assertEqual(2, tracker.total)
+
     def test_migrate_volume_bad_volume_status(self):
         self.volume_a.status = 'in-use'
         ret = self.driver.migrate_volume(context, self.volume_a, None)
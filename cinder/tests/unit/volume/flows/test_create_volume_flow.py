@@ -1287,6 +1287,102 @@ class CreateVolumeFlowManagerImageCacheTestCase(test.TestCase):
             image_meta=image_meta
         )
 
+    @mock.patch('cinder.image.image_utils.qemu_img_info')
+    @mock.patch('cinder.image.image_utils.check_available_space')
+    def test_create_from_image_stream_raw(
+            self, mock_check_space, mock_qemu_info,
+            mock_get_internal_context, mock_create_from_img_dl,
+            mock_create_from_src, mock_handle_bootable, mock_fetch_img):
+        self.flags(image_stream_raw_download=True)
+        mock_get_internal_context.return_value = None
+        self.mock_driver.clone_image.return_value = (None, False)
+        self.mock_driver.STREAMS_RAW_IMAGES = True
+        volume = fake_volume.fake_volume_obj(self.ctxt,
+                                             host='host@backend#pool')
+
+        image_location = 'someImageLocationStr'
+        image_id = fakes.IMAGE_ID
+        image_meta = {'id': image_id,
+                      'disk_format': 'raw',
+                      'container_format': 'bare',
+                      'size': 1073741824}
+
+        manager = create_volume_manager.CreateVolumeFromSpecTask(
+            self.mock_volume_manager,
+            self.mock_db,
+            self.mock_driver,
+            image_volume_cache=self.mock_cache
+        )
+
+        manager._create_from_image(self.ctxt,
+                                   volume,
+                                   image_location,
+                                   image_id,
+                                   image_meta,
+                                   self.mock_image_service)
+
+        # The image is not downloaded to image_conversion_dir first
+        self.assertFalse(mock_check_space.called)
+        self.assertFalse(mock_fetch_img.called)
+        self.assertFalse(mock_qemu_info.called)
+        mock_create_from_img_dl.assert_called_once_with(
+            self.ctxt,
+            volume,
+            image_location,
+            image_meta,
+            self.mock_image_service
+        )
+
+    @mock.patch('cinder.image.image_utils.qemu_img_info')
+    @mock.patch('cinder.image.image_utils.check_available_space')
+    def test_create_from_image_stream_raw_not_supported(
+            self, mock_check_space, mock_qemu_info,
+            mock_get_internal_context, mock_create_from_img_dl,
+            mock_create_from_src, mock_handle_bootable, mock_fetch_img):
+        self.flags(image_stream_raw_download=True)
+        mock_get_internal_context.return_value = None
+        self.mock_driver.clone_image.return_value = (None, False)
+        self.mock_driver.STREAMS_RAW_IMAGES = False
+        volume = fake_volume.fake_volume_obj(self.ctxt,
+                                             host='host@backend#pool')
+        image_info = imageutils.QemuImgInfo()
+        image_info.virtual_size = '1073741824'
+        mock_qemu_info.return_value = image_info
+
+        image_location = 'someImageLocationStr'
+        image_id = fakes.IMAGE_ID
+        image_meta = {'id': image_id,
+                      'disk_format': 'raw',
+                      'container_format': 'bare',
+                      'size': 1073741824}
+
+        manager = create_volume_manager.CreateVolumeFromSpecTask(
+            self.mock_volume_manager,
+            self.mock_db,
+            self.mock_driver,
+            image_volume_cache=self.mock_cache
+        )
+
+        manager._create_from_image(self.ctxt,
+                                   volume,
+                                   image_location,
+                                   image_id,
+                                   image_meta,
+                                   self.mock_image_service)
+
+        # The driver downloads the image to a file before writing it to
+        # the volume, so image_conversion_dir must have room for it.
+        mock_check_space.assert_called_once_with(
+            mock.ANY, image_meta['size'], image_id)
+        self.assertTrue(mock_fetch_img.called)
+        mock_create_from_img_dl.assert_called_once_with(
+            self.ctxt,
+            volume,
+            image_location,
+            image_meta,
+            self.mock_image_service
+        )
+
     @mock.patch('cinder.image.image_utils.qemu_img_info')
     @mock.patch('cinder.image.image_utils.check_available_space')
     def test_create_from_image_cannot_use_cache(
@@ -149,6 +149,24 @@ class DriverTestCase(test.TestCase):
                                               mock.sentinel.secondary_id,
                                               [])
 
+    def test_set_image_conversion_tuning(self):
+        self.override_config('image_conversion_coroutines', 8)
+        self.override_config('image_conversion_target_is_zero', True)
+        config = mock.Mock()
+        config.safe_get.side_effect = {
+            'image_conversion_coroutines': 0,
+            'image_conversion_out_of_order_writes': None,
+            'image_conversion_target_is_zero': False}.get
+        my_driver = self._get_driver(False, None)(configuration=config)
+        self.addCleanup(image_utils.ConversionTuning.set_default, None)
+
+        my_driver.set_image_conversion_tuning()
+
+        tuning = image_utils.ConversionTuning.get_default()
+        self.assertEqual(0, tuning.coroutines)
+        self.assertFalse(tuning.out_of_order_writes)
+        self.assertFalse(tuning.target_is_zero)
+
 
 class BaseDriverTestCase(test.TestCase):
     """Base Test class for Drivers."""
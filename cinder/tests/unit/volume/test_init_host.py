@@ -15,10 +15,12 @@
 #    under the License.
 """Tests for volume init host method cases."""
 
+import eventlet
 import mock
 from oslo_config import cfg
 
 from cinder import context
+from cinder import exception
 from cinder import objects
 from cinder.tests.unit import utils as tests_utils
 from cinder.tests.unit import volume as base
@@ -269,6 +271,81 @@ class VolumeInitHostTestCase(base.BaseVolumeTestCase):
         snap_get_all_mock.assert_called_once_with(
             mock.ANY, filters={'cluster_name': cluster})
 
+    @mock.patch('cinder.manager.CleanableManager.init_host')
+    def test_init_host_ensure_export_concurrency(self, init_host_mock):
+        vols = [tests_utils.create_volume(self.context, status='in-use',
+                                          host=CONF.host)
+                for i in range(4)]
+        tests_utils.create_volume(self.context, host=CONF.host)
+        self.volume.driver.ENSURE_EXPORT_CONCURRENCY = 2
+        running = []
+        max_running = []
+
+        def _ensure_export(ctxt, volume):
+            running.append(volume.id)
+            max_running.append(len(running))
+            eventlet.sleep(0)
+            running.remove(volume.id)
+            if volume.id == vols[1].id:
+                raise exception.ExportFailure(reason='fake')
+
+        with mock.patch.object(self.volume.driver, 'ensure_export',
+                               side_effect=_ensure_export) as mock_export:
+            self.volume.init_host(service_id=self.service_id)
+
+        self.assertEqual(4, mock_export.call_count)
+        self.assertEqual(2, max(max_running))
+        self.assertTrue(self.volume.driver.initialized)
+        for vol in vols:
+            vol.refresh()
+        self.assertEqual(['in-use', 'error', 'in-use', 'in-use'],
+                         [vol.status for vol in vols])
+
+    @mock.patch('cinder.manager.CleanableManager.init_host')
+    def test_init_host_ensure_exports_batch(self, init_host_mock):
+        vols = [tests_utils.create_volume(self.context, status='in-use',
+                                          host=CONF.host)
+                for i in range(2)]
+
+        with mock.patch.object(self.volume.driver, 'ensure_export') as \
+                mock_export, \
+                mock.patch.object(self.volume.driver, 'ensure_exports',
+                                  return_value={vols[0].id: Exception()}) \
+                as mock_exports:
+            self.volume.init_host(service_id=self.service_id)
+
+        mock_exports.assert_called_once_with(mock.ANY, mock.ANY)
+        exported = mock_exports.call_args[0][1]
+        self.assertEqual(sorted(vol.id for vol in vols),
+                         sorted(vol.id for vol in exported))
+        mock_export.assert_not_called()
+        for vol in vols:
+            vol.refresh()
+        self.assertEqual(['error', 'in-use'], [vol.status for vol in vols])
+
+    @mock.patch('cinder.manager.CleanableManager.init_host')
+    def test_init_host_ensure_exports_batch_failure(self, init_host_mock):
+        vols = [tests_utils.create_volume(self.context, status='in-use',
+                                          host=CONF.host)
+                for i in range(2)]
+
+        def _ensure_export(ctxt, volume):
+            if volume.id == vols[0].id:
+                raise exception.ExportFailure(reason='fake')
+
+        with mock.patch.object(self.volume.driver, 'ensure_export',
+                               side_effect=_ensure_export) as mock_export, \
+                mock.patch.object(self.volume.driver, 'ensure_exports',
+                                  side_effect=exception.ExportFailure(
+                                      reason='fake')):
+            self.volume.init_host(service_id=self.service_id)
+
+        self.assertEqual(2, mock_export.call_count)
+        self.assertTrue(self.volume.driver.initialized)
+        for vol in vols:
+            vol.refresh()
+        self.assertEqual(['error', 'in-use'], [vol.status for vol in vols])
+
     @mock.patch('cinder.keymgr.migration.migrate_fixed_key')
     @mock.patch('cinder.volume.manager.VolumeManager._get_my_volumes')
     @mock.patch('cinder.manager.ThreadPoolManager._add_to_threadpool')
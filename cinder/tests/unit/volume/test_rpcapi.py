@@ -575,6 +575,14 @@ class VolumeRPCAPITestCase(test.RPCAPITestCase):
         can_send_version.assert_has_calls([mock.call('3.10')])
 
     @mock.patch('oslo_messaging.RPCClient.can_send_version', mock.Mock())
+    def test_request_full_capabilities(self):
+        self._test_rpc_api('request_full_capabilities',
+                           rpc_method='cast',
+                           server='fake_host@backend',
+                           host='fake_host@backend',
+                           version='3.16',
+                           expected_kwargs_diff={'host': None})
+
     def test_set_log_levels(self):
         service = objects.Service(self.context, host='host1')
         self._test_rpc_api('set_log_levels',
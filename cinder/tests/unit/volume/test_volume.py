@@ -567,6 +567,49 @@ class VolumeTestCase(base.BaseVolumeTestCase):
                                    'description')
         self.assertEqual('default-az', volume['availability_zone'])
 
+    @mock.patch('cinder.quota.QUOTAS.rollback', new=mock.MagicMock())
+    @mock.patch('cinder.quota.QUOTAS.commit', new=mock.MagicMock())
+    @mock.patch('cinder.quota.QUOTAS.reserve', return_value=["RESERVATION"])
+    @mock.patch('cinder.scheduler.rpcapi.SchedulerAPI.create_volume')
+    @mock.patch('cinder.scheduler.rpcapi.SchedulerAPI.create_volumes')
+    def test_create_volumes(self, mock_create_volumes, mock_create_volume,
+                            _mock_reserve):
+        """Test the volumes of a batch are scheduled in one request."""
+        volume_api = cinder.volume.api.API()
+
+        volumes = volume_api.create_volumes(self.context, 2, 1, 'name',
+                                            'description',
+                                            scheduler_hints={'a': 'b'})
+
+        self.assertEqual(2, len(volumes))
+        mock_create_volume.assert_not_called()
+        mock_create_volumes.assert_called_once_with(
+            self.context, mock.ANY, mock.ANY,
+            [{'scheduler_hints': {'a': 'b'}}] * 2)
+        sent_volumes, request_specs = mock_create_volumes.call_args[0][1:3]
+        self.assertEqual([v.id for v in volumes], [v.id for v in sent_volumes])
+        self.assertEqual([v.id for v in volumes],
+                         [spec['volume_id'] for spec in request_specs])
+
+    @mock.patch('cinder.quota.QUOTAS.rollback', new=mock.MagicMock())
+    @mock.patch('cinder.quota.QUOTAS.commit', new=mock.MagicMock())
+    @mock.patch('cinder.quota.QUOTAS.reserve',
+                side_effect=[["RESERVATION"], exception.OverQuota(
+                    overs=['volumes'], quotas={'volumes': 1},
+                    usages={'volumes': {'reserved': 0, 'in_use': 1}})])
+    @mock.patch('cinder.scheduler.rpcapi.SchedulerAPI.create_volumes')
+    def test_create_volumes_partial(self, mock_create_volumes,
+                                    _mock_reserve):
+        """Test volumes created before a failure are still scheduled."""
+        volume_api = cinder.volume.api.API()
+
+        self.assertRaises(exception.VolumeLimitExceeded,
+                          volume_api.create_volumes,
+                          self.context, 2, 1, 'name', 'description')
+
+        mock_create_volumes.assert_called_once_with(
+            self.context, mock.ANY, mock.ANY, [{}])
+
     @mock.patch('cinder.quota.QUOTAS.rollback', new=mock.MagicMock())
     @mock.patch('cinder.quota.QUOTAS.commit', new=mock.MagicMock())
     @mock.patch('cinder.quota.QUOTAS.reserve', return_value=["RESERVATION"])
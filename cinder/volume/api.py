@@ -204,7 +204,7 @@ class API(base.Base):
                source_replica=None, consistencygroup=None,
                cgsnapshot=None, multiattach=False, source_cg=None,
                group=None, group_snapshot=None, source_group=None,
-               backup=None):
+               backup=None, batch=None):
 
         if image_id:
             context.authorize(vol_policy.CREATE_FROM_IMAGE_POLICY)
@@ -328,7 +328,8 @@ class API(base.Base):
                                                  availability_zones,
                                                  create_what,
                                                  sched_rpcapi,
-                                                 volume_rpcapi)
+                                                 volume_rpcapi,
+                                                 batch)
         except Exception:
             msg = _('Failed to create api volume flow.')
             LOG.exception(msg)
@@ -360,6 +361,28 @@ class API(base.Base):
                     self.list_availability_zones(enable_cache=True,
                                                  refresh_cache=True)
 
+    def create_volumes(self, context, count, size, name, description,
+                       **kwargs):
+        """Create count identical volumes scheduling them as a batch.
+
+        The volumes are created like in create, but instead of sending each
+        one to the scheduler they are all sent in a single request so they
+        are placed in one pass.
+        """
+        batch = []
+        volumes = []
+        try:
+            for __ in range(count):
+                volumes.append(self.create(context, size, name, description,
+                                           batch=batch, **kwargs))
+        finally:
+            # Volumes already created must be scheduled even if creating the
+            # rest failed, otherwise they would stay in creating status.
+            if batch:
+                self.scheduler_rpcapi.create_volumes(
+                    context, *[list(items) for items in zip(*batch)])
+        return volumes
+
     def revert_to_snapshot(self, context, volume, snapshot):
         """revert a volume to a snapshot"""
         context.authorize(vol_action_policy.REVERT_POLICY,
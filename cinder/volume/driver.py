@@ -130,6 +130,25 @@ volume_opts = [
                default=0,
                help='The upper limit of bandwidth of volume copy. '
                     '0 => unlimited'),
+    cfg.IntOpt('image_conversion_coroutines',
+               default=0,
+               min=0,
+               max=16,
+               help='Number of coroutines qemu-img uses to convert images '
+                    'to volumes of this backend. 0 leaves the qemu-img '
+                    'default. Requires qemu-img 2.9 or later.'),
+    cfg.BoolOpt('image_conversion_out_of_order_writes',
+                default=False,
+                help='Let qemu-img write the data of converted images out '
+                     'of order, which makes parallel conversions faster. '
+                     'Requires qemu-img 2.9 or later.'),
+    cfg.BoolOpt('image_conversion_target_is_zero',
+                default=False,
+                help='New volumes of this backend read as zeroes, so '
+                     'qemu-img does not need to write the zeroes of the '
+                     'images it converts to them. Only enable this for '
+                     'backends that guarantee it, such as thin '
+                     'provisioned ones. Requires qemu-img 5.0 or later.'),
     cfg.StrOpt('iscsi_write_cache',
                default='on',
                choices=['on', 'off'],
@@ -357,6 +376,17 @@ class BaseVD(object):
     REPLICATION_FEATURE_CHECKERS = {'v2.1': 'failover_host',
                                     'a/a': 'failover_completed'}
 
+    # Number of ensure_export calls the manager may run concurrently when
+    # re-exporting volumes on startup if the driver doesn't implement
+    # ensure_exports.  Drivers whose ensure_export is safe to run in parallel
+    # greenthreads can raise it.
+    ENSURE_EXPORT_CONCURRENCY = 1
+
+    # Whether copy_image_to_volume writes raw images straight to the volume
+    # with fetch_to_raw, so the manager doesn't need room for them in
+    # image_conversion_dir when image_stream_raw_download is enabled.
+    STREAMS_RAW_IMAGES = False
+
     def __init__(self, execute=utils.execute, *args, **kwargs):
         # NOTE(vish): db is set by Manager
         self.db = kwargs.get('db')
@@ -525,6 +555,19 @@ class BaseVD(object):
                             '%(err)s', {'err': err})
         throttling.Throttle.set_default(self._throttle)
 
+    def set_image_conversion_tuning(self):
+        def _get(name):
+            # Backends may explicitly disable what the defaults enable.
+            value = (self.configuration.safe_get(name)
+                     if self.configuration else None)
+            return getattr(CONF, name) if value is None else value
+
+        tuning = image_utils.ConversionTuning(
+            coroutines=_get('image_conversion_coroutines'),
+            out_of_order_writes=_get('image_conversion_out_of_order_writes'),
+            target_is_zero=_get('image_conversion_target_is_zero'))
+        image_utils.ConversionTuning.set_default(tuning)
+
     def get_version(self):
         """Get the current version of this driver."""
         return self.VERSION
@@ -1375,6 +1418,20 @@ class BaseVD(object):
         """Synchronously recreates an export for a volume."""
         return
 
+    def ensure_exports(self, context, volumes):
+        """Synchronously recreates the exports of a list of volumes.
+
+        Drivers that can re-export many volumes at once should implement this
+        method, otherwise the manager calls ensure_export for each volume.
+        Drivers must log the volumes they fail to export.
+
+        :param context: the context of the caller
+        :param volumes: a list of volume objects
+        :returns: dictionary with the exceptions raised for the volumes that
+                  could not be exported, keyed by volume id
+        """
+        raise NotImplementedError()
+
     @abc.abstractmethod
     def create_export(self, context, volume, connector):
         """Exports the volume.
@@ -93,6 +93,8 @@ class LVMVolumeDriver(driver.VolumeDriver):
     # ThirdPartySystems wiki page
     CI_WIKI_NAME = "Cinder_Jenkins"
 
+    STREAMS_RAW_IMAGES = True
+
     def __init__(self, vg_obj=None, *args, **kwargs):
         # Parent sets db, host, _execute and base config
         super(LVMVolumeDriver, self).__init__(*args, **kwargs)
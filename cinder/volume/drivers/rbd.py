@@ -15,12 +15,15 @@
 
 from __future__ import absolute_import
 import binascii
+import collections
 import json
 import math
 import os
 import tempfile
+import time
 
 from castellan import key_manager
+import eventlet
 from eventlet import tpool
 from os_brick import encryptors
 from os_brick.initiator import linuxrbd
@@ -93,6 +96,10 @@ RBD_OPTS = [
     cfg.IntOpt('rados_connection_interval', default=5,
                help='Interval value (in seconds) between connection '
                     'retries to ceph cluster.'),
+    cfg.IntOpt('rados_connection_pool_size', default=5, min=0,
+               help='Maximum number of idle connections to each ceph cluster '
+                    'kept open for reuse by the driver. Set to 0 to open a '
+                    'new connection for every operation.'),
     cfg.IntOpt('replication_connect_timeout', default=5,
                help='Timeout value (in seconds) used when connecting to '
                     'ceph cluster to do a demotion/promotion of volumes. '
@@ -103,6 +110,13 @@ RBD_OPTS = [
                      'dynamic value -used + current free- and to False to '
                      'report a static value -quota max bytes if defined and '
                      'global size of cluster if not-.'),
+    cfg.IntOpt('rbd_usage_scan_interval', default=3600, min=0,
+               help='Interval, in seconds, between background scans of all '
+                    'the images in the pool to reconcile the provisioned '
+                    'capacity, which is otherwise kept up to date by the '
+                    'operations of the driver itself. Set to 0 to scan the '
+                    'pool on every stats refresh. Not used when '
+                    'rbd_exclusive_cinder_pool is set.'),
     cfg.BoolOpt('rbd_exclusive_cinder_pool', default=False,
                 help="Set to True if the pool is used exclusively by Cinder. "
                      "On exclusive use driver won't query images' provisioned "
@@ -118,6 +132,74 @@ CONF.register_opts(RBD_OPTS, group=configuration.SHARED_CONF_GROUP)
 EXTRA_SPECS_REPL_ENABLED = "replication_enabled"
 
 
+class RADOSConnectionPool(object):
+    """Pool of long lived librados connections.
+
+    Connections are keyed by cluster name, conf file, user and timeout, and
+    each one keeps the ioctxs it has opened so they can be reused too. A
+    connection is used by a single caller at a time, and at most max_idle of
+    them are kept open for each key once released.
+    """
+
+    def __init__(self, max_idle):
+        self.max_idle = max_idle
+        self._idle = collections.defaultdict(list)
+        self._in_use = {}
+
+    @staticmethod
+    def _is_healthy(client):
+        return client.state == 'connected'
+
+    def acquire(self, key, connect):
+        """Returns a (client, ioctxs) tuple for key.
+
+        Idle connections that are no longer connected are shut down, and
+        connect is called to create a new client if none is left.
+        """
+        idle = self._idle.get(key)
+        while idle:
+            client, ioctxs = idle.pop()
+            if self._is_healthy(client):
+                break
+            self._close(client, ioctxs)
+        else:
+            client, ioctxs = connect(), {}
+        if self.max_idle:
+            self._in_use[id(client)] = (key, client, ioctxs)
+        return client, ioctxs
+
+    def release(self, client, discard=False):
+        """Returns a client to the pool.
+
+        :returns: False if the client doesn't come from the pool
+        """
+        entry = self._in_use.pop(id(client), None)
+        if entry is None:
+            return False
+        key, client, ioctxs = entry
+        idle = self._idle[key]
+        if discard or len(idle) >= self.max_idle or not self._is_healthy(
+                client):
+            self._close(client, ioctxs)
+        else:
+            idle.append((client, ioctxs))
+        return True
+
+    def close_all(self):
+        """Shuts down all the idle connections."""
+        idle, self._idle = self._idle, collections.defaultdict(list)
+        for connections in idle.values():
+            for client, ioctxs in connections:
+                self._close(client, ioctxs)
+
+    @staticmethod
+    def _close(client, ioctxs):
+        # closing an ioctx cannot raise an exception
+        for ioctx in ioctxs.values():
+            ioctx.close()
+        client.shutdown()
+
+
 class RBDVolumeProxy(object):
     """Context manager for dealing with an existing rbd volume.
 
@@ -163,7 +245,8 @@ class RBDVolumeProxy(object):
             self.volume.close()
         finally:
             if self._close_conn:
-                self.driver._disconnect_from_rados(self.client, self.ioctx)
+                self.driver._disconnect_from_rados(self.client, self.ioctx,
+                                                   value)
 
     def __getattr__(self, attrib):
         return getattr(self.volume, attrib)
@@ -179,7 +262,7 @@ class RADOSClient(object):
         return self
 
     def __exit__(self, type_, value, traceback):
-        self.driver._disconnect_from_rados(self.cluster, self.ioctx)
+        self.driver._disconnect_from_rados(self.cluster, self.ioctx, value)
 
     @property
     def features(self):
@@ -189,6 +272,79 @@ class RADOSClient(object):
         return int(features)
 
 
+class RBDUsageTracker(object):
+    """Keeps the provisioned size of the images in a pool.
+
+    Sizes come from a full scan of the pool and are kept up to date by the
+    driver operations that create, resize, rename or remove images until the
+    next scan. Changes made while a scan is running are replayed on top of
+    its results.
+    """
+
+    def __init__(self):
+        self._sizes = None
+        self._total = 0
+        self._changes = None
+        self.last_scan = None
+
+    @property
+    def scanning(self):
+        return self._changes is not None
+
+    @property
+    def total(self):
+        """Provisioned bytes, or None until the first scan has finished."""
+        return None if self._sizes is None else self._total
+
+    def _update(self, name, size):
+        if self._changes is not None:
+            self._changes[name] = size
+        if self._sizes is None:
+            return
+        self._total -= self._sizes.pop(name, 0)
+        if size is not None:
+            self._sizes[name] = size
+            self._total += size
+
+    def set(self, name, size):
+        self._update(name, size)
+
+    def remove(self, name):
+        self._update(name, None)
+
+    def rename(self, old_name, new_name):
+        size = None
+        if self._sizes is not None:
+            size = self._sizes.get(old_name)
+        elif self._changes is not None:
+            size = self._changes.get(old_name)
+        self._update(old_name, None)
+        if size is not None:
+            self._update(new_name, size)
+
+    def start_scan(self):
+        if self._changes is None:
+            self._changes = {}
+
+    def finish_scan(self, sizes, scan_time):
+        """Replaces the tracked sizes with the results of a scan.
+
+        :param sizes: dictionary of image sizes keyed by name, or None if the
+                      scan failed
+        """
+        changes, self._changes = self._changes, None
+        if sizes is None:
+            return
+        for name, size in (changes or {}).items():
+            if size is None:
+                sizes.pop(name, None)
+            else:
+                sizes[name] = size
+        self._sizes = sizes
+        self._total = sum(six.itervalues(sizes))
+        self.last_scan = scan_time
+
+
 @interface.volumedriver
 class RBDDriver(driver.CloneableImageVD, driver.MigrateVD,
                 driver.ManageableVD, driver.ManageableSnapshotsVD,
@@ -225,6 +381,9 @@ class RBDDriver(driver.CloneableImageVD, driver.MigrateVD,
         self._is_replication_enabled = False
         self._replication_targets = []
         self._target_names = []
+        self._rados_pool = RADOSConnectionPool(
+            self.configuration.rados_connection_pool_size)
+        self._usage = RBDUsageTracker()
 
     def _get_target_config(self, target_id):
         """Get a replication target from known replication targets."""
@@ -327,34 +486,65 @@ class RBDDriver(driver.CloneableImageVD, driver.MigrateVD,
             if timeout is None:
                 timeout = self.configuration.rados_connect_timeout
 
-            LOG.debug("connecting to %(user)s@%(name)s (conf=%(conf)s, "
-                      "timeout=%(timeout)s).",
-                      {'user': user, 'name': name, 'conf': conf,
-                       'timeout': timeout})
+            def _new_client():
+                LOG.debug("connecting to %(user)s@%(name)s (conf=%(conf)s, "
+                          "timeout=%(timeout)s).",
+                          {'user': user, 'name': name, 'conf': conf,
+                           'timeout': timeout})
 
-            client = self.rados.Rados(rados_id=user,
-                                      clustername=name,
-                                      conffile=conf)
+                client = self.rados.Rados(rados_id=user,
+                                          clustername=name,
+                                          conffile=conf)
+                try:
+                    if timeout >= 0:
+                        str_timeout = six.text_type(timeout)
+                        client.conf_set('rados_osd_op_timeout', str_timeout)
+                        client.conf_set('rados_mon_op_timeout', str_timeout)
+                        client.conf_set('client_mount_timeout', str_timeout)
+
+                    client.connect()
+                    return client
+                except self.rados.Error:
+                    msg = _("Error connecting to ceph cluster.")
+                    LOG.exception(msg)
+                    client.shutdown()
+                    raise exception.VolumeBackendAPIException(data=msg)
 
+            client, ioctxs = self._rados_pool.acquire(
+                (name, conf, user, timeout), _new_client)
             try:
-                if timeout >= 0:
-                    timeout = six.text_type(timeout)
-                    client.conf_set('rados_osd_op_timeout', timeout)
-                    client.conf_set('rados_mon_op_timeout', timeout)
-                    client.conf_set('client_mount_timeout', timeout)
-
-                client.connect()
-                ioctx = client.open_ioctx(pool)
-                return client, ioctx
+                if pool not in ioctxs:
+                    ioctxs[pool] = client.open_ioctx(pool)
+                return client, ioctxs[pool]
             except self.rados.Error:
                 msg = _("Error connecting to ceph cluster.")
                 LOG.exception(msg)
-                client.shutdown()
+                if not self._rados_pool.release(client, discard=True):
+                    client.shutdown()
                 raise exception.VolumeBackendAPIException(data=msg)
 
         return _do_conn(pool, remote, timeout)
 
-    def _disconnect_from_rados(self, client, ioctx):
+    def _is_rados_connection_error(self, error):
+        connection_errors = tuple(
+            getattr(module, name) for module, name in (
+                (self.rados, 'Error'),
+                (self.rbd, 'Timeout'),
+                (self.rbd, 'ConnectionShutdown'))
+            if isinstance(getattr(module, name, None), type))
+        return isinstance(error, connection_errors)
+
+    def _disconnect_from_rados(self, client, ioctx, error=None):
+        """Releases a connection returned by _connect_to_rados.
+
+        Pooled connections are kept open for reuse unless error, the
+        exception raised while the connection was in use, is a librados or
+        connection error.
+        """
+        discard = (error is not None and
+                   self._is_rados_connection_error(error))
+        if self._rados_pool.release(client, discard):
+            return
         # closing an ioctx cannot raise an exception
         ioctx.close()
         client.shutdown()
@@ -390,6 +580,32 @@ class RBDDriver(driver.CloneableImageVD, driver.MigrateVD,
             ports.append(port)
         return hosts, ports
 
+    def _scan_usage_info(self):
+        """Returns the provisioned size of every image in the pool."""
+        sizes = {}
+        with RADOSClient(self) as client:
+            for t in self.RBDProxy().list(client.ioctx):
+                with RBDVolumeProxy(self, t, read_only=True,
+                                    client=client.cluster,
+                                    ioctx=client.ioctx) as v:
+                    try:
+                        sizes[t] = v.size()
+                    except self.rbd.ImageNotFound:
+                        LOG.debug("Image %s is not found.", t)
+        return sizes
+
+    def _refresh_usage_info(self):
+        scan_time = time.time()
+        self._usage.start_scan()
+        sizes = None
+        try:
+            sizes = self._scan_usage_info()
+        except Exception:
+            LOG.exception('Error scanning the provisioned capacity of pool '
+                          '%s.', self.configuration.rbd_pool)
+        finally:
+            self._usage.finish_scan(sizes, scan_time)
+
     def _get_usage_info(self):
         """Calculate provisioned volume space in GiB.
 
@@ -399,22 +615,26 @@ class RBDDriver(driver.CloneableImageVD, driver.MigrateVD,
         We must include all volumes, not only Cinder created volumes, because
         Cinder created volumes are reported by the Cinder core code as
         allocated_capacity_gb.
-        """
-        total_provisioned = 0
-        with RADOSClient(self) as client:
-            for t in self.RBDProxy().list(client.ioctx):
-                with RBDVolumeProxy(self, t, read_only=True,
-                                    client=client.cluster,
-                                    ioctx=client.ioctx) as v:
-                    try:
-                        size = v.size()
-                    except self.rbd.ImageNotFound:
-                        LOG.debug("Image %s is not found.", t)
-                    else:
-                        total_provisioned += size
 
-        total_provisioned = math.ceil(float(total_provisioned) / units.Gi)
-        return total_provisioned
+        Opening every image in the pool is slow on large pools, so this is only
+        done every rbd_usage_scan_interval seconds in a greenthread, and the
+        driver keeps the sizes of the images it changes up to date in between.
+        Returns None until the first scan has finished.
+        """
+        interval = self.configuration.rbd_usage_scan_interval
+        if not interval:
+            self._refresh_usage_info()
+        elif not self._usage.scanning and (
+                self._usage.last_scan is None or
+                time.time() - self._usage.last_scan >= interval):
+            # Flag the scan as started right away so it isn't spawned twice.
+            self._usage.start_scan()
+            eventlet.spawn_n(self._refresh_usage_info)
+
+        total_provisioned = self._usage.total
+        if total_provisioned is None:
+            return None
+        return math.ceil(float(total_provisioned) / units.Gi)
 
     def _get_pool_stats(self):
         """Gets pool free and total capacity in GiB.
@@ -510,9 +730,11 @@ class RBDDriver(driver.CloneableImageVD, driver.MigrateVD,
 
             # For exclusive pools let scheduler set provisioned_capacity_gb to
             # allocated_capacity_gb, and for non exclusive query the value.
+            # Until the provisioned capacity is known it is left out as well.
             if not self.configuration.safe_get('rbd_exclusive_cinder_pool'):
                 total_gbi = self._get_usage_info()
-                stats['provisioned_capacity_gb'] = total_gbi
+                if total_gbi is not None:
+                    stats['provisioned_capacity_gb'] = total_gbi
         except self.rados.Error:
             # just log and return unknown capacities and let scheduler set
             # provisioned_capacity_gb = allocated_capacity_gb
@@ -580,6 +802,7 @@ class RBDDriver(driver.CloneableImageVD, driver.MigrateVD,
         if self.configuration.rbd_max_clone_depth <= 0:
             with RBDVolumeProxy(self, src_name, read_only=True) as vol:
                 vol.copy(vol.ioctx, dest_name)
+                self._usage.set(dest_name, int(src_vref.size) * units.Gi)
                 self._extend_if_required(volume, src_vref)
             return
 
@@ -599,6 +822,7 @@ class RBDDriver(driver.CloneableImageVD, driver.MigrateVD,
                 self.RBDProxy().clone(client.ioctx, src_name, clone_snap,
                                       client.ioctx, dest_name,
                                       features=client.features)
+                self._usage.set(dest_name, int(src_vref.size) * units.Gi)
             except Exception as e:
                 src_volume.unprotect_snap(clone_snap)
                 src_volume.remove_snap(clone_snap)
@@ -655,6 +879,7 @@ class RBDDriver(driver.CloneableImageVD, driver.MigrateVD,
                 volume_update = self._enable_replication_if_needed(volume)
             except Exception:
                 self.RBDProxy().remove(client.ioctx, dest_name)
+                self._usage.remove(dest_name)
                 src_volume.unprotect_snap(clone_snap)
                 src_volume.remove_snap(clone_snap)
                 err_msg = (_('Failed to enable image replication'))
@@ -773,6 +998,7 @@ class RBDDriver(driver.CloneableImageVD, driver.MigrateVD,
                    tmp_image.name, volume.name]
             cmd.extend(self._ceph_args())
             self._execute(*cmd)
+            self._usage.set(volume.name, int(volume.size) * units.Gi)
 
     def create_volume(self, volume):
         """Creates a logical volume."""
@@ -796,10 +1022,13 @@ class RBDDriver(driver.CloneableImageVD, driver.MigrateVD,
                                    old_format=False,
                                    features=client.features)
 
+            self._usage.set(vol_name, size)
+
             try:
                 volume_update = self._enable_replication_if_needed(volume)
             except Exception:
                 self.RBDProxy().remove(client.ioctx, vol_name)
+                self._usage.remove(vol_name)
                 err_msg = (_('Failed to enable image replication'))
                 raise exception.ReplicationError(reason=err_msg,
                                                  volume_id=volume.id)
@@ -829,11 +1058,14 @@ class RBDDriver(driver.CloneableImageVD, driver.MigrateVD,
                                       vol_name,
                                       features=src_client.features,
                                       order=order)
+            # Callers resize the clone to the size of the volume.
+            self._usage.set(vol_name, int(volume.size) * units.Gi)
 
             try:
                 volume_update = self._enable_replication_if_needed(volume)
             except Exception:
                 self.RBDProxy().remove(dest_client.ioctx, vol_name)
+                self._usage.remove(vol_name)
                 err_msg = (_('Failed to enable image replication'))
                 raise exception.ReplicationError(reason=err_msg,
                                                  volume_id=volume.id)
@@ -846,6 +1078,7 @@ class RBDDriver(driver.CloneableImageVD, driver.MigrateVD,
 
         with RBDVolumeProxy(self, volume.name) as vol:
             vol.resize(size)
+        self._usage.set(utils.convert_str(volume.name), size)
 
     def create_volume_from_snapshot(self, volume, snapshot):
         """Creates a volume from a snapshot."""
@@ -932,6 +1165,7 @@ class RBDDriver(driver.CloneableImageVD, driver.MigrateVD,
         if (not parent_has_snaps) and parent_name.endswith('.deleted'):
             LOG.debug("deleting parent %s", parent_name)
             self.RBDProxy().remove(client.ioctx, parent_name)
+            self._usage.remove(parent_name)
 
             # Now move up to grandparent if there is one
             if g_parent:
@@ -948,6 +1182,7 @@ class RBDDriver(driver.CloneableImageVD, driver.MigrateVD,
             except self.rbd.ImageNotFound:
                 LOG.info("volume %s no longer exists in backend",
                          volume_name)
+                self._usage.remove(volume_name)
                 return
 
             clone_snap = None
@@ -1000,7 +1235,9 @@ class RBDDriver(driver.CloneableImageVD, driver.MigrateVD,
                 except self.rbd.ImageNotFound:
                     LOG.info("RBD volume %s not found, allowing delete "
                              "operation to proceed.", volume_name)
+                    self._usage.remove(volume_name)
                     return
+                self._usage.remove(volume_name)
 
                 # If it is a clone, walk back up the parent chain deleting
                 # references.
@@ -1013,6 +1250,7 @@ class RBDDriver(driver.CloneableImageVD, driver.MigrateVD,
                 # will be deleted when it's snapshot and clones are deleted.
                 new_name = "%s.deleted" % (volume_name)
                 self.RBDProxy().rename(client.ioctx, volume_name, new_name)
+                self._usage.rename(volume_name, new_name)
 
     def create_snapshot(self, snapshot):
         """Creates an rbd snapshot."""
@@ -1207,6 +1445,8 @@ class RBDDriver(driver.CloneableImageVD, driver.MigrateVD,
                    for volume, is_demoted in zip(volumes, demotion_results)]
         self._active_backend_id = secondary_id
         self._active_config = remote
+        # Don't keep connections to the cluster we've failed over from.
+        self._rados_pool.close_all()
         LOG.info('RBD driver failover completed.')
         return secondary_id, updates, []
 
@@ -1214,6 +1454,10 @@ class RBDDriver(driver.CloneableImageVD, driver.MigrateVD,
         """Synchronously recreates an export for a logical volume."""
         pass
 
+    def ensure_exports(self, context, volumes):
+        """RBD volumes are not exported, so there is nothing to do."""
+        return {}
+
     def create_export(self, context, volume, connector):
         """Exports the volume."""
         pass
@@ -1468,6 +1712,8 @@ class RBDDriver(driver.CloneableImageVD, driver.MigrateVD,
             self.RBDProxy().rename(client.ioctx,
                                    utils.convert_str(rbd_name),
                                    utils.convert_str(volume.name))
+            self._usage.rename(utils.convert_str(rbd_name),
+                               utils.convert_str(volume.name))
 
     def manage_existing_get_size(self, volume, existing_ref):
         """Return size of an existing image for manage_existing.
@@ -1595,6 +1841,9 @@ class RBDDriver(driver.CloneableImageVD, driver.MigrateVD,
                 # one from the new volume as well.
                 name_id = new_volume._name_id or new_volume.id
                 provider_location = new_volume['provider_location']
+            else:
+                self._usage.rename(utils.convert_str(existing_name),
+                                   utils.convert_str(wanted_name))
         return {'_name_id': name_id, 'provider_location': provider_location}
 
     def migrate_volume(self, context, volume, host):
@@ -728,7 +728,7 @@ class VolumeCastTask(flow_utils.CinderTask):
     created volume.
     """
 
-    def __init__(self, scheduler_rpcapi, volume_rpcapi, db):
+    def __init__(self, scheduler_rpcapi, volume_rpcapi, db, batch=None):
         requires = ['image_id', 'scheduler_hints', 'snapshot_id',
                     'source_volid', 'volume_id', 'volume', 'volume_type',
                     'volume_properties', 'consistencygroup_id',
@@ -738,6 +738,8 @@ class VolumeCastTask(flow_utils.CinderTask):
         self.volume_rpcapi = volume_rpcapi
         self.scheduler_rpcapi = scheduler_rpcapi
         self.db = db
+        # When given, requests are collected here to be cast as a batch
+        self.batch = batch
 
     def _cast_create_volume(self, context, request_spec, filter_properties):
         source_volid = request_spec['source_volid']
@@ -775,6 +777,10 @@ class VolumeCastTask(flow_utils.CinderTask):
             source_volume_ref = objects.Volume.get_by_id(context, source_volid)
             request_spec['resource_backend'] = source_volume_ref.host
 
+        if self.batch is not None:
+            self.batch.append((volume, request_spec, filter_properties))
+            return
+
         self.scheduler_rpcapi.create_volume(
             context,
             volume,
@@ -813,7 +819,7 @@ class VolumeCastTask(flow_utils.CinderTask):
 
 
 def get_flow(db_api, image_service_api, availability_zones, create_what,
-             scheduler_rpcapi=None, volume_rpcapi=None):
+             scheduler_rpcapi=None, volume_rpcapi=None, batch=None):
     """Constructs and returns the api entrypoint flow.
 
     This flow will do the following:
@@ -842,7 +848,8 @@ def get_flow(db_api, image_service_api, availability_zones, create_what,
     if scheduler_rpcapi and volume_rpcapi:
         # This will cast it out to either the scheduler or volume manager via
         # the rpc apis provided.
-        api_flow.add(VolumeCastTask(scheduler_rpcapi, volume_rpcapi, db_api))
+        api_flow.add(VolumeCastTask(scheduler_rpcapi, volume_rpcapi, db_api,
+                                    batch))
 
     # Now load (but do not run) the flow using the provided initial data.
     return taskflow.engines.load(api_flow, store=create_what)
@@ -721,26 +721,33 @@ class CreateVolumeFromSpecTask(flow_utils.CinderTask):
     def _create_from_image_cache_or_download(self, context, volume,
                                              image_location, image_id,
                                              image_meta, image_service):
+        # Raw images are written straight to the volume as they are
+        # downloaded, without going through image_conversion_dir, if the
+        # driver fetches them to a raw volume.
+        stream_image = (self.driver.STREAMS_RAW_IMAGES and
+                        image_utils.is_streamable_raw_image(image_meta))
+
         # NOTE(e0ne): check for free space in image_conversion_dir before
         # image downloading.
         # NOTE(mnaser): This check *only* happens if the backend is not able
         #               to clone volumes and we have to resort to downloading
         #               the image from Glance and uploading it.
-        if (CONF.image_conversion_dir and not
-                os.path.exists(CONF.image_conversion_dir)):
-            os.makedirs(CONF.image_conversion_dir)
-        try:
-            image_utils.check_available_space(
-                CONF.image_conversion_dir,
-                image_meta['size'], image_id)
-        except exception.ImageTooBig as err:
-            with excutils.save_and_reraise_exception():
-                self.message.create(
-                    context,
-                    message_field.Action.COPY_IMAGE_TO_VOLUME,
-                    resource_uuid=volume.id,
-                    detail=message_field.Detail.NOT_ENOUGH_SPACE_FOR_IMAGE,
-                    exception=err)
+        if not stream_image:
+            if (CONF.image_conversion_dir and not
+                    os.path.exists(CONF.image_conversion_dir)):
+                os.makedirs(CONF.image_conversion_dir)
+            try:
+                image_utils.check_available_space(
+                    CONF.image_conversion_dir,
+                    image_meta['size'], image_id)
+            except exception.ImageTooBig as err:
+                with excutils.save_and_reraise_exception():
+                    self.message.create(
+                        context,
+                        message_field.Action.COPY_IMAGE_TO_VOLUME,
+                        resource_uuid=volume.id,
+                        detail=message_field.Detail.NOT_ENOUGH_SPACE_FOR_IMAGE,
+                        exception=err)
 
         # Try and use the image cache.
         should_create_cache_entry = False
@@ -771,31 +778,35 @@ class CreateVolumeFromSpecTask(flow_utils.CinderTask):
         # download the image data and copy it into the volume.
         original_size = volume.size
         backend_name = volume_utils.extract_host(volume.service_topic_queue)
+
+        def _download(image_virtual_size):
+            # Try to create the volume as the minimal size, then we can
+            # extend once the image has been downloaded.
+            virtual_size = image_utils.check_virtual_size(
+                image_virtual_size, volume.size, image_id)
+
+            if should_create_cache_entry:
+                if virtual_size and virtual_size != original_size:
+                    volume.size = virtual_size
+                    volume.save()
+            return self._create_from_image_download(context,
+                                                    volume,
+                                                    image_location,
+                                                    image_meta,
+                                                    image_service)
+
         try:
             if not cloned:
                 try:
-                    with image_utils.TemporaryImages.fetch(
-                            image_service, context, image_id,
-                            backend_name) as tmp_image:
-                        # Try to create the volume as the minimal size,
-                        # then we can extend once the image has been
-                        # downloaded.
-                        data = image_utils.qemu_img_info(tmp_image)
-
-                        virtual_size = image_utils.check_virtual_size(
-                            data.virtual_size, volume.size, image_id)
-
-                        if should_create_cache_entry:
-                            if virtual_size and virtual_size != original_size:
-                                    volume.size = virtual_size
-                                    volume.save()
-                        model_update = self._create_from_image_download(
-                            context,
-                            volume,
-                            image_location,
-                            image_meta,
-                            image_service
-                        )
+                    if stream_image:
+                        # The virtual size of raw images is their size
+                        model_update = _download(image_meta['size'])
+                    else:
+                        with image_utils.TemporaryImages.fetch(
+                                image_service, context, image_id,
+                                backend_name) as tmp_image:
+                            data = image_utils.qemu_img_info(tmp_image)
+                            model_update = _download(data.virtual_size)
                 except exception.ImageTooBig as e:
                     with excutils.save_and_reraise_exception():
                         self.message.create(
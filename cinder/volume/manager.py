@@ -40,6 +40,7 @@ import requests
 import time
 
 from castellan import key_manager
+import eventlet
 from oslo_config import cfg
 from oslo_log import log as logging
 import oslo_messaging as messaging
@@ -451,21 +452,17 @@ class VolumeManager(manager.CleanableManager,
         self.stats.update({'allocated_capacity_gb': 0})
 
         try:
+            in_use_volumes = []
             for volume in volumes:
                 # available volume should also be counted into allocated
                 if volume['status'] in ['in-use', 'available']:
                     # calculate allocated capacity for driver
                     self._count_allocated_capacity(ctxt, volume)
 
-                    try:
-                        if volume['status'] in ['in-use']:
-                            self.driver.ensure_export(ctxt, volume)
-                    except Exception:
-                        LOG.exception("Failed to re-export volume, "
-                                      "setting to ERROR.",
-                                      resource=volume)
-                        volume.conditional_update({'status': 'error'},
-                                                  {'status': 'in-use'})
+                    if volume['status'] in ['in-use']:
+                        in_use_volumes.append(volume)
+
+            self._ensure_exports(ctxt, in_use_volumes)
             # All other cleanups are processed by parent class CleanableManager
 
         except Exception:
@@ -474,6 +471,7 @@ class VolumeManager(manager.CleanableManager,
             return
 
         self.driver.set_throttle()
+        self.driver.set_image_conversion_tuning()
 
         # at this point the driver is considered initialized.
         # NOTE(jdg): Careful though because that doesn't mean
@@ -498,6 +496,59 @@ class VolumeManager(manager.CleanableManager,
         super(VolumeManager, self).init_host(added_to_cluster=added_to_cluster,
                                              **kwargs)
 
+    def _ensure_exports(self, ctxt, volumes):
+        """Re-export volumes, setting the ones that fail to ERROR."""
+        if not volumes:
+            return
+
+        LOG.info('Re-exporting %d volumes.', len(volumes))
+        start_time = time.time()
+        try:
+            failures = self.driver.ensure_exports(ctxt, volumes)
+        except NotImplementedError:
+            failures = self._ensure_exports_generic(ctxt, volumes)
+        except Exception:
+            # A failed batch must not leave the driver uninitialized, give
+            # each volume a chance on its own instead.
+            LOG.exception("Failed to re-export volumes in bulk, "
+                          "re-exporting them one by one.")
+            failures = self._ensure_exports_generic(ctxt, volumes)
+
+        for volume in volumes:
+            if volume.id in failures:
+                volume.conditional_update({'status': 'error'},
+                                          {'status': 'in-use'})
+        LOG.info('Re-exported %(total)d volumes, %(failed)d failed, in '
+                 '%(time).2f seconds.',
+                 {'total': len(volumes), 'failed': len(failures),
+                  'time': time.time() - start_time})
+
+    def _ensure_exports_generic(self, ctxt, volumes):
+        """Call ensure_export for each volume, concurrently if possible."""
+        def _ensure_export(volume):
+            try:
+                self.driver.ensure_export(ctxt, volume)
+            except Exception as exc:
+                LOG.exception("Failed to re-export volume, "
+                              "setting to ERROR.",
+                              resource=volume)
+                return exc
+
+        failures = {}
+        total = len(volumes)
+        # Log the progress every 10%
+        progress_step = max(1, total // 10)
+        pool = eventlet.GreenPool(
+            max(1, self.driver.ENSURE_EXPORT_CONCURRENCY))
+        results = six.moves.zip(volumes, pool.imap(_ensure_export, volumes))
+        for done, (volume, error) in enumerate(results, 1):
+            if error is not None:
+                failures[volume.id] = error
+            if done % progress_step == 0 and done < total:
+                LOG.info('Re-exported %(done)d of %(total)d volumes.',
+                         {'done': done, 'total': total})
+        return failures
+
     def init_host_with_rpc(self):
         LOG.info("Initializing RPC dependent components of volume "
                  "driver %(driver_name)s (%(version)s)",
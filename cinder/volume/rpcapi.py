@@ -133,9 +133,10 @@ class VolumeAPI(rpc.RPCAPI):
         3.14 - Adds enable_replication, disable_replication,
                failover_replication, and list_replication_targets.
         3.15 - Add revert_to_snapshot method
+        3.16 - Add request_full_capabilities method
     """
 
-    RPC_API_VERSION = '3.15'
+    RPC_API_VERSION = '3.16'
     RPC_DEFAULT_VERSION = '3.0'
     TOPIC = constants.VOLUME_TOPIC
     BINARY = constants.VOLUME_BINARY
@@ -238,6 +239,11 @@ class VolumeAPI(rpc.RPCAPI):
         cctxt = self._get_cctxt(fanout=True)
         cctxt.cast(ctxt, 'publish_service_capabilities')
 
+    @rpc.assert_min_rpc_version('3.16')
+    def request_full_capabilities(self, ctxt, host):
+        cctxt = self._get_cctxt(host, '3.16')
+        cctxt.cast(ctxt, 'request_full_capabilities')
+
     def accept_transfer(self, ctxt, volume, new_user, new_project):
         cctxt = self._get_cctxt(volume.service_topic_queue)
         return cctxt.call(ctxt, 'accept_transfer', volume_id=volume['id'],
@@ -16,12 +16,19 @@
 
 
 import ast
+import collections
+import ctypes
+import ctypes.util
+import errno
 import functools
 import json
 import math
 import operator
+import os
 from os import urandom
 import re
+import stat
+import sys
 import time
 import uuid
 
@@ -416,6 +423,27 @@ def _check_blocksize(blocksize):
     return blocksize
 
 
+# Block devices and file systems known to support O_DIRECT
+ODIRECT_SUPPORT = set()
+
+
+def _get_odirect_support_key(path, flag):
+    """Return what O_DIRECT support of path depends on, if known.
+
+    It depends on the device for block devices, and on the file system
+    holding them for files.
+    """
+    try:
+        path_stat = os.stat(path)
+    except OSError:
+        return None
+    if stat.S_ISBLK(path_stat.st_mode):
+        return (flag, 'blk', path_stat.st_rdev)
+    if stat.S_ISREG(path_stat.st_mode):
+        return (flag, 'fs', path_stat.st_dev)
+    return None
+
+
 def check_for_odirect_support(src, dest, flag='oflag=direct'):
 
     # Check whether O_DIRECT is supported
@@ -425,9 +453,17 @@ def check_for_odirect_support(src, dest, flag='oflag=direct'):
         if (src == '/dev/zero' and flag == 'iflag=direct'):
             return False
         else:
+            # Only successful probes are cached, in case a failure was
+            # not caused by O_DIRECT.
+            key = _get_odirect_support_key(
+                src if flag == 'iflag=direct' else dest, flag)
+            if key is not None and key in ODIRECT_SUPPORT:
+                return True
             utils.execute('dd', 'count=0', 'if=%s' % src,
                           'of=%s' % dest,
                           flag, run_as_root=True)
+            if key is not None:
+                ODIRECT_SUPPORT.add(key)
             return True
     except processutils.ProcessExecutionError:
         return False
@@ -562,6 +598,67 @@ def _copy_volume_with_file(src, dest, size_in_m):
              {'size_in_m': size_in_m, 'mbps': mbps})
 
 
+_FALLOC_FL_KEEP_SIZE = 0x01
+_FALLOC_FL_PUNCH_HOLE = 0x02
+_libc = None
+
+
+def _get_libc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    return _libc
+
+
+def punch_hole(handle, offset, length):
+    """Deallocate a range of a file or block device.
+
+    The range reads back as zeroes afterwards, but no data has to be
+    written: regular files get a hole and block devices get the range
+    zeroed out by the storage, usually with a discard.
+
+    Returns False when the range could not be punched, for example because
+    the file system or device does not support it, in which case the caller
+    has to write the zeroes itself.
+    """
+    if not sys.platform.startswith('linux'):
+        return False
+    try:
+        fileno = handle.fileno()
+    except (AttributeError, IOError, ValueError):
+        return False
+
+    try:
+        fallocate = _get_libc().fallocate
+    except (AttributeError, OSError):
+        return False
+    fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_longlong,
+                          ctypes.c_longlong]
+
+    def _punch():
+        # errno is per native thread, so it has to be read in the same one.
+        if fallocate(fileno, _FALLOC_FL_PUNCH_HOLE | _FALLOC_FL_KEEP_SIZE,
+                     offset, length):
+            return ctypes.get_errno()
+        # Holes punched past the end of a regular file don't grow it.
+        file_stat = os.fstat(fileno)
+        if (stat.S_ISREG(file_stat.st_mode) and
+                file_stat.st_size < offset + length):
+            os.ftruncate(fileno, offset + length)
+        return 0
+
+    # Buffered data must not land on the range once it has been punched.
+    handle.flush()
+    err = tpool.execute(_punch)
+    if err:
+        LOG.debug('Could not punch a hole of %(length)s bytes at offset '
+                  '%(offset)s: %(error)s',
+                  {'length': length, 'offset': offset,
+                   'error': errno.errorcode.get(err, err)})
+        return False
+    return True
+
+
 def copy_volume(src, dest, size_in_m, blocksize, sync=False,
                 execute=utils.execute, ionice=None, throttle=None,
                 sparse=False):
@@ -1011,3 +1108,75 @@ def get_max_over_subscription_ratio(str_value, supports_auto=False):
         LOG.error(msg)
         raise exception.InvalidParameterValue(message=msg)
     return mosr
+
+
+def _dict_delta(old, new):
+    updated = {key: value for key, value in new.items()
+               if key not in old or old[key] != value}
+    removed = [key for key in old if key not in new]
+    return updated, removed
+
+
+def _pools_by_name(capabilities):
+    pools = capabilities.get('pools') or []
+    names = [pool.get('pool_name') for pool in pools]
+    if None in names or len(set(names)) != len(names):
+        return None
+    return collections.OrderedDict(six.moves.zip(names, pools))
+
+
+def get_capabilities_delta(old, new):
+    """Return the changes between two capability reports of a backend.
+
+    The delta has the top level keys that were updated and removed, and for
+    each pool (identified by its pool_name) the fields that were updated and
+    removed.  Returns None when a delta cannot represent the change, for
+    example when pools have no name, and the full report must be sent.
+    """
+    if ('pools' in old) != ('pools' in new):
+        return None
+
+    updated, removed = _dict_delta(
+        {k: v for k, v in old.items() if k != 'pools'},
+        {k: v for k, v in new.items() if k != 'pools'})
+    delta = {'updated': updated, 'removed': removed}
+
+    if 'pools' in new:
+        old_pools = _pools_by_name(old)
+        new_pools = _pools_by_name(new)
+        if old_pools is None or new_pools is None:
+            return None
+        pools = {}
+        for name, pool in new_pools.items():
+            pool_updated, pool_removed = _dict_delta(old_pools.get(name, {}),
+                                                     pool)
+            if pool_updated or pool_removed:
+                pools[name] = {'updated': pool_updated,
+                               'removed': pool_removed}
+        delta['pools'] = pools
+        delta['removed_pools'] = [name for name in old_pools
+                                  if name not in new_pools]
+    return delta
+
+
+def apply_capabilities_delta(capabilities, delta):
+    """Return the capabilities resulting from applying a delta to them."""
+    result = dict(capabilities)
+    result.update(delta['updated'])
+    for key in delta['removed']:
+        result.pop(key, None)
+
+    if 'pools' in delta:
+        pools = _pools_by_name(capabilities)
+        if pools is None:
+            pools = collections.OrderedDict()
+        for name in delta['removed_pools']:
+            pools.pop(name, None)
+        for name, change in delta['pools'].items():
+            pool = dict(pools.get(name, {}))
+            pool.update(change['updated'])
+            for key in change['removed']:
+                pool.pop(key, None)
+            pools[name] = pool
+        result['pools'] = list(pools.values())
+    return result